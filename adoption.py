@@ -0,0 +1,98 @@
+from flask import current_app
+
+from cache import invalidate
+from db import get_db, run_immediate
+from writebehind import get_writer, submit_write
+
+# A pet is 'available' until an adoption row points at it. adopt() flips the
+# status itself, inside the same transaction as the insert; the triggers keep
+# it right for adoptions written any other way (API, import, deletes).
+SCHEMA = [
+    "ALTER TABLE pets ADD COLUMN Status TEXT NOT NULL DEFAULT 'available'",
+    "UPDATE pets SET Status = 'adopted' WHERE PetID IN (SELECT PetID FROM adoptions)",
+    "CREATE INDEX IF NOT EXISTS idx_pets_status ON pets(Status, PetID)",
+    '''CREATE TRIGGER IF NOT EXISTS adoption_status_insert AFTER INSERT ON adoptions BEGIN
+        UPDATE pets SET Status = 'adopted' WHERE PetID = NEW.PetID AND Status <> 'adopted';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS adoption_status_delete AFTER DELETE ON adoptions BEGIN
+        UPDATE pets SET Status = 'available' WHERE PetID = OLD.PetID
+            AND NOT EXISTS (SELECT 1 FROM adoptions WHERE PetID = OLD.PetID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS adoption_status_update AFTER UPDATE OF PetID ON adoptions BEGIN
+        UPDATE pets SET Status = 'available' WHERE PetID = OLD.PetID
+            AND NOT EXISTS (SELECT 1 FROM adoptions WHERE PetID = OLD.PetID);
+        UPDATE pets SET Status = 'adopted' WHERE PetID = NEW.PetID AND Status <> 'adopted';
+    END''',
+]
+
+
+class PetUnavailable(Exception):
+    """The pet does not exist or has already been adopted."""
+
+
+def claim_pet(conn, pet_id):
+    # Marks the pet adopted, or raises PetUnavailable when it is not there to
+    # be claimed; run inside the write transaction that records the adoption.
+    claimed = conn.execute("UPDATE pets SET Status = 'adopted' WHERE PetID = ? AND Status = 'available' AND DeletedAt IS NULL",
+                           (pet_id,)).rowcount
+    if not claimed:
+        raise PetUnavailable('Pet %s is not available for adoption' % pet_id)
+
+
+def adoption_work(pet_id, adopter_id, adoption_date, amount=None, payment_date=None):
+    # Claim the pet, record the adoption and, when an amount is given, its
+    # payment. Returns work(conn) -> (adoption id, payment id), to be run
+    # inside a write transaction.
+    def work(conn):
+        claim_pet(conn, pet_id)
+        adoption_id = conn.execute("INSERT INTO adoptions (PetID, AdopterID, AdoptionDate) VALUES (?, ?, ?)",
+                                   (pet_id, adopter_id, adoption_date)).lastrowid
+        payment_id = None
+        if amount is not None:
+            payment_id = conn.execute("INSERT INTO payments (AdoptionID, Amount, PaymentDate) VALUES (?, ?, ?)",
+                                      (adoption_id, amount, payment_date or adoption_date)).lastrowid
+        return adoption_id, payment_id
+    return work
+
+
+def adopt_and_pay(conn, pet_id, adopter_id, adoption_date, amount=None, payment_date=None,
+                  retries=5, backoff=0.01):
+    # The adoption as one BEGIN IMMEDIATE transaction of its own.
+    # Returns (adoption id, payment id, attempts).
+    work = adoption_work(pet_id, adopter_id, adoption_date, amount, payment_date)
+    (adoption_id, payment_id), attempts = run_immediate(conn, work, retries, backoff)
+    return adoption_id, payment_id, attempts
+
+
+def adopt(pet_id, adopter_id, adoption_date, amount=None, payment_date=None):
+    # adopt_and_pay() on the request's connection, or through the write-behind
+    # queue when it is on, with the page cache and metrics brought up to date.
+    # Returns (adoption id, payment id); both are None when the write-behind
+    # queue acknowledges on enqueue.
+    config = current_app.config
+    metrics = current_app.extensions.get('metrics')
+    attempts = 1
+    try:
+        if get_writer() is not None:
+            work = adoption_work(pet_id, adopter_id, adoption_date, amount, payment_date)
+            adoption_id, payment_id = submit_write(work, ('pets', 'adoptions', 'payments')) or (None, None)
+        else:
+            adoption_id, payment_id, attempts = adopt_and_pay(
+                get_db(), pet_id, adopter_id, adoption_date, amount, payment_date,
+                retries=config['ADOPT_RETRIES'], backoff=config['ADOPT_BACKOFF'])
+    except PetUnavailable:
+        if metrics is not None:
+            metrics.inc('adoptions_total', result='unavailable')
+        raise
+    if metrics is not None and adoption_id is None:
+        metrics.inc('adoptions_total', result='queued')
+    elif metrics is not None:
+        metrics.inc('adoptions_total', result='adopted')
+        metrics.inc('adoption_attempts_total', attempts)
+    invalidate('pets', 'adoptions', 'payments')
+    return adoption_id, payment_id
+
+
+def init_app(app):
+    app.config.setdefault('ADOPT_RETRIES', 5)
+    app.config.setdefault('ADOPT_BACKOFF', 0.01)
@@ -0,0 +1,302 @@
+import datetime
+import sqlite3
+import zlib
+
+from flask import Blueprint, Response, jsonify, request, url_for
+
+from adoption import PetUnavailable, adopt, claim_pet
+from cache import invalidate
+from db import DatabaseBusy, get_db, run_immediate
+from importer import IMPORTS, clean_record, clean_value
+from listing import LISTINGS, archive_scope, build_query, encode_cursor, page_limit, total_rows
+from matching import match_limit, pending_changes, top_matches
+from schema import NOW
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+RESOURCES = 'any(pets, adopters, adoptions, payments)'
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+@bp.errorhandler(ApiError)
+def api_error(e):
+    return jsonify(error=str(e)), e.status
+
+
+@bp.errorhandler(sqlite3.IntegrityError)
+@bp.errorhandler(PetUnavailable)
+def integrity_error(e):
+    return jsonify(error=str(e)), 409
+
+
+@bp.errorhandler(DatabaseBusy)
+def database_busy(e):
+    return jsonify(error=str(e)), 503, {'Retry-After': '1'}
+
+
+# ---------- HELPERS ----------
+def parse_timestamp(value):
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ').replace(
+        tzinfo=datetime.timezone.utc, microsecond=0)
+
+
+def requested_fields(table, names):
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    fields = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in names]
+    if unknown:
+        raise ApiError('unknown fields: %s' % ', '.join(unknown))
+    return fields
+
+
+def to_item(names, row, fields):
+    item = dict(zip(names, row))
+    if fields:
+        item = {f: item[f] for f in fields}
+    return item
+
+
+def not_modified(etag, last_modified):
+    # Answer conditional GETs before touching the rows themselves. The
+    # comparison is weak: compressed responses carry the weakened tag.
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+
+def fetch_item(table, key, scope_all=False):
+    # Soft-deleted rows are gone as far as the API is concerned; archived
+    # ones are readable with ?scope=all.
+    spec = LISTINGS[table]
+    sql = 'SELECT * FROM %s WHERE %s=?' % (spec['archive'] if scope_all else table, spec['key'])
+    if spec.get('soft_delete'):
+        sql += ' AND DeletedAt IS NULL'
+    c = get_db().execute(sql, (key,))
+    row = c.fetchone()
+    if row is None:
+        raise ApiError('%s %s not found' % (table, key), 404)
+    return [d[0] for d in c.description], row
+
+
+def item_etag(names, row):
+    # The row version, plus a hash of ?fields= when only some are returned.
+    etag = str(row[names.index('RowVersion')])
+    if request.args.get('fields'):
+        etag += '-%x' % zlib.crc32(request.args['fields'].encode())
+    return etag
+
+
+def item_response(table, names, row, status=200):
+    fields = requested_fields(table, names)
+    etag = item_etag(names, row)
+    response = jsonify(to_item(names, row, fields))
+    response.status_code = status
+    return with_validators(response, etag, parse_timestamp(row[names.index('UpdatedAt')]))
+
+
+def check_if_match(names, row):
+    # Writes with If-Match only go through against the version the client saw,
+    # whichever field selection (or content encoding) that ETag was issued for.
+    # Returns that version for the write itself to check (see write_row), or
+    # None when the request has no precondition.
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    version = row[names.index('RowVersion')]
+    if not any(tag.split('-')[0] == str(version) for tag in request.if_match.as_set(include_weak=True)):
+        raise ApiError('precondition failed', 412)
+    return version
+
+
+def write_row(conn, table, sql, params, key, version):
+    # Runs an UPDATE or DELETE against one row. With a version, the write only
+    # matches the row while it is still at that version, so another write
+    # landing between check_if_match and this one fails the precondition
+    # instead of being overwritten.
+    sql += ' WHERE %s=?' % LISTINGS[table]['key']
+    params = list(params) + [key]
+    if version is not None:
+        sql += ' AND RowVersion=?'
+        params.append(version)
+    if conn.execute(sql, params).rowcount or version is None:
+        return
+    conn.rollback()
+    fetch_item(table, key)
+    raise ApiError('precondition failed', 412)
+
+
+def request_record():
+    record = request.get_json(silent=True)
+    if not isinstance(record, dict):
+        raise ApiError('expected a JSON object body')
+    return record
+
+
+def validated(table, record):
+    try:
+        return clean_record(table, record)
+    except ValueError as e:
+        raise ApiError(str(e))
+
+
+# ---------- ROUTES ----------
+@bp.route('/<%s:table>' % RESOURCES, methods=['GET'])
+def list_items(table):
+    # Any write to the table bumps its version, so the version plus the query
+    # string identifies the page without running the query.
+    version, modified = get_db().execute(
+        "SELECT Version, ModifiedAt FROM row_counts WHERE TableName=?", (table,)).fetchone()
+    etag = '%s-%x' % (version, zlib.crc32(request.query_string))
+    last_modified = parse_timestamp(modified)
+    if not_modified(etag, last_modified):
+        return with_validators(Response(status=304), etag, last_modified)
+
+    spec = LISTINGS[table]
+    limit = page_limit(request.args)
+    sql, params, sort = build_query(table, request.args)
+    c = get_db().execute(sql + ' LIMIT ?', params + [limit + 1])
+    names = [d[0] for d in c.description]
+    fields = requested_fields(table, names)
+    rows = c.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][names.index(sort)], rows[-1][names.index(spec['key'])]])
+    body = {
+        'items': [to_item(names, row, fields) for row in rows],
+        'next_cursor': next_cursor,
+        'total': total_rows(table, archive_scope(table, request.args)),
+    }
+    return with_validators(jsonify(body), etag, last_modified)
+
+
+@bp.route('/<%s:table>/<key>' % RESOURCES, methods=['GET'])
+def get_item(table, key):
+    names, row = fetch_item(table, key, archive_scope(table, request.args))
+    etag = item_etag(names, row)
+    last_modified = parse_timestamp(row[names.index('UpdatedAt')])
+    if not_modified(etag, last_modified):
+        return with_validators(Response(status=304), etag, last_modified)
+    return item_response(table, names, row)
+
+
+@bp.route('/<any(pets, adopters):table>/<key>/matches', methods=['GET'])
+def list_matches(table, key):
+    # Best candidates from the match index: adopters for a pet, pets for
+    # an adopter.
+    fetch_item(table, key)
+    conn = get_db()
+    c = top_matches(conn, 'pet' if table == 'pets' else 'adopter', key, match_limit())
+    names = [d[0] for d in c.description]
+    return jsonify(items=[dict(zip(names, row)) for row in c.fetchall()], pending=pending_changes(conn))
+
+
+@bp.route('/<%s:table>' % RESOURCES, methods=['POST'])
+def create_item(table):
+    if table == 'adoptions':
+        # An insert here would skip the claim on the pet.
+        raise ApiError('adoptions are created with POST %s' % url_for('api.adopt_item'), 405)
+    values = validated(table, request_record())
+    columns = [name for name, _ in IMPORTS[table]]
+    conn = get_db()
+    c = conn.execute('INSERT INTO %s (%s) VALUES (%s)' % (
+        table, ', '.join(columns), ', '.join('?' * len(columns))), values)
+    conn.commit()
+    invalidate(table)
+    key = values[0] if values[0] is not None else c.lastrowid
+    names, row = fetch_item(table, key)
+    response = item_response(table, names, row, status=201)
+    response.headers['Location'] = url_for('api.get_item', table=table, key=key)
+    return response
+
+
+@bp.route('/adopt', methods=['POST'])
+def adopt_item():
+    # {"PetID", "AdopterID", "AdoptionDate"} plus optional "Amount" and
+    # "PaymentDate": the adoption and its payment in one transaction.
+    record = request_record()
+
+    def field(name, kind, required=True):
+        if not required and record.get(name) in (None, ''):
+            return None
+        try:
+            return clean_value(name, kind, record.get(name))
+        except (TypeError, ValueError) as e:
+            raise ApiError('%s: %s' % (name, e))
+
+    pet_id = field('PetID', 'text')
+    adopter_id = field('AdopterID', 'text')
+    adoption_date = field('AdoptionDate', 'date')
+    amount = field('Amount', 'real', required=False)
+    payment_date = field('PaymentDate', 'date', required=False)
+    adoption_id, payment_id = adopt(pet_id, adopter_id, adoption_date, amount, payment_date)
+    if adoption_id is None:
+        # Write-behind acknowledged on enqueue: accepted, not yet committed.
+        return jsonify(status='queued'), 202
+    names, row = fetch_item('adoptions', adoption_id)
+    response = item_response('adoptions', names, row, status=201)
+    response.headers['Location'] = url_for('api.get_item', table='adoptions', key=adoption_id)
+    if payment_id is not None:
+        response.headers['Link'] = '<%s>; rel="payment"' % url_for('api.get_item', table='payments', key=payment_id)
+    return response
+
+
+@bp.route('/<%s:table>/<key>' % RESOURCES, methods=['PUT'])
+def update_item(table, key):
+    names, row = fetch_item(table, key)
+    version = check_if_match(names, row)
+    record = dict(request_record())
+    record[LISTINGS[table]['key']] = key
+    values = validated(table, record)
+    columns = [name for name, _ in IMPORTS[table]]
+    assignments = ', '.join('%s=?' % name for name in columns[1:])
+    sql = 'UPDATE %s SET %s' % (table, assignments)
+    conn = get_db()
+    if table == 'adoptions' and values[1] != row[names.index('PetID')]:
+        # Moving an adoption to another pet claims that pet first, in the
+        # same transaction; the trigger frees the old one.
+        def work(conn):
+            claim_pet(conn, values[1])
+            write_row(conn, table, sql, values[1:], key, version)
+        run_immediate(conn, work)
+    else:
+        write_row(conn, table, sql, values[1:], key, version)
+        conn.commit()
+    invalidate(table)
+    names, row = fetch_item(table, key)
+    return item_response(table, names, row)
+
+
+@bp.route('/<%s:table>/<key>' % RESOURCES, methods=['DELETE'])
+def delete_item(table, key):
+    names, row = fetch_item(table, key)
+    version = check_if_match(names, row)
+    conn = get_db()
+    if LISTINGS[table].get('soft_delete'):
+        write_row(conn, table, 'UPDATE %s SET DeletedAt = %s' % (table, NOW), (), key, version)
+    else:
+        write_row(conn, table, 'DELETE FROM %s' % table, (), key, version)
+    conn.commit()
+    invalidate(table)
+    return '', 204
+
+
+def init_app(app):
+    app.register_blueprint(bp)
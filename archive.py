@@ -0,0 +1,243 @@
+import datetime
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from db import get_db, run_immediate
+
+# Closed adoptions (and their payments) older than the cutoff are moved out of
+# the hot database into an archive database (PET_ADOPTION_ARCHIVE_DB) ATTACHed
+# to every pooled connection, so the hot tables and their indexes stay small enough to live
+# in the page cache. The list pages read hot rows only unless asked for
+# ?scope=all, which reads the all_adoptions/all_payments views over both.
+COLUMNS = {
+    'adoptions': ('AdoptionID', 'PetID', 'AdopterID', 'AdoptionDate', 'RowVersion', 'UpdatedAt'),
+    'payments': ('PaymentID', 'AdoptionID', 'Amount', 'PaymentDate', 'RowVersion', 'UpdatedAt'),
+}
+
+# Created in the archive database when it is attached.
+ARCHIVE_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS archive.adoptions (
+        AdoptionID INTEGER PRIMARY KEY,
+        PetID TEXT NOT NULL,
+        AdopterID TEXT NOT NULL,
+        AdoptionDate TEXT NOT NULL,
+        RowVersion INTEGER NOT NULL,
+        UpdatedAt TEXT,
+        ArchivedAt TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+    )''',
+    "CREATE INDEX IF NOT EXISTS archive.idx_adoptions_pet ON adoptions(PetID)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_adoptions_adopter ON adoptions(AdopterID)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_adoptions_date ON adoptions(AdoptionDate)",
+    '''CREATE TABLE IF NOT EXISTS archive.payments (
+        PaymentID INTEGER PRIMARY KEY,
+        AdoptionID INTEGER NOT NULL,
+        Amount REAL NOT NULL,
+        PaymentDate TEXT NOT NULL,
+        RowVersion INTEGER NOT NULL,
+        UpdatedAt TEXT,
+        ArchivedAt TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+    )''',
+    "CREATE INDEX IF NOT EXISTS archive.idx_payments_adoption ON payments(AdoptionID)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_payments_date ON payments(PaymentDate)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_payments_amount ON payments(Amount)",
+    '''CREATE TABLE IF NOT EXISTS archive.archive_counts (
+        TableName TEXT PRIMARY KEY,
+        Total INTEGER NOT NULL
+    )''',
+    "INSERT OR IGNORE INTO archive.archive_counts (TableName, Total) VALUES ('adoptions', 0), ('payments', 0)",
+]
+
+
+def view_statement(table):
+    # Hot rows plus archived ones. A row is only ever in both for the moment
+    # between the two halves of a move (or after a crash there); the hot copy
+    # wins. Both halves are read in key order, so keyset pages stay index
+    # range scans merged by the UNION ALL.
+    key = COLUMNS[table][0]
+    columns = ', '.join(COLUMNS[table])
+    return '''CREATE TEMP VIEW IF NOT EXISTS all_%(t)s AS
+        SELECT %(c)s FROM main.%(t)s
+        UNION ALL
+        SELECT %(c)s FROM archive.%(t)s a WHERE NOT EXISTS (SELECT 1 FROM main.%(t)s h WHERE h.%(k)s = a.%(k)s)''' % {
+        't': table, 'c': columns, 'k': key}
+
+
+# Migration 9, in the hot database. Triggers cannot see an attached database,
+# so while the archiver deletes moved rows it flags the move in
+# archive_moving, and the triggers that would otherwise treat those deletes
+# as real (pet availability, dashboard history) stand aside.
+GUARD = 'NOT EXISTS (SELECT 1 FROM archive_moving)'
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS archive_moving (Moving INTEGER NOT NULL)",
+    "DROP TRIGGER IF EXISTS adoption_status_delete",
+    '''CREATE TRIGGER adoption_status_delete AFTER DELETE ON adoptions WHEN %s BEGIN
+        UPDATE pets SET Status = 'available' WHERE PetID = OLD.PetID
+            AND NOT EXISTS (SELECT 1 FROM adoptions WHERE PetID = OLD.PetID);
+    END''' % GUARD,
+    "DROP TRIGGER IF EXISTS dashboard_adoptions_delete",
+    '''CREATE TRIGGER dashboard_adoptions_delete AFTER DELETE ON adoptions WHEN %s BEGIN
+        UPDATE monthly_adoptions SET Adoptions = Adoptions - 1 WHERE Month = substr(OLD.AdoptionDate, 1, 7);
+        UPDATE dashboard_totals SET Value = Value - 1 WHERE Name = 'adopted_pets'
+            AND NOT EXISTS (SELECT 1 FROM adoptions WHERE PetID = OLD.PetID);
+    END''' % GUARD,
+    "DROP TRIGGER IF EXISTS dashboard_payments_delete",
+    '''CREATE TRIGGER dashboard_payments_delete AFTER DELETE ON payments WHEN %s BEGIN
+        UPDATE monthly_revenue SET Payments = Payments - 1, Revenue = Revenue - OLD.Amount
+            WHERE Month = substr(OLD.PaymentDate, 1, 7);
+    END''' % GUARD,
+]
+
+
+def attach(database):
+    # Pool setup hook: ATTACH the archive and create its tables and the views.
+    def setup(conn):
+        conn.execute('ATTACH DATABASE ? AS archive', (database,))
+        conn.execute('PRAGMA archive.journal_mode=WAL')
+        for sql in ARCHIVE_TABLES:
+            conn.execute(sql)
+        for table in COLUMNS:
+            conn.execute(view_statement(table))
+        conn.commit()
+    return setup
+
+
+# ---------- ARCHIVER ----------
+def cutoff_date(days, today=None):
+    return ((today or datetime.date.today()) - datetime.timedelta(days=days)).isoformat()
+
+
+# Adoptions dated before the cutoff with no payment on or after it, in
+# (AdoptionDate, AdoptionID) order after a keyset cursor.
+CLOSED_ADOPTIONS = '''SELECT AdoptionDate, AdoptionID FROM main.adoptions a
+    WHERE AdoptionDate < ? AND (AdoptionDate, AdoptionID) > (?, ?)
+      AND NOT EXISTS (SELECT 1 FROM main.payments p WHERE p.AdoptionID = a.AdoptionID AND p.PaymentDate >= ?)
+    ORDER BY AdoptionDate, AdoptionID LIMIT ?'''
+
+
+def copy_work(cutoff, after, chunk_size):
+    # First half of a move: copy the next chunk into the archive. Returns
+    # work(conn) -> (rows picked, last (AdoptionDate, AdoptionID)).
+    def work(conn):
+        conn.execute('DELETE FROM temp.archive_batch')
+        rows = conn.execute(CLOSED_ADOPTIONS, (cutoff, after[0], after[1], cutoff, chunk_size)).fetchall()
+        if not rows:
+            return 0, after
+        conn.executemany('INSERT INTO temp.archive_batch (AdoptionID) VALUES (?)', [(row[1],) for row in rows])
+        for table, columns in COLUMNS.items():
+            copied = conn.execute('''INSERT OR IGNORE INTO archive.%(t)s (%(c)s)
+                SELECT %(c)s FROM main.%(t)s WHERE AdoptionID IN (SELECT AdoptionID FROM temp.archive_batch)''' % {
+                't': table, 'c': ', '.join(columns)}).rowcount
+            conn.execute('UPDATE archive.archive_counts SET Total = Total + ? WHERE TableName = ?', (copied, table))
+        return len(rows), tuple(rows[-1])
+    return work
+
+
+def remove_work(conn):
+    # Second half: delete the hot rows that are now safely in the archive.
+    # A payment that arrived in between keeps its adoption hot; the archive
+    # copies of that adoption are dropped again. Returns (adoptions, payments)
+    # moved.
+    kept = conn.execute('''SELECT DISTINCT p.AdoptionID FROM main.payments p
+        WHERE p.AdoptionID IN (SELECT AdoptionID FROM temp.archive_batch)
+          AND NOT EXISTS (SELECT 1 FROM archive.payments a WHERE a.PaymentID = p.PaymentID)''').fetchall()
+    conn.executemany('DELETE FROM temp.archive_batch WHERE AdoptionID = ?', kept)
+    for table in COLUMNS:
+        dropped = sum(conn.execute('DELETE FROM archive.%s WHERE AdoptionID = ?' % table, key).rowcount for key in kept)
+        conn.execute('UPDATE archive.archive_counts SET Total = Total - ? WHERE TableName = ?', (dropped, table))
+    conn.execute('INSERT INTO archive_moving (Moving) VALUES (1)')
+    payments = conn.execute('DELETE FROM main.payments WHERE AdoptionID IN (SELECT AdoptionID FROM temp.archive_batch)').rowcount
+    adoptions = conn.execute('DELETE FROM main.adoptions WHERE AdoptionID IN (SELECT AdoptionID FROM temp.archive_batch)').rowcount
+    conn.execute('DELETE FROM archive_moving')
+    return adoptions, payments
+
+
+def archive_closed(conn, cutoff, chunk_size=500, pause=0.01, progress=None):
+    # Moves every closed adoption dated before cutoff, with its payments, a
+    # chunk at a time. Each chunk is two short write transactions: the copy
+    # commits before the hot rows are deleted, so a crash in between leaves a
+    # duplicate (hidden by the views, skipped by the next run) rather than a
+    # lost row; SQLite only commits the two files atomically with a rollback
+    # journal, not in WAL mode. Returns (adoptions, payments) moved.
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (AdoptionID INTEGER PRIMARY KEY)')
+    after = ('', 0)
+    moved = [0, 0]
+    while True:
+        (picked, after), _ = run_immediate(conn, copy_work(cutoff, after, chunk_size))
+        if not picked:
+            break
+        (adoptions, payments), _ = run_immediate(conn, remove_work)
+        moved[0] += adoptions
+        moved[1] += payments
+        if progress is not None:
+            progress(*moved)
+        # Let queued writers in between chunks.
+        time.sleep(pause)
+    return tuple(moved)
+
+
+def archive_counts(conn):
+    hot = dict(conn.execute("SELECT TableName, Total FROM row_counts WHERE TableName IN ('adoptions', 'payments')"))
+    archived = dict(conn.execute('SELECT TableName, Total FROM archive.archive_counts'))
+    return {table: (hot.get(table, 0), archived.get(table, 0)) for table in COLUMNS}
+
+
+# ---------- CLI ----------
+cli = AppGroup('archive', help='Move old adoptions and payments to the archive database.')
+
+
+def require_archive():
+    if 'archive' not in current_app.extensions:
+        raise click.ClickException('no archive database; set PET_ADOPTION_ARCHIVE_DB')
+
+
+@cli.command('run')
+@click.option('--before', help='Cutoff date (YYYY-MM-DD); defaults to ARCHIVE_AFTER_DAYS ago.')
+@click.option('--chunk-size', default=500, show_default=True, help='Adoptions per chunk.')
+@click.option('--pause', default=0.01, show_default=True, help='Seconds to sleep between chunks.')
+@click.option('--vacuum', is_flag=True, help='VACUUM the hot database afterwards to give the space back.')
+def run_command(before, chunk_size, pause, vacuum):
+    """Archive closed adoptions and their payments older than the cutoff."""
+    require_archive()
+    cutoff = before or cutoff_date(current_app.config['ARCHIVE_AFTER_DAYS'])
+    conn = get_db()
+    started = time.perf_counter()
+    adoptions, payments = archive_closed(conn, cutoff, chunk_size, pause)
+    page_cache = current_app.extensions.get('page_cache')
+    if page_cache is not None:
+        page_cache.invalidate('adoptions', 'payments')
+    click.echo('Archived %d adoptions and %d payments dated before %s in %.2fs' % (
+        adoptions, payments, cutoff, time.perf_counter() - started))
+    if vacuum:
+        conn.execute('VACUUM main')
+        click.echo('Hot database vacuumed')
+
+
+@cli.command('status')
+def status_command():
+    """Show hot and archived row counts."""
+    require_archive()
+    conn = get_db()
+    click.echo('archive: %s' % current_app.config['ARCHIVE_DATABASE'])
+    for table, (hot, archived) in archive_counts(conn).items():
+        click.echo('%s: %d hot, %d archived' % (table, hot, archived))
+    cutoff = cutoff_date(current_app.config['ARCHIVE_AFTER_DAYS'])
+    eligible = conn.execute('SELECT COUNT(*) FROM (%s)' % CLOSED_ADOPTIONS,
+                            (cutoff, '', 0, cutoff, -1)).fetchone()[0]
+    click.echo('%d closed adoptions dated before %s waiting to be archived' % (eligible, cutoff))
+
+
+def init_app(app):
+    # Must run before the pool opens its first connection.
+    # Only a configured archive is attached; without one every connection
+    # sees the hot tables alone and ?scope=all reads them as they are.
+    app.config.setdefault('ARCHIVE_DATABASE', None)
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', 365)
+    app.cli.add_command(cli)
+    if not app.config['ARCHIVE_DATABASE']:
+        return
+    app.extensions['db_pool'].setup = attach(app.config['ARCHIVE_DATABASE'])
+    app.extensions['archive'] = app.config['ARCHIVE_DATABASE']
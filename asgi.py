@@ -0,0 +1,172 @@
+"""ASGI entry point for the adoption app.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+The Flask views stay synchronous: SQLite calls block whichever driver wraps
+them, so they run on a bounded thread pool instead (PET_ADOPTION_ASGI_THREADS,
+default 8). The event loop only parses requests and writes responses. A slow
+client or a long streamed page then holds a socket, not a worker thread:
+each chunk of a streamed body is produced on the pool and sent from the
+loop, so the thread is free while the chunk is on its way.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from petadopupdate import app
+
+# Bytes of response body gathered on a pool thread before handing them to
+# the event loop to send.
+SEND_BUFFER = 16 * 1024
+
+# Request bodies larger than this are spooled to a temporary file.
+SPOOL_SIZE = 1024 * 1024
+
+
+class WsgiBridge:
+    """Serves a WSGI app over ASGI, running app code on a thread pool."""
+
+    def __init__(self, wsgi_app, threads=8):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi-worker')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise RuntimeError('unsupported ASGI scope type %r' % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        return body
+
+    def environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = 'HTTP_' + name
+            if key in environ:
+                # Repeated headers fold into one, except Cookie, whose
+                # pairs (split across headers by HTTP/2) are joined with ';'.
+                value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+            environ[key] = value
+        return environ
+
+    async def wait_disconnect(self, receive):
+        # Once the request body is read, the only message left is the
+        # disconnect.
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def http(self, scope, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        environ = self.environ(scope, body)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return lambda data: started.setdefault('written', []).append(data)
+
+        def begin():
+            iterable = self.wsgi_app(environ, start_response)
+            return iterable, iter(iterable)
+
+        def read(chunks):
+            # Gather up to SEND_BUFFER bytes; returns (data, finished).
+            parts, size = started.pop('written', []), 0
+            for chunk in chunks:
+                parts.append(chunk)
+                size += len(chunk)
+                if size >= SEND_BUFFER:
+                    return b''.join(parts), False
+            return b''.join(parts), True
+
+        # Every step of one request runs in the same context, so Flask's
+        # request context (kept in context variables) survives the hops
+        # between pool threads while a streamed body is produced.
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        run = lambda *args: loop.run_in_executor(self.executor, context.run, *args)
+        # A client that goes away mid-response stops the body: no further
+        # chunks are produced and the iterable is closed, rather than a
+        # streamed page running to the end for nobody.
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+
+        async def respond(message):
+            # False once the client has gone, whether the server said so with
+            # a disconnect message or by refusing the send (OSError).
+            try:
+                await send(message)
+            except OSError:
+                return False
+            return not disconnected.done()
+
+        iterable = None
+        try:
+            iterable, chunks = await run(begin)
+            data, finished = await run(read, chunks)
+            if not await respond({'type': 'http.response.start', 'status': started['status'],
+                                  'headers': started['headers']}):
+                return
+            while not finished:
+                if not await respond({'type': 'http.response.body', 'body': data, 'more_body': True}):
+                    return
+                data, finished = await run(read, chunks)
+            await respond({'type': 'http.response.body', 'body': data, 'more_body': False})
+        finally:
+            disconnected.cancel()
+            if iterable is not None and hasattr(iterable, 'close'):
+                await run(iterable.close)
+            body.close()
+
+
+application = WsgiBridge(app, int(os.environ.get('PET_ADOPTION_ASGI_THREADS', 8)))
@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import logging
+import mimetypes
+import os
+import urllib.request
+
+import click
+from flask import Blueprint, Response, abort, current_app, request, url_for
+
+from compression import COMPRESSIBLE, accepted_encoding, brotli, encode
+from templating import update_template_digest
+
+log = logging.getLogger(__name__)
+
+bp = Blueprint('assets', __name__)
+
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'vendor')
+
+# Third-party files the pages use, served from VENDOR_DIR. "flask assets
+# fetch" downloads them and checks them against their SRI hash. A file that
+# is missing is logged at startup; pages then link the CDN copy, unless
+# ASSETS_CDN_FALLBACK is off (shelters on offline networks), in which case
+# rendering them fails.
+VENDOR = {
+    'bootstrap.min.css': ('https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+                          'sha384-9ndCyUaIbzAi2FUVXJi0CjmCapSmO7SnpJef0486qhLnuZ2cdeRhO02iuK6FUUVM'),
+}
+
+# Fingerprinted URLs change whenever the file does, so they can be cached
+# for good.
+MAX_AGE = 365 * 24 * 3600
+
+
+def load_assets(directory):
+    # {name: asset} for every file in directory, each kept in memory with
+    # its gzip (and brotli) encodings made once, at the highest level.
+    assets = {}
+    if not os.path.isdir(directory):
+        return assets
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.startswith('.') or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            body = f.read()
+        digest = hashlib.sha256(body).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        bodies = {None: body}
+        if mimetype in COMPRESSIBLE:
+            bodies['gzip'] = encode(body, 'gzip', gzip_level=9)
+            if brotli is not None:
+                bodies['br'] = encode(body, 'br', brotli_quality=11)
+        assets[name] = {
+            'path': 'vendor/%s.%s%s' % (stem, digest, ext),
+            'digest': digest,
+            'mimetype': mimetype,
+            'bodies': bodies,
+        }
+    return assets
+
+
+def asset_url(name):
+    asset = current_app.extensions['assets'].get(name)
+    if asset is None:
+        if not current_app.config['ASSETS_CDN_FALLBACK']:
+            raise RuntimeError('%s is not in %s; run "flask assets fetch"' % (name, current_app.config['ASSETS_DIR']))
+        return VENDOR[name][0]
+    return url_for('assets.asset', filename=asset['path'])
+
+
+@bp.route('/assets/<path:filename>')
+def asset(filename):
+    # Fingerprinted paths are immutable; the plain vendor/<name> path (for
+    # pages cached from before a deploy) must be revalidated.
+    assets = current_app.extensions['assets']
+    found = next((a for a in assets.values() if a['path'] == filename), None)
+    immutable = found is not None
+    if found is None and filename.startswith('vendor/'):
+        found = assets.get(filename[len('vendor/'):])
+    if found is None:
+        abort(404)
+    encoding = accepted_encoding([e for e in ('br', 'gzip') if e in found['bodies']])
+    response = Response(found['bodies'][encoding], mimetype=found['mimetype'])
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(found['digest'] + ('-' + encoding if encoding else ''))
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def sri_hash(body, algorithm):
+    return '%s-%s' % (algorithm, base64.b64encode(hashlib.new(algorithm, body).digest()).decode())
+
+
+@bp.cli.command('fetch')
+@click.option('--force', is_flag=True, help='Download files that are already there again.')
+def fetch_command(force):
+    """Download the vendored third-party files into static/vendor."""
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    for name, (url, integrity) in VENDOR.items():
+        path = os.path.join(VENDOR_DIR, name)
+        if os.path.exists(path) and not force:
+            click.echo('%s: already there' % name)
+            continue
+        with urllib.request.urlopen(url, timeout=30) as f:
+            body = f.read()
+        algorithm = integrity.split('-', 1)[0]
+        if sri_hash(body, algorithm) != integrity:
+            raise click.ClickException('%s does not match its integrity hash; not saved' % url)
+        with open(path, 'wb') as f:
+            f.write(body)
+        click.echo('%s: %d bytes' % (name, len(body)))
+    click.echo('Restart the app to serve them.')
+
+
+def init_app(app):
+    app.config.setdefault('ASSETS_CDN_FALLBACK', True)
+    assets = load_assets(app.config.setdefault('ASSETS_DIR', VENDOR_DIR))
+    missing = sorted(set(VENDOR) - set(assets))
+    if missing:
+        log.error('vendored assets missing from %s: %s; run "flask assets fetch"%s', app.config['ASSETS_DIR'],
+                  ', '.join(missing), ' (linking the CDN until then)' if app.config['ASSETS_CDN_FALLBACK'] else '')
+    app.extensions['assets'] = assets
+    app.jinja_env.globals['asset_url'] = asset_url
+    # Pages link the fingerprinted paths, so those are part of their ETags.
+    update_template_digest(app, *(asset['path'] for asset in assets.values()))
+    app.register_blueprint(bp)
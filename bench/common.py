@@ -0,0 +1,174 @@
+import datetime
+import http.client
+import importlib
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+
+
+def parse_scale(value):
+    value = value.lower()
+    if value in SCALES:
+        return SCALES[value]
+    return int(value)
+
+
+# ---------- APP ----------
+def load_app(database, cache=False, module='petadopupdate'):
+    # The app reads its database path and cache switch from the environment
+    # at import time, so these must be set before the first import.
+    os.environ['PET_ADOPTION_DB'] = database
+    os.environ['PET_ADOPTION_CACHE'] = '1' if cache else '0'
+    # Scheduled jobs (VACUUM, rebuilds) would skew the timings.
+    os.environ.setdefault('PET_ADOPTION_JOBS', '0')
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    return importlib.import_module(module).app
+
+
+class LiveServer:
+    """Runs a WSGI app on a threaded werkzeug server in a background thread."""
+
+    def __init__(self, app, host='127.0.0.1'):
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server(host, 0, app, threaded=True)
+        self.url = 'http://%s:%d' % (host, self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.thread.join()
+
+
+# ---------- MEASUREMENT ----------
+def reset_peak_rss():
+    # Linux lets a process reset its own high-water mark; elsewhere the peak
+    # stays cumulative for the whole run.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    values = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': ms(percentile(values, 50)),
+        'p95_ms': ms(percentile(values, 95)),
+        'p99_ms': ms(percentile(values, 99)),
+        'mean_ms': ms(sum(values) / len(values)) if values else 0.0,
+        'max_ms': ms(values[-1]) if values else 0.0,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def http_load(base_url, make_request, total, concurrency):
+    # Fires `total` requests from `concurrency` threads, each on its own
+    # keep-alive connection. make_request(i) returns (method, path, body,
+    # headers); the response body is read in full before the clock stops.
+    host = urlsplit(base_url).netloc
+    local = threading.local()
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def one(i):
+        method, path, body, headers = make_request(i)
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection(host, timeout=60)
+        started = time.perf_counter()
+        try:
+            local.conn.request(method, path, body=body, headers=headers or {})
+            response = local.conn.getresponse()
+            response.read()
+            failed = response.status >= 500
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            del local.conn
+            failed = True
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if failed:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return latencies, time.perf_counter() - started, errors[0]
+
+
+# ---------- REPORTS ----------
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_metadata(**extra):
+    meta = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+    }
+    meta.update(extra)
+    return meta
+
+
+def write_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def print_table(rows, columns):
+    widths = [max([len(str(c))] + [len(str(r.get(c, ''))) for r in rows]) for c in columns]
+    print('  '.join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(str(row.get(c, '')).ljust(w) for c, w in zip(columns, widths)))
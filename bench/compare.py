@@ -0,0 +1,69 @@
+"""Compare two benchmark reports written by bench.routes.
+
+    python -m bench.compare baseline.json candidate.json --threshold 10
+
+Prints the change in p50/p95/p99 latency, throughput and peak RSS for every
+route and mode present in both reports, and exits with status 1 when any
+latency grows (or throughput drops) by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+from bench.common import print_table
+
+# Metric -> True when a larger value is worse
+METRICS = {'p50_ms': True, 'p95_ms': True, 'p99_ms': True, 'throughput_rps': False, 'peak_rss_kb': True}
+
+
+def change(old, new):
+    if not old:
+        return None
+    return (new - old) * 100.0 / old
+
+
+def compare(baseline, candidate, threshold):
+    rows, regressions = [], []
+    for route, modes in baseline['routes'].items():
+        for mode, old in modes.items():
+            new = candidate['routes'].get(route, {}).get(mode)
+            if new is None:
+                continue
+            row = {'route': route, 'mode': mode}
+            for metric, larger_is_worse in METRICS.items():
+                delta = change(old.get(metric), new.get(metric, 0))
+                if delta is None:
+                    row[metric] = '-'
+                    continue
+                row[metric] = '%+.1f%%' % delta
+                worse = delta > threshold if larger_is_worse else delta < -threshold
+                if worse and metric != 'peak_rss_kb':
+                    regressions.append('%s (%s) %s %s' % (route, mode, metric, row[metric]))
+            rows.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent change counted as a regression (default 10)')
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print('baseline  %s (%s)' % (baseline['meta'].get('commit'), baseline['meta'].get('date')))
+    print('candidate %s (%s)\n' % (candidate['meta'].get('commit'), candidate['meta'].get('date')))
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print_table(rows, ['route', 'mode'] + list(METRICS))
+    if regressions:
+        print('\n%d regressions over %.0f%%:' % (len(regressions), args.threshold))
+        for line in regressions:
+            print('  ' + line)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""Adoption throughput with N concurrent adopters.
+
+    python -m bench.seed --scale 10k --db bench_10k.db
+    python -m bench.contention --db bench_10k.db --clients 1,2,4,8,16
+
+Runs against a copy of the database so the seeded file is left untouched.
+For each client count, fresh available pets are created and every client
+adopts (and pays for) them over HTTP. A share of requests (--overlap) goes
+after a pet another client also wants, to provoke conflicts:
+
+  adopt   POST /api/v1/adopt, one BEGIN IMMEDIATE transaction that claims
+          the pet, inserts the adoption and the payment
+  legacy  POST /api/v1/adopt without a fee then POST /api/v1/payments,
+          the old two-request flow (the generic POST /api/v1/adoptions,
+          which skipped the availability check, is gone)
+
+The report gives throughput, latency per adoption, conflicts (409), busy
+responses (503), busy retries and pets that ended up adopted twice.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from bench.common import LiveServer, load_app, print_table, run_metadata, summarize, write_report
+from bench.seed import adopter_id
+
+JSON = {'Content-Type': 'application/json'}
+
+
+def copy_database(source, target):
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def create_pets(database, prefix, count):
+    conn = sqlite3.connect(database)
+    ids = ['%s-%d' % (prefix, i) for i in range(count)]
+    conn.executemany("INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES (?, 'Bench', 'Beagle', 2, 'Healthy')",
+                     [(pid,) for pid in ids])
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def double_adoptions(database, prefix):
+    conn = sqlite3.connect(database)
+    count = conn.execute('''SELECT COUNT(*) FROM (SELECT PetID FROM adoptions WHERE PetID LIKE ?
+                            GROUP BY PetID HAVING COUNT(*) > 1)''', (prefix + '-%',)).fetchone()[0]
+    conn.close()
+    return count
+
+
+def metric(base_url, name, **labels):
+    conn = http.client.HTTPConnection(urlsplit(base_url).netloc, timeout=60)
+    conn.request('GET', '/metrics')
+    text = conn.getresponse().read().decode()
+    conn.close()
+    selector = ','.join('%s="%s"' % item for item in sorted(labels.items()))
+    pattern = r'^petadoption_%s%s (\S+)$' % (name, re.escape('{%s}' % selector) if labels else '')
+    match = re.search(pattern, text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def post(conn, path, body):
+    conn.request('POST', path, body=json.dumps(body), headers=JSON)
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, data
+
+
+def adopt(conn, pet, adopter, day):
+    status, _ = post(conn, '/api/v1/adopt', {'PetID': pet, 'AdopterID': adopter, 'AdoptionDate': day,
+                                             'Amount': 150.0, 'PaymentDate': day})
+    return status
+
+
+def legacy(conn, pet, adopter, day):
+    status, data = post(conn, '/api/v1/adopt', {'PetID': pet, 'AdopterID': adopter, 'AdoptionDate': day})
+    if status != 201:
+        return status
+    status, _ = post(conn, '/api/v1/payments', {'AdoptionID': json.loads(data)['AdoptionID'],
+                                                'Amount': 150.0, 'PaymentDate': day})
+    return status
+
+
+FLOWS = {'adopt': adopt, 'legacy': legacy}
+
+
+def run_level(server, flow, jobs, clients):
+    host = urlsplit(server.url).netloc
+    local = threading.local()
+    latencies, outcomes = [], {}
+    lock = threading.Lock()
+
+    def one(job):
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection(host, timeout=60)
+        started = time.perf_counter()
+        try:
+            status = flow(local.conn, *job)
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            del local.conn
+            status = 'error'
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            outcomes[status] = outcomes.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(one, jobs))
+    return latencies, time.perf_counter() - started, outcomes
+
+
+def make_jobs(rng, pets, adopters, overlap):
+    # Each pet is wanted once; an `overlap` share of requests goes after a
+    # pet that is also in someone else's request.
+    jobs = []
+    for i, pet in enumerate(pets):
+        if i and rng.random() < overlap:
+            pet = pets[rng.randrange(i)]
+        jobs.append((pet, adopter_id(rng.randrange(max(adopters, 1))), '2025-06-%02d' % rng.randint(1, 28)))
+    rng.shuffle(jobs)
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='database seeded with bench.seed')
+    parser.add_argument('--clients', default='1,2,4,8,16', help='comma-separated client counts (default 1,2,4,8,16)')
+    parser.add_argument('--adoptions', type=int, default=400, help='adoptions per client count (default 400)')
+    parser.add_argument('--overlap', type=float, default=0.1,
+                        help='share of requests that compete for an already requested pet (default 0.1)')
+    parser.add_argument('--flow', choices=['adopt', 'legacy', 'both'], default='both')
+    parser.add_argument('--pool-size', type=int, help='database pool size (default: the app default)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--out', default='contention_results.json', help='report file (default contention_results.json)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='petadoption-contention-')
+    database = os.path.join(workdir, 'contention.db')
+    copy_database(args.db, database)
+    if args.pool_size:
+        os.environ['PET_ADOPTION_DB_POOL_SIZE'] = str(args.pool_size)
+    app = load_app(database)
+    conn = sqlite3.connect(database)
+    adopters = conn.execute("SELECT Total FROM row_counts WHERE TableName='adopters'").fetchone()[0]
+    conn.close()
+
+    rng = random.Random(args.seed)
+    flows = list(FLOWS) if args.flow == 'both' else [args.flow]
+    levels = [int(n) for n in args.clients.split(',')]
+    results = {}
+    with LiveServer(app) as server:
+        for flow in flows:
+            for clients in levels:
+                prefix = 'CONT-%s-%d-%d' % (flow, clients, int(time.time()))
+                pets = create_pets(database, prefix, args.adoptions)
+                jobs = make_jobs(rng, pets, adopters, args.overlap)
+                attempts = metric(server.url, 'adoption_attempts_total')
+                adopted = metric(server.url, 'adoptions_total', result='adopted')
+                latencies, elapsed, outcomes = run_level(server, FLOWS[flow], jobs, clients)
+                retries = (metric(server.url, 'adoption_attempts_total') - attempts) - \
+                    (metric(server.url, 'adoptions_total', result='adopted') - adopted)
+                ok = sum(n for status, n in outcomes.items() if status in (200, 201))
+                errors = outcomes.get('error', 0) + sum(
+                    n for status, n in outcomes.items() if status != 'error' and status >= 500 and status != 503)
+                result = summarize(latencies, elapsed, errors)
+                result.update(adopted=ok, conflicts=outcomes.get(409, 0), busy=outcomes.get(503, 0),
+                              retries=int(retries), double_adopted=double_adoptions(database, prefix),
+                              adoptions_per_s=round(ok / elapsed, 1) if elapsed else 0.0)
+                results.setdefault(flow, {})[str(clients)] = result
+
+    report = {
+        'meta': run_metadata(database=args.db, adoptions=args.adoptions, overlap=args.overlap,
+                             pool_size=app.config['DB_POOL_SIZE']),
+        'flows': results,
+    }
+    write_report(args.out, report)
+    shutil.rmtree(workdir, ignore_errors=True)
+    rows = [dict(flow=flow, clients=clients, **stats) for flow, levels in results.items()
+            for clients, stats in levels.items()]
+    print_table(rows, ['flow', 'clients', 'requests', 'adopted', 'conflicts', 'busy', 'retries', 'double_adopted',
+                       'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'adoptions_per_s'])
+    print('\nwrote %s' % args.out, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
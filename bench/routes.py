@@ -0,0 +1,228 @@
+"""Benchmark every route of petadopupdate.py against a seeded database.
+
+    python -m bench.seed --scale 100k --db bench_100k.db
+    python -m bench.routes --db bench_100k.db --out baseline.json
+    python -m bench.compare baseline.json after.json
+
+Each route is driven sequentially through the Flask test client and, for
+--concurrency > 0, concurrently over HTTP against a threaded server. The
+report records p50/p95/p99 latency, throughput and peak RSS per route and
+mode. The page cache is off unless --cache is given, so the numbers reflect
+real query and render cost.
+"""
+import argparse
+import io
+import itertools
+import random
+import sqlite3
+import sys
+import time
+from urllib.parse import urlencode
+
+from bench.common import (LiveServer, http_load, load_app, peak_rss_kb, print_table,
+                          reset_peak_rss, run_metadata, summarize, write_report)
+from bench.seed import BREEDS, HEALTH, PLACES, pet_id, adopter_id
+
+FORM = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+class Context:
+    """Row ids and dates shared by the route definitions."""
+
+    def __init__(self, database, seed=7):
+        conn = sqlite3.connect(database)
+        count = lambda table: conn.execute(
+            "SELECT Total FROM row_counts WHERE TableName=?", (table,)).fetchone()[0]
+        self.pets = count('pets')
+        self.adopters = count('adopters')
+        self.adoptions = count('adoptions')
+        self.payments = count('payments')
+        conn.close()
+        self.rng = random.Random(seed)
+        self.new_ids = itertools.count()
+        self.created_pets = []
+        self.created_adopters = []
+
+    def pet(self):
+        return pet_id(self.rng.randrange(max(self.pets, 1)))
+
+    def adopter(self):
+        return adopter_id(self.rng.randrange(max(self.adopters, 1)))
+
+    def adoption(self):
+        return self.rng.randint(1, max(self.adoptions, 1))
+
+    def month(self):
+        return '%d-%02d' % (self.rng.randint(2015, 2025), self.rng.randint(1, 12))
+
+    def new_pet(self):
+        pid = 'BENCH-P%d-%d' % (int(time.time()), next(self.new_ids))
+        self.created_pets.append(pid)
+        return pid
+
+    def new_adopter(self):
+        aid = 'BENCH-A%d-%d' % (int(time.time()), next(self.new_ids))
+        self.created_adopters.append(aid)
+        return aid
+
+
+def get(path):
+    return lambda ctx: ('GET', path(ctx) if callable(path) else path, None, None)
+
+
+def post(path, form):
+    return lambda ctx: ('POST', path(ctx) if callable(path) else path, urlencode(form(ctx)), FORM)
+
+
+def pet_form(ctx):
+    return {'PetName': 'Bench', 'Breed': ctx.rng.choice(BREEDS), 'Age': ctx.rng.randint(0, 18),
+            'HealthStatus': ctx.rng.choice(HEALTH)}
+
+
+def adopter_form(ctx):
+    city, state, country = ctx.rng.choice(PLACES)
+    return {'FirstName': 'Bench', 'LastName': 'Runner', 'Contact': '555-0100', 'Address': '1 Test Way',
+            'City': city, 'State': state, 'Country': country}
+
+
+def month_range(ctx):
+    month = ctx.month()
+    return 'date_from=%s-01&date_to=%s-31' % (month, month)
+
+
+def import_csv(ctx):
+    lines = ['PetID,PetName,Breed,Age,HealthStatus']
+    for _ in range(100):
+        lines.append('%s,Bench,Beagle,3,Healthy' % ctx.new_pet())
+    return '\n'.join(lines).encode()
+
+
+# Route name -> request factory. Write routes that delete consume the rows the
+# matching add_ routes created, so they run after them.
+ROUTES = [
+    ('home', get('/')),
+    ('pets', get('/pets')),
+    ('pets sorted by breed', get('/pets?sort=Breed&order=desc')),
+    ('pets filtered by breed', get(lambda ctx: '/pets?' + urlencode({'Breed': ctx.rng.choice(BREEDS)}))),
+    ('pets page 500 rows', get('/pets?limit=500')),
+    ('adopters', get('/adopters')),
+    ('adopters filtered by city', get(lambda ctx: '/adopters?' + urlencode({'City': ctx.rng.choice(PLACES)[0]}))),
+    ('adoptions', get('/adoptions')),
+    ('adoptions by month', get(lambda ctx: '/adoptions?' + month_range(ctx))),
+    ('payments', get('/payments')),
+    ('payments by month', get(lambda ctx: '/payments?' + month_range(ctx))),
+    ('edit_pet form', get(lambda ctx: '/edit_pet/' + ctx.pet())),
+    ('edit_adopter form', get(lambda ctx: '/edit_adopter/' + ctx.adopter())),
+    ('dashboard', get('/dashboard')),
+    ('search', get(lambda ctx: '/search?' + urlencode({'q': ctx.rng.choice(BREEDS).split()[0][:4]}))),
+    ('export payments month csv', get(lambda ctx: '/export/payments.csv?' + month_range(ctx))),
+    ('api pets list', get('/api/v1/pets?limit=50')),
+    ('api pet', get(lambda ctx: '/api/v1/pets/' + ctx.pet())),
+    ('api adoption', get(lambda ctx: '/api/v1/adoptions/%d' % ctx.adoption())),
+    ('admin explain', get('/admin/explain')),
+    ('admin pool', get('/admin/pool')),
+    ('admin cache', get('/admin/cache')),
+    ('add_pet', post('/add_pet', lambda ctx: dict(pet_form(ctx), PetID=ctx.new_pet()))),
+    ('edit_pet', post(lambda ctx: '/edit_pet/' + ctx.pet(), pet_form)),
+    ('add_adopter', post('/add_adopter', lambda ctx: dict(adopter_form(ctx), AdopterID=ctx.new_adopter()))),
+    ('edit_adopter', post(lambda ctx: '/edit_adopter/' + ctx.adopter(), adopter_form)),
+    ('add_adoption', post('/add_adoption', lambda ctx: {
+        'PetID': ctx.pet(), 'AdopterID': ctx.adopter(), 'AdoptionDate': ctx.month() + '-15'})),
+    ('add_payment', post('/add_payment', lambda ctx: {
+        'AdoptionID': ctx.adoption(), 'Amount': '120.00', 'PaymentDate': ctx.month() + '-20'})),
+    ('delete_pet', get(lambda ctx: '/delete_pet/' + ctx.created_pets.pop())),
+    ('delete_adopter', get(lambda ctx: '/delete_adopter/' + ctx.created_adopters.pop())),
+]
+
+# Routes only exercised through the test client (multipart upload)
+CLIENT_ONLY = [
+    ('import 100 pets', lambda client, ctx: client.post(
+        '/import', data={'table': 'pets', 'file': (io.BytesIO(import_csv(ctx)), 'pets.csv')},
+        content_type='multipart/form-data')),
+]
+
+
+def open_request(client, request):
+    method, path, body, headers = request
+    return client.open(path, method=method, data=body, headers=headers)
+
+
+def run_client(app, ctx, name, send, requests):
+    # send(client) issues one request and returns the response.
+    client = app.test_client()
+    latencies, errors = [], 0
+    reset_peak_rss()
+    started = time.perf_counter()
+    for _ in range(requests):
+        if name.startswith('delete_') and not (ctx.created_pets if 'pet' in name else ctx.created_adopters):
+            break
+        began = time.perf_counter()
+        response = send(client)
+        response.get_data()
+        latencies.append(time.perf_counter() - began)
+        errors += response.status_code >= 500
+        response.close()
+    result = summarize(latencies, time.perf_counter() - started, errors)
+    result['peak_rss_kb'] = peak_rss_kb()
+    return result
+
+
+def run_http(server, ctx, name, factory, requests, concurrency):
+    if name.startswith('delete_'):
+        available = len(ctx.created_pets if 'pet' in name else ctx.created_adopters)
+        requests = min(requests, available)
+    # Request factories share one RNG; build them up front so worker threads
+    # only do I/O.
+    prepared = [factory(ctx) for _ in range(requests)]
+    reset_peak_rss()
+    latencies, elapsed, errors = http_load(server.url, lambda i: prepared[i], requests, concurrency)
+    result = summarize(latencies, elapsed, errors)
+    result['peak_rss_kb'] = peak_rss_kb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='database seeded with bench.seed')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and mode (default 200)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='HTTP client threads; 0 skips the HTTP run (default 8)')
+    parser.add_argument('--cache', action='store_true', help='leave the page cache on')
+    parser.add_argument('--only', help='comma-separated route names to run')
+    parser.add_argument('--out', default='bench_results.json', help='report file (default bench_results.json)')
+    args = parser.parse_args()
+
+    app = load_app(args.db, cache=args.cache)
+    ctx = Context(args.db)
+    only = set(args.only.split(',')) if args.only else None
+    selected = lambda name: not only or name in only
+    results = {}
+    for name, factory in ROUTES:
+        if selected(name):
+            send = lambda client, factory=factory: open_request(client, factory(ctx))
+            results[name] = {'client': run_client(app, ctx, name, send, args.requests)}
+    for name, call in CLIENT_ONLY:
+        if selected(name):
+            send = lambda client, call=call: call(client, ctx)
+            results[name] = {'client': run_client(app, ctx, name, send, args.requests)}
+    if args.concurrency:
+        with LiveServer(app) as server:
+            for name, factory in ROUTES:
+                if selected(name):
+                    results[name]['http'] = run_http(server, ctx, name, factory, args.requests, args.concurrency)
+
+    report = {
+        'meta': run_metadata(database=args.db, pets=ctx.pets, adopters=ctx.adopters,
+                             adoptions=ctx.adoptions, payments=ctx.payments, requests=args.requests,
+                             concurrency=args.concurrency, cache=args.cache),
+        'routes': results,
+    }
+    write_report(args.out, report)
+    rows = [dict(route=name, mode=mode, **stats) for name, modes in results.items() for mode, stats in modes.items()]
+    print_table(rows, ['route', 'mode', 'requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms',
+                       'throughput_rps', 'peak_rss_kb'])
+    print('\nwrote %s' % args.out, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
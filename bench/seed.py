@@ -0,0 +1,148 @@
+"""Generate a synthetic pet_adoption.db for benchmarking.
+
+    python -m bench.seed --scale 100k --db bench_100k.db
+
+Each scale creates that many pets, adopters, adoptions and payments (one
+payment per adoption). The schema, indexes and triggers come from the app
+itself, so the seeded file matches what a real deployment would have.
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+
+from bench.common import load_app, parse_scale
+
+BATCH_SIZE = 10000
+
+BREEDS = ['Labrador Retriever', 'Golden Retriever', 'German Shepherd', 'Beagle', 'Poodle',
+          'Bulldog', 'Dachshund', 'Boxer', 'Siberian Husky', 'Border Collie', 'Chihuahua',
+          'Shih Tzu', 'Persian Cat', 'Maine Coon', 'Siamese Cat', 'Bengal Cat', 'Ragdoll',
+          'Mixed Breed', 'Domestic Shorthair', 'Rabbit']
+HEALTH = ['Healthy', 'Vaccinated', 'Needs Checkup', 'Senior Care', 'Recovering', 'Special Needs']
+PET_NAMES = ['Max', 'Bella', 'Charlie', 'Luna', 'Cooper', 'Daisy', 'Rocky', 'Milo', 'Coco',
+             'Buddy', 'Lucy', 'Bailey', 'Molly', 'Oscar', 'Simba', 'Nala', 'Toby', 'Rosie']
+FIRST_NAMES = ['James', 'Mary', 'Ahmed', 'Fatima', 'Wei', 'Priya', 'Carlos', 'Ana', 'John',
+               'Aisha', 'David', 'Sara', 'Omar', 'Emma', 'Hassan', 'Olivia', 'Ravi', 'Mia']
+LAST_NAMES = ['Smith', 'Khan', 'Garcia', 'Chen', 'Patel', 'Johnson', 'Ali', 'Brown', 'Lopez',
+              'Kim', 'Ahmed', 'Wilson', 'Singh', 'Martin', 'Nguyen', 'Hussain', 'Lee', 'Davis']
+PLACES = [('Karachi', 'Sindh', 'Pakistan'), ('Lahore', 'Punjab', 'Pakistan'),
+          ('Austin', 'Texas', 'USA'), ('Seattle', 'Washington', 'USA'),
+          ('Toronto', 'Ontario', 'Canada'), ('Manchester', 'England', 'UK'),
+          ('Mumbai', 'Maharashtra', 'India'), ('Sydney', 'New South Wales', 'Australia')]
+FIRST_DAY = datetime.date(2015, 1, 1)
+DAYS = (datetime.date(2025, 12, 31) - FIRST_DAY).days
+
+
+def pet_id(i):
+    return 'P%07d' % i
+
+
+def adopter_id(i):
+    return 'A%07d' % i
+
+
+def pets(rng, n):
+    for i in range(n):
+        yield (pet_id(i), rng.choice(PET_NAMES), rng.choice(BREEDS), rng.randint(0, 18),
+               rng.choice(HEALTH))
+
+
+def adopters(rng, n):
+    for i in range(n):
+        city, state, country = rng.choice(PLACES)
+        yield (adopter_id(i), rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+               '+1-555-%07d' % rng.randrange(10 ** 7), '%d Main Street' % rng.randint(1, 9999),
+               city, state, country)
+
+
+def adoption_dates(rng, n):
+    return [FIRST_DAY + datetime.timedelta(days=rng.randrange(DAYS)) for _ in range(n)]
+
+
+def adoptions(rng, n, dates):
+    for i in range(n):
+        yield (i + 1, pet_id(rng.randrange(n)), adopter_id(rng.randrange(n)), dates[i].isoformat())
+
+
+def payments(rng, n, dates):
+    for i in range(n):
+        paid = dates[i] + datetime.timedelta(days=rng.randint(0, 14))
+        yield (i + 1, i + 1, round(rng.uniform(25, 500), 2), paid.isoformat())
+
+
+def insert(conn, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+    conn.commit()
+
+
+def seed(database, n, seed_value=42):
+    # The match index is built once at the end rather than refreshed in the
+    # background while rows go in.
+    os.environ['PET_ADOPTION_MATCH_REFRESH'] = '0'
+    load_app(database)
+    from matching import rebuild
+    rng = random.Random(seed_value)
+    dates = adoption_dates(rng, n)
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA foreign_keys=ON')
+    timings = {}
+    for table, sql, rows in (
+        ('pets', "INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES (?, ?, ?, ?, ?)",
+         pets(rng, n)),
+        ('adopters', "INSERT INTO adopters (AdopterID, FirstName, LastName, Contact, Address, City, State, Country)"
+         " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", adopters(rng, n)),
+        ('adoptions', "INSERT INTO adoptions (AdoptionID, PetID, AdopterID, AdoptionDate) VALUES (?, ?, ?, ?)",
+         adoptions(rng, n, dates)),
+        ('payments', "INSERT INTO payments (PaymentID, AdoptionID, Amount, PaymentDate) VALUES (?, ?, ?, ?)",
+         payments(rng, n, dates)),
+    ):
+        started = time.perf_counter()
+        insert(conn, sql, rows)
+        timings[table] = time.perf_counter() - started
+    started = time.perf_counter()
+    rebuild(conn)
+    timings['matches'] = time.perf_counter() - started
+    conn.execute('ANALYZE')
+    conn.close()
+    return timings
+
+
+def remove_database(database):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='1k', help='1k, 10k, 100k, 1m or a row count (default 1k)')
+    parser.add_argument('--db', help='output file (default bench_<scale>.db)')
+    parser.add_argument('--force', action='store_true', help='replace an existing file')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default 42)')
+    args = parser.parse_args()
+    n = parse_scale(args.scale)
+    database = args.db or 'bench_%s.db' % args.scale.lower()
+    if os.path.exists(database):
+        if not args.force:
+            parser.error('%s already exists (use --force to replace it)' % database)
+        remove_database(database)
+    timings = seed(database, n, args.seed)
+    matches = timings.pop('matches')
+    for table, seconds in timings.items():
+        print('%-10s %9d rows in %7.2fs (%.0f rows/s)' % (table, n, seconds, n / seconds))
+    print('%-10s %23.2fs' % ('matches', matches))
+
+
+if __name__ == '__main__':
+    main()
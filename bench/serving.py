@@ -0,0 +1,146 @@
+"""Sync (threaded WSGI) versus async (ASGI) serving at high concurrency.
+
+    python -m bench.serving --db bench_100k.db --concurrency 16,64,256
+
+Each mode runs serve.py in its own process against a copy of the database,
+with the page cache off. Every list view is driven over HTTP at each
+concurrency level. The report records latency, throughput, and the server's
+peak RSS and thread count. ASGI mode needs uvicorn.
+"""
+import argparse
+import http.client
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from bench.common import REPO, http_load, print_table, run_metadata, summarize, write_report
+from bench.contention import copy_database
+
+PAGES = [
+    ('pets', '/pets'),
+    ('pets page 500 rows', '/pets?limit=500'),
+    ('adopters', '/adopters'),
+    ('adoptions', '/adoptions'),
+    ('payments', '/payments'),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_status(pid):
+    # Peak RSS (kB) and current thread count of the server process.
+    status = {}
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.split()[0] if value.split() else ''
+    return int(status.get('VmHWM', 0)), int(status.get('Threads', 0))
+
+
+class ThreadSampler:
+    """Tracks the most threads the server process had while a load ran."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process_status(self.pid)[1])
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Server:
+    def __init__(self, mode, database, threads):
+        self.port = free_port()
+        self.url = 'http://127.0.0.1:%d' % self.port
+        env = dict(os.environ, PET_ADOPTION_DB=database, PET_ADOPTION_CACHE='0', PET_ADOPTION_JOBS='0',
+                   PET_ADOPTION_ASGI_THREADS=str(threads))
+        self.process = subprocess.Popen([sys.executable, 'serve.py', '--mode', mode, '--port', str(self.port)],
+                                        cwd=REPO, env=env)
+
+    def wait(self, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                conn = http.client.HTTPConnection(urlsplit(self.url).netloc, timeout=5)
+                conn.request('GET', '/metrics')
+                conn.getresponse().read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError('server did not start on %s' % self.url)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='database seeded with bench.seed')
+    parser.add_argument('--concurrency', default='16,64,256', help='comma-separated client counts (default 16,64,256)')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per page and level (default 1000)')
+    parser.add_argument('--modes', default='wsgi,asgi', help='comma-separated modes (default wsgi,asgi)')
+    parser.add_argument('--threads', type=int, default=8, help='ASGI worker threads (default 8)')
+    parser.add_argument('--out', default='serving_results.json', help='report file (default serving_results.json)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='petadoption-serving-')
+    results = {}
+    try:
+        for mode in args.modes.split(','):
+            database = os.path.join(workdir, '%s.db' % mode)
+            copy_database(args.db, database)
+            server = Server(mode, database, args.threads)
+            try:
+                server.wait()
+                for level in [int(n) for n in args.concurrency.split(',')]:
+                    for name, path in PAGES:
+                        request = ('GET', path, None, None)
+                        with ThreadSampler(server.process.pid) as threads:
+                            latencies, elapsed, errors = http_load(server.url, lambda i: request, args.requests, level)
+                        result = summarize(latencies, elapsed, errors)
+                        result['server_peak_rss_kb'] = process_status(server.process.pid)[0]
+                        result['server_threads'] = threads.peak
+                        results.setdefault(mode, {}).setdefault(str(level), {})[name] = result
+            finally:
+                server.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': run_metadata(database=args.db, requests=args.requests, asgi_threads=args.threads),
+        'modes': results,
+    }
+    write_report(args.out, report)
+    rows = [dict(mode=mode, clients=level, page=name, **stats)
+            for mode, levels in results.items() for level, pages in levels.items() for name, stats in pages.items()]
+    print_table(rows, ['mode', 'clients', 'page', 'requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms',
+                       'throughput_rps', 'server_peak_rss_kb', 'server_threads'])
+    print('\nwrote %s' % args.out, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Write throughput as the writes are spread over more shelter databases.
+
+    python -m bench.tenants --tenants 1,2,4,8 --clients 16 --writes 2000
+
+Starts the app with a fresh TENANT_DIR. For each tenant count, that many
+new shelters are created and the clients insert pets over HTTP
+(POST /api/v1/pets), round-robin across the shelters by X-Shelter header.
+With one shelter every insert queues for the same SQLite write lock; with
+several, the inserts to different files commit in parallel.
+
+A cross-shelter report (/admin/shelters) is timed at the end, with every
+shelter created by the run.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from bench.common import LiveServer, http_load, load_app, print_table, run_metadata, summarize, write_report
+
+JSON = {'Content-Type': 'application/json'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tenants', default='1,2,4,8', help='comma-separated shelter counts (default 1,2,4,8)')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients (default 16)')
+    parser.add_argument('--writes', type=int, default=2000, help='inserts per shelter count (default 2000)')
+    parser.add_argument('--write-behind', action='store_true', help='run with write-behind batching on')
+    parser.add_argument('--out', default='tenants_results.json', help='report file (default tenants_results.json)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='petadoption-tenants-')
+    os.environ['PET_ADOPTION_TENANT_DIR'] = os.path.join(workdir, 'shelters')
+    # Inserts only: the match index and its refresher threads stay out of it.
+    os.environ['PET_ADOPTION_MATCH_REFRESH'] = '0'
+    os.environ['PET_ADOPTION_WRITE_BEHIND'] = '1' if args.write_behind else '0'
+    app = load_app(os.path.join(workdir, 'default.db'))
+    tenants = app.extensions['tenants']
+    levels = [int(n) for n in args.tenants.split(',')]
+    app.config['TENANT_OPEN_MAX'] = tenants.capacity = max(levels)
+
+    results = {}
+    with LiveServer(app) as server:
+        for count in levels:
+            names = ['bench-%d-%d' % (count, i) for i in range(count)]
+            for name in names:
+                tenants.create(name)
+
+            def make_request(i):
+                body = {'PetID': 'T%d' % i, 'PetName': 'Bench', 'Breed': 'Beagle', 'Age': 2, 'HealthStatus': 'Healthy'}
+                return 'POST', '/api/v1/pets', json.dumps(body), dict(JSON, **{'X-Shelter': names[i % count]})
+
+            latencies, elapsed, errors = http_load(server.url, make_request, args.writes, args.clients)
+            results[str(count)] = summarize(latencies, elapsed, errors)
+
+        latencies, elapsed, errors = http_load(server.url, lambda i: ('GET', '/admin/shelters', None, None), 5, 1)
+        shelters_report = summarize(latencies, elapsed, errors)
+        shelters_report['shelters'] = len(tenants.names())
+
+    base = results[str(levels[0])]['throughput_rps']
+    for count in levels:
+        result = results[str(count)]
+        result['speedup'] = round(result['throughput_rps'] / base, 2) if base else 0.0
+    report = {
+        'meta': run_metadata(clients=args.clients, writes=args.writes, write_behind=args.write_behind),
+        'tenants': results,
+        'report': shelters_report,
+    }
+    write_report(args.out, report)
+    shutil.rmtree(workdir, ignore_errors=True)
+    rows = [dict(tenants=count, **stats) for count, stats in results.items()]
+    print_table(rows, ['tenants', 'requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'speedup'])
+    print('\ncross-shelter report over %d shelters: p50 %s ms' % (shelters_report['shelters'], shelters_report['p50_ms']))
+    print('wrote %s' % args.out, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
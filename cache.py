@@ -0,0 +1,324 @@
+import functools
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import Response, current_app, g, has_app_context, jsonify, request
+
+from db import get_db
+
+
+# ---------- BACKENDS ----------
+class MemoryBackend:
+    """In-process LRU store with per-entry TTL and a total size bound."""
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (expires, value)
+            self._bytes += len(value)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, value = self._data.pop(key)
+        self._bytes -= len(value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class RedisBackend:
+    """Shared store for multi-worker deployments; size limits and eviction are
+    left to the Redis server's maxmemory policy."""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(key)
+        if value is not None and key.startswith('gen:'):
+            value = value.decode()
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, value, ex=ttl)
+
+    def clear(self):
+        self._client.flushdb()
+
+    def stats(self):
+        info = self._client.info('stats')
+        return {'evictions': info.get('evicted_keys', 0), 'expirations': info.get('expired_keys', 0)}
+
+
+# ---------- PAGE CACHE ----------
+class PageCache:
+    # Pages are stored under the current generation token of every table they
+    # show. A write to a table replaces its token, so exactly the pages built
+    # from it stop matching and age out of the LRU.
+
+    def __init__(self, backend, ttl=300, max_entry_bytes=2 * 1024 * 1024):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'too_large': 0, 'invalidations': 0, 'not_modified': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def generation(self, table):
+        token = self.backend.get('gen:' + table)
+        if token is None:
+            token = uuid.uuid4().hex
+            self.backend.set('gen:' + table, token)
+        return token
+
+    def invalidate(self, *tables):
+        for table in tables:
+            self.backend.set('gen:' + table, uuid.uuid4().hex)
+            self._count('invalidations')
+
+    def page_key(self, tables, versions=None):
+        # versions are the row_counts versions the page's ETag is built from:
+        # a write that never called invalidate() (another process, a trigger,
+        # a CLI import) still moves the page to a new key.
+        args = urlencode(sorted(request.args.items(multi=True)))
+        generations = ','.join(self.generation(t) for t in tables)
+        if versions is not None:
+            generations += ':' + versions
+        # A page read from a reporting snapshot (snapshot.py) may predate the
+        # latest write, so it is only reused while that copy is current.
+        snapshot = g.get('snapshot')
+        if snapshot is not None:
+            generations += ':snapshot-%d' % snapshot
+        return 'page:%s:%s?%s:%s' % (request.endpoint, request.path, args, generations)
+
+    def get(self, key):
+        body = self.backend.get(key)
+        self._count('hits' if body is not None else 'misses')
+        return body
+
+    def store(self, key, body):
+        if len(body) > self.max_entry_bytes:
+            self._count('too_large')
+            return
+        self.backend.set(key, body, self.ttl)
+        self._count('stores')
+
+    def capture(self, key, response):
+        # Streamed pages keep streaming; the chunks are collected on the way
+        # out and stored once the whole body has been sent.
+        if not response.is_streamed:
+            self.store(key, response.get_data())
+            return response
+
+        def generate():
+            chunks, size = [], 0
+            try:
+                for chunk in response.iter_encoded():
+                    if chunks is not None:
+                        size += len(chunk)
+                        if size > self.max_entry_bytes:
+                            chunks = None
+                            self._count('too_large')
+                        else:
+                            chunks.append(chunk)
+                    yield chunk
+                if chunks is not None:
+                    self.store(key, b''.join(chunks))
+            finally:
+                response.close()
+        return Response(generate(), status=response.status, headers=response.headers)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        stats.update(self.backend.stats())
+        return stats
+
+
+# ---------- FLASK INTEGRATION ----------
+def init_app(app):
+    app.config.setdefault('CACHE_ENABLED', True)
+    app.config.setdefault('CACHE_TTL', 300)
+    app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+    app.config.setdefault('CACHE_MAX_BYTES', 64 * 1024 * 1024)
+    app.config.setdefault('CACHE_MAX_ENTRY_BYTES', 2 * 1024 * 1024)
+    app.config.setdefault('CACHE_REDIS_URL', None)
+    app.config.setdefault('PAGE_ETAGS', True)
+    if app.config['CACHE_REDIS_URL']:
+        backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+    else:
+        backend = MemoryBackend(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_MAX_BYTES'])
+    page_cache = PageCache(backend, ttl=app.config['CACHE_TTL'],
+                           max_entry_bytes=app.config['CACHE_MAX_ENTRY_BYTES'])
+    app.extensions['page_cache'] = page_cache
+    app.add_url_rule('/admin/cache', 'cache_stats', cache_stats)
+    return page_cache
+
+
+def get_cache():
+    return current_app.extensions['page_cache']
+
+
+def namespaced(tables):
+    # Shelters (tenancy.py) share the page cache; each one's tables get
+    # generations of their own, so its pages never match another's.
+    tenant = g.get('tenant') if has_app_context() else None
+    if tenant is None:
+        return list(tables)
+    return ['%s/%s' % (tenant, table) for table in tables]
+
+
+# Triggers carry a write to one table over to another: every adoption
+# inserted, deleted or moved to another pet sets that pet's Status
+# (adoption.py). Payments are only written alongside, never by a trigger.
+TRIGGERED = {'adoptions': ('pets',)}
+
+
+def written(tables):
+    # The tables a write to tables changes, trigger side effects included.
+    result = []
+    for table in tables:
+        for name in (table,) + TRIGGERED.get(table, ()):
+            if name not in result:
+                result.append(name)
+    return result
+
+
+def invalidate(*tables):
+    get_cache().invalidate(*namespaced(written(tables)))
+
+
+def table_versions(tables):
+    # The row_counts version of every table, bumped by triggers on each write
+    # whichever process made it, as one string; None when a table has no
+    # version to go by.
+    rows = dict(get_db().execute('SELECT TableName, Version FROM row_counts WHERE TableName IN (%s)' % (
+        ', '.join('?' * len(tables))), tables).fetchall())
+    if len(rows) != len(tables):
+        return None
+    return '.'.join(str(rows[t]) for t in tables)
+
+
+def page_etag(versions):
+    # Weak validator for a rendered page: the table versions it was read at,
+    # plus a hash of the URL and of the templates it is rendered from.
+    if versions is None:
+        return None
+    url = '%s%s?%s:%s' % (g.get('tenant') or '', request.path, urlencode(sorted(request.args.items(multi=True))),
+                          current_app.extensions.get('template_digest', ''))
+    return '%s-%x' % (versions, zlib.crc32(url.encode()))
+
+
+def with_page_etag(response, etag):
+    # no-cache: browsers keep the page but ask again each time, and get a
+    # 304 while nothing it shows has changed.
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def cached(*tables):
+    # Serve GET requests for a view from the page cache, keyed by endpoint,
+    # path, query string and the generations and row versions of the tables
+    # it reads, so a cached body always matches the ETag sent with it. A
+    # conditional GET whose weak ETag still matches gets a 304 before the
+    # view or the cache are touched. Requests that set g.cache_bypass
+    # (profiled ones) always run the view.
+    def decorator(view):
+        def render(versions, *args, **kwargs):
+            if not current_app.config['CACHE_ENABLED']:
+                return current_app.make_response(view(*args, **kwargs))
+            page_cache = get_cache()
+            key = page_cache.page_key(namespaced(tables), versions)
+            body = page_cache.get(key)
+            if body is not None:
+                return Response(body, mimetype='text/html')
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            return page_cache.capture(key, response)
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or g.get('cache_bypass'):
+                return view(*args, **kwargs)
+            versions = table_versions(tables)
+            etag = page_etag(versions) if current_app.config['PAGE_ETAGS'] else None
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                page_cache = current_app.extensions.get('page_cache')
+                if page_cache is not None:
+                    page_cache._count('not_modified')
+                return with_page_etag(Response(status=304), etag)
+            response = render(versions, *args, **kwargs)
+            if etag is not None and response.status_code == 200:
+                with_page_etag(response, etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidates(*tables, methods=None):
+    # Drop cached pages for the given tables once a write view succeeds;
+    # methods limits this to the writing half of a GET/POST view.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            response = view(*args, **kwargs)
+            if methods is None or request.method in methods:
+                invalidate(*tables)
+            return response
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    return jsonify(get_cache().stats())
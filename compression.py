@@ -0,0 +1,117 @@
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Text responses worth compressing; images, archives and exports that are
+# already gzipped are left alone.
+COMPRESSIBLE = {
+    'text/html', 'text/css', 'text/csv', 'text/plain', 'application/json',
+    'application/x-ndjson', 'application/javascript', 'image/svg+xml',
+}
+
+
+# ---------- ENCODERS ----------
+class Encoder:
+    """Incremental gzip or brotli compressor."""
+
+    def __init__(self, encoding, gzip_level=6, brotli_quality=4):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def flush(self):
+        # Everything given so far, decodable by the client straight away.
+        if self.encoding == 'br':
+            return self._brotli.flush()
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def encode(data, encoding, gzip_level=6, brotli_quality=4):
+    encoder = Encoder(encoding, gzip_level, brotli_quality)
+    return encoder.compress(data) + encoder.finish()
+
+
+def accepted_encoding(offered=None):
+    # The client's preferred encoding among those we can produce, or None.
+    if offered is None:
+        offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+
+# ---------- RESPONSES ----------
+def compressed_stream(response, encoder):
+    # Streamed pages stay streamed: each chunk is compressed and flushed as
+    # it is produced, so the browser can render rows as they arrive.
+    original = response.response
+    chunks = response.iter_encoded()
+
+    def generate():
+        try:
+            for chunk in chunks:
+                data = encoder.compress(chunk) + encoder.flush()
+                if data:
+                    yield data
+            yield encoder.finish()
+        finally:
+            close = getattr(original, 'close', None)
+            if close is not None:
+                close()
+    return generate()
+
+
+def compress_response(response):
+    config = current_app.config
+    if (request.method == 'HEAD' or response.status_code not in (200, 201) or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+    encoder = Encoder(encoding, config['COMPRESS_LEVEL'], config['COMPRESS_BROTLI_QUALITY'])
+    if response.is_streamed:
+        response.response = compressed_stream(response, encoder)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(encoder.compress(data) + encoder.finish())
+    response.headers['Content-Encoding'] = encoding
+    # A strong ETag names exact bytes; the compressed body is a different
+    # representation of the same resource, so the tag is weakened.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    metrics = current_app.extensions.get('metrics')
+    if metrics is not None:
+        metrics.inc('http_compressed_responses_total', encoding=encoding)
+    return response
+
+
+def init_app(app):
+    # Register after instrumentation: after_request hooks run in reverse, so
+    # the byte counts it records are the compressed ones.
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+    if app.config['COMPRESS_ENABLED']:
+        app.after_request(compress_response)
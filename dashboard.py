@@ -0,0 +1,234 @@
+import time
+
+import click
+from flask import Blueprint, render_template
+
+from cache import cached, invalidate
+from db import get_db
+from templating import register_templates
+
+bp = Blueprint('dashboard', __name__)
+
+# Summary tables read by /dashboard. Triggers keep them in step with every
+# write to pets, adoptions and payments, inside the writer's own transaction,
+# so the dashboard never has to aggregate the base tables.
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS monthly_adoptions (
+        Month TEXT PRIMARY KEY,
+        Adoptions INTEGER NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS monthly_revenue (
+        Month TEXT PRIMARY KEY,
+        Payments INTEGER NOT NULL,
+        Revenue REAL NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS breed_stats (
+        Breed TEXT PRIMARY KEY,
+        Pets INTEGER NOT NULL,
+        TotalAge INTEGER NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS dashboard_totals (
+        Name TEXT PRIMARY KEY,
+        Value INTEGER NOT NULL
+    )''',
+
+    # Adoptions per month and number of distinct pets adopted
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_adoptions_insert AFTER INSERT ON adoptions BEGIN
+        INSERT INTO monthly_adoptions (Month, Adoptions) VALUES (substr(NEW.AdoptionDate, 1, 7), 1)
+            ON CONFLICT(Month) DO UPDATE SET Adoptions = Adoptions + 1;
+        UPDATE dashboard_totals SET Value = Value + 1 WHERE Name = 'adopted_pets'
+            AND (SELECT COUNT(*) FROM adoptions WHERE PetID = NEW.PetID) = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_adoptions_delete AFTER DELETE ON adoptions BEGIN
+        UPDATE monthly_adoptions SET Adoptions = Adoptions - 1 WHERE Month = substr(OLD.AdoptionDate, 1, 7);
+        UPDATE dashboard_totals SET Value = Value - 1 WHERE Name = 'adopted_pets'
+            AND NOT EXISTS (SELECT 1 FROM adoptions WHERE PetID = OLD.PetID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_adoptions_update AFTER UPDATE OF PetID, AdoptionDate ON adoptions BEGIN
+        UPDATE monthly_adoptions SET Adoptions = Adoptions - 1 WHERE Month = substr(OLD.AdoptionDate, 1, 7);
+        INSERT INTO monthly_adoptions (Month, Adoptions) VALUES (substr(NEW.AdoptionDate, 1, 7), 1)
+            ON CONFLICT(Month) DO UPDATE SET Adoptions = Adoptions + 1;
+        UPDATE dashboard_totals SET Value = Value - 1 WHERE Name = 'adopted_pets' AND NEW.PetID != OLD.PetID
+            AND NOT EXISTS (SELECT 1 FROM adoptions WHERE PetID = OLD.PetID);
+        UPDATE dashboard_totals SET Value = Value + 1 WHERE Name = 'adopted_pets' AND NEW.PetID != OLD.PetID
+            AND (SELECT COUNT(*) FROM adoptions WHERE PetID = NEW.PetID) = 1;
+    END''',
+
+    # Payments and revenue per month
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_payments_insert AFTER INSERT ON payments BEGIN
+        INSERT INTO monthly_revenue (Month, Payments, Revenue) VALUES (substr(NEW.PaymentDate, 1, 7), 1, NEW.Amount)
+            ON CONFLICT(Month) DO UPDATE SET Payments = Payments + 1, Revenue = Revenue + NEW.Amount;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_payments_delete AFTER DELETE ON payments BEGIN
+        UPDATE monthly_revenue SET Payments = Payments - 1, Revenue = Revenue - OLD.Amount
+            WHERE Month = substr(OLD.PaymentDate, 1, 7);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_payments_update AFTER UPDATE OF Amount, PaymentDate ON payments BEGIN
+        UPDATE monthly_revenue SET Payments = Payments - 1, Revenue = Revenue - OLD.Amount
+            WHERE Month = substr(OLD.PaymentDate, 1, 7);
+        INSERT INTO monthly_revenue (Month, Payments, Revenue) VALUES (substr(NEW.PaymentDate, 1, 7), 1, NEW.Amount)
+            ON CONFLICT(Month) DO UPDATE SET Payments = Payments + 1, Revenue = Revenue + NEW.Amount;
+    END''',
+
+    # Pet count and total age per breed
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_pets_insert AFTER INSERT ON pets BEGIN
+        INSERT INTO breed_stats (Breed, Pets, TotalAge) VALUES (NEW.Breed, 1, NEW.Age)
+            ON CONFLICT(Breed) DO UPDATE SET Pets = Pets + 1, TotalAge = TotalAge + NEW.Age;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_pets_delete AFTER DELETE ON pets BEGIN
+        UPDATE breed_stats SET Pets = Pets - 1, TotalAge = TotalAge - OLD.Age WHERE Breed = OLD.Breed;
+        DELETE FROM breed_stats WHERE Breed = OLD.Breed AND Pets <= 0;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_pets_update AFTER UPDATE OF Breed, Age ON pets BEGIN
+        UPDATE breed_stats SET Pets = Pets - 1, TotalAge = TotalAge - OLD.Age WHERE Breed = OLD.Breed;
+        DELETE FROM breed_stats WHERE Breed = OLD.Breed AND Pets <= 0;
+        INSERT INTO breed_stats (Breed, Pets, TotalAge) VALUES (NEW.Breed, 1, NEW.Age)
+            ON CONFLICT(Breed) DO UPDATE SET Pets = Pets + 1, TotalAge = TotalAge + NEW.Age;
+    END''',
+]
+
+# Breed stats count pets that are still on file (migration 8).
+SOFT_DELETE_SCHEMA = [
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_pets_soft_delete AFTER UPDATE OF DeletedAt ON pets
+        WHEN (OLD.DeletedAt IS NULL) != (NEW.DeletedAt IS NULL) BEGIN
+        UPDATE breed_stats SET Pets = Pets - 1, TotalAge = TotalAge - OLD.Age
+            WHERE Breed = OLD.Breed AND NEW.DeletedAt IS NOT NULL;
+        DELETE FROM breed_stats WHERE Breed = OLD.Breed AND Pets <= 0;
+        INSERT INTO breed_stats (Breed, Pets, TotalAge) SELECT NEW.Breed, 1, NEW.Age WHERE NEW.DeletedAt IS NULL
+            ON CONFLICT(Breed) DO UPDATE SET Pets = Pets + 1, TotalAge = TotalAge + NEW.Age;
+    END''',
+]
+
+# Pets open for adoption: available and still on file (migration 12). A
+# total of its own, since total pets minus adopted pets counts soft-deleted
+# and archived pets on one side but not the other, and drifts below zero.
+OPEN_PETS_REBUILD = '''INSERT OR REPLACE INTO dashboard_totals (Name, Value)
+    SELECT 'open_pets', COUNT(*) FROM pets WHERE Status = 'available' AND DeletedAt IS NULL'''
+
+OPEN_PETS_SCHEMA = [
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_open_pets_insert AFTER INSERT ON pets
+        WHEN NEW.Status = 'available' AND NEW.DeletedAt IS NULL BEGIN
+        UPDATE dashboard_totals SET Value = Value + 1 WHERE Name = 'open_pets';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_open_pets_delete AFTER DELETE ON pets
+        WHEN OLD.Status = 'available' AND OLD.DeletedAt IS NULL BEGIN
+        UPDATE dashboard_totals SET Value = Value - 1 WHERE Name = 'open_pets';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS dashboard_open_pets_update AFTER UPDATE OF Status, DeletedAt ON pets
+        WHEN (OLD.Status = 'available' AND OLD.DeletedAt IS NULL)
+            != (NEW.Status = 'available' AND NEW.DeletedAt IS NULL) BEGIN
+        UPDATE dashboard_totals SET Value = Value + 1 WHERE Name = 'open_pets'
+            AND NEW.Status = 'available' AND NEW.DeletedAt IS NULL;
+        UPDATE dashboard_totals SET Value = Value - 1 WHERE Name = 'open_pets'
+            AND OLD.Status = 'available' AND OLD.DeletedAt IS NULL;
+    END''',
+    OPEN_PETS_REBUILD,
+]
+
+# Recomputes every summary table from the base tables, for backfills and for
+# correcting drift after bulk edits made with triggers disabled. The sources
+# are filled in by rebuild_statements().
+REBUILD = [
+    "DELETE FROM monthly_adoptions",
+    '''INSERT INTO monthly_adoptions (Month, Adoptions)
+        SELECT substr(AdoptionDate, 1, 7), COUNT(*) FROM %(adoptions)s GROUP BY 1''',
+    "DELETE FROM monthly_revenue",
+    '''INSERT INTO monthly_revenue (Month, Payments, Revenue)
+        SELECT substr(PaymentDate, 1, 7), COUNT(*), SUM(Amount) FROM %(payments)s GROUP BY 1''',
+    "DELETE FROM breed_stats",
+    '''INSERT INTO breed_stats (Breed, Pets, TotalAge)
+        SELECT Breed, COUNT(*), SUM(Age) FROM %(pets)s GROUP BY Breed''',
+    '''INSERT OR REPLACE INTO dashboard_totals (Name, Value)
+        SELECT 'adopted_pets', COUNT(DISTINCT PetID) FROM %(adoptions)s''',
+]
+
+MONTHS_SHOWN = 24
+
+
+def rebuild_statements(adoptions='adoptions', payments='payments', pets='pets'):
+    return [sql % {'adoptions': adoptions, 'payments': payments, 'pets': pets} for sql in REBUILD]
+
+
+def rebuild(conn):
+    # Archived adoptions and payments still count towards the history; the
+    # archive views are there when the connection has the archive attached.
+    # Open pets are recounted too; migration 3's REBUILD predates Status.
+    archived = conn.execute("SELECT 1 FROM temp.sqlite_master WHERE name = 'all_adoptions'").fetchone()
+    statements = rebuild_statements(
+        adoptions='all_adoptions' if archived else 'adoptions',
+        payments='all_payments' if archived else 'payments',
+        pets='(SELECT * FROM pets WHERE DeletedAt IS NULL)')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for sql in statements + [OPEN_PETS_REBUILD]:
+            conn.execute(sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+dashboard_html = """
+{% extends "base.html" %}
+{% block content %}
+<h4>Dashboard</h4>
+<div class="row mb-4">
+  <div class="col-auto"><div class="card card-body"><strong>{{ total_pets }}</strong> pets</div></div>
+  <div class="col-auto"><div class="card card-body"><strong>{{ adopted }}</strong> adopted</div></div>
+  <div class="col-auto"><div class="card card-body"><strong>{{ open_pets }}</strong> open</div></div>
+</div>
+<div class="row">
+  <div class="col-md-6">
+    <h5>Adoptions and Revenue per Month</h5>
+    <table class="table table-bordered table-sm">
+    <tr><th>Month</th><th>Adoptions</th><th>Payments</th><th>Revenue</th></tr>
+    {% for m in months %}
+    <tr><td>{{m[0]}}</td><td>{{m[1]}}</td><td>{{m[2]}}</td><td>{{ '%.2f'|format(m[3]) }}</td></tr>
+    {% endfor %}
+    </table>
+  </div>
+  <div class="col-md-6">
+    <h5>Average Age by Breed</h5>
+    <table class="table table-bordered table-sm">
+    <tr><th>Breed</th><th>Pets</th><th>Average Age</th></tr>
+    {% for b in breeds %}
+    <tr><td>{{b[0]}}</td><td>{{b[1]}}</td><td>{{ '%.1f'|format(b[2]) }}</td></tr>
+    {% endfor %}
+    </table>
+  </div>
+</div>
+{% endblock %}
+"""
+
+
+@bp.route('/dashboard')
+@cached('pets', 'adoptions', 'payments')
+def dashboard():
+    conn = get_db()
+    months = conn.execute('''
+        SELECT Month, SUM(Adoptions), SUM(Payments), SUM(Revenue) FROM (
+            SELECT Month, Adoptions, 0 AS Payments, 0.0 AS Revenue FROM monthly_adoptions
+            UNION ALL
+            SELECT Month, 0, Payments, Revenue FROM monthly_revenue
+        ) GROUP BY Month HAVING SUM(Adoptions) > 0 OR SUM(Payments) > 0
+        ORDER BY Month DESC LIMIT ?''', (MONTHS_SHOWN,)).fetchall()
+    breeds = conn.execute(
+        "SELECT Breed, Pets, CAST(TotalAge AS REAL) / Pets FROM breed_stats WHERE Pets > 0 ORDER BY Breed").fetchall()
+    total_pets = conn.execute("SELECT Total FROM row_counts WHERE TableName='pets'").fetchone()[0]
+    totals = dict(conn.execute("SELECT Name, Value FROM dashboard_totals"))
+    return render_template('dashboard.html', months=months, breeds=breeds, total_pets=total_pets,
+                           adopted=totals.get('adopted_pets', 0), open_pets=totals.get('open_pets', 0))
+
+
+@bp.cli.command('rebuild')
+def rebuild_command():
+    """Recompute the dashboard summary tables from scratch."""
+    started = time.perf_counter()
+    rebuild(get_db())
+    invalidate('pets', 'adoptions', 'payments')
+    click.echo('Dashboard aggregates rebuilt in %.2fs' % (time.perf_counter() - started))
+
+
+def init_app(app):
+    register_templates(app, {'dashboard.html': dashboard_html})
+    app.register_blueprint(bp)
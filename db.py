@@ -0,0 +1,221 @@
+import queue
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, jsonify
+
+
+# ---------- CONNECTION POOL ----------
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by all request threads."""
+
+    def __init__(self, database, size=5, timeout=30.0, busy_timeout=5000, factory=sqlite3.Connection,
+                 setup=None, uri=False):
+        self.database = database
+        # uri=True reads database as a file: URI (e.g. ?mode=ro).
+        self.uri = uri
+        self.factory = factory
+        # setup(conn), if given, runs on every new connection after the
+        # PRAGMAs below (e.g. to ATTACH another database).
+        self.setup = setup
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'created': 0,
+            'connect_seconds': 0.0,
+            'discarded': 0,
+            'leaks': 0,
+        }
+
+    def _connect(self):
+        # Connection-level settings are applied once, when the connection is
+        # opened, so a checkout from the idle queue costs nothing extra.
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout / 1000,
+                               check_same_thread=False, factory=self.factory, uri=self.uri)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA busy_timeout=%d' % self.busy_timeout)
+        conn.execute('PRAGMA foreign_keys=ON')
+        if self.setup is not None:
+            self.setup(conn)
+        with self._lock:
+            self._stats['created'] += 1
+            self._stats['connect_seconds'] += time.perf_counter() - started
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._open -= 1
+            self._stats['discarded'] += 1
+
+    def acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                with self._lock:
+                    if self._open < self.size:
+                        self._open += 1
+                        reserve = True
+                    else:
+                        reserve = False
+                        self._stats['waits'] += 1
+                if reserve:
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                else:
+                    started = time.perf_counter()
+                    try:
+                        conn = self._idle.get(timeout=self.timeout)
+                    except queue.Empty:
+                        raise RuntimeError('timed out waiting for a database connection')
+                    with self._lock:
+                        self._stats['wait_seconds'] += time.perf_counter() - started
+            if self._healthy(conn):
+                break
+            self._discard(conn)
+        with self._lock:
+            self._stats['checkouts'] += 1
+        return conn
+
+    def release(self, conn):
+        # A connection handed back with an open transaction means the caller
+        # forgot to commit; roll it back so the next user starts clean.
+        if conn.in_transaction:
+            with self._lock:
+                self._stats['leaks'] += 1
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self._discard(conn)
+                return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._open
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        return stats
+
+
+# ---------- WRITE TRANSACTIONS ----------
+class DatabaseBusy(Exception):
+    """The write lock could not be taken within the allowed retries."""
+
+
+def is_busy(e):
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    code = getattr(e, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'locked' in str(e) or 'busy' in str(e)
+
+
+def run_immediate(conn, work, retries=5, backoff=0.01):
+    # Runs work(conn) in a BEGIN IMMEDIATE transaction, so the write lock is
+    # taken up front and whatever work() reads cannot change before it
+    # commits. SQLITE_BUSY (after the connection's own busy_timeout) is
+    # retried with jittered exponential backoff. Returns (result, attempts).
+    for attempt in range(1, retries + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(conn)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            return result, attempt
+        except sqlite3.OperationalError as e:
+            if not is_busy(e):
+                raise
+            if attempt == retries:
+                raise DatabaseBusy('database is busy, gave up after %d attempts' % attempt) from e
+            time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+
+# ---------- FLASK INTEGRATION ----------
+def init_app(app):
+    app.config.setdefault('DB_POOL_SIZE', 5)
+    app.config.setdefault('DB_POOL_TIMEOUT', 30.0)
+    app.config.setdefault('DB_BUSY_TIMEOUT', 5000)
+    pool = ConnectionPool(app.config['DATABASE'],
+                          size=app.config['DB_POOL_SIZE'],
+                          timeout=app.config['DB_POOL_TIMEOUT'],
+                          busy_timeout=app.config['DB_BUSY_TIMEOUT'])
+    app.extensions['db_pool'] = pool
+    app.teardown_appcontext(close_db)
+    app.add_url_rule('/admin/pool', 'pool_stats', pool_stats)
+    return pool
+
+
+def get_pool():
+    # A request for a tenant (see tenancy.py) uses that tenant's pool.
+    pool = g.get('db_pool')
+    if pool is not None:
+        return pool
+    return current_app.extensions['db_pool']
+
+
+def get_db():
+    if 'db' not in g:
+        started = time.perf_counter()
+        g.db = get_pool().acquire()
+        g.db_acquire_seconds = time.perf_counter() - started
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def pool_stats():
+    return jsonify(get_pool().stats())
@@ -0,0 +1,115 @@
+import csv
+import gzip
+import io
+import json
+import sys
+import zlib
+
+import click
+from flask import Blueprint, Response, request, stream_with_context
+
+from db import get_db
+from listing import LISTINGS, build_query
+
+bp = Blueprint('exporter', __name__, cli_group=None)
+
+# Rows pulled from the cursor per fetchmany call and written per chunk.
+CHUNK_SIZE = 1000
+
+TABLES = 'any(pets, adopters, adoptions, payments)'
+FORMATS = 'any(csv, jsonl)'
+
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def export_filters(table, args):
+    # Exports accept the same filters as the list pages, e.g. date_from and
+    # date_to on AdoptionDate/PaymentDate, and scope=all for archived rows.
+    return {k: v for k, v in args.items() if (k in LISTINGS[table]['filters'] or k == 'scope') and v}
+
+
+def export_chunks(conn, table, filters, fmt):
+    sql, params, _ = build_query(table, filters)
+    c = conn.execute(sql, params)
+    names = [d[0] for d in c.description]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if fmt == 'csv':
+        writer.writerow(names)
+    while True:
+        rows = c.fetchmany(CHUNK_SIZE)
+        if not rows:
+            break
+        if fmt == 'csv':
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                buf.write(json.dumps(dict(zip(names, row))))
+                buf.write('\n')
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@bp.route('/export/<%s:table>.<%s:fmt>' % (TABLES, FORMATS))
+def export(table, fmt, gz=False):
+    gz = gz or request.args.get('gzip') == '1'
+    chunks = export_chunks(get_db(), table, export_filters(table, request.args), fmt)
+    filename = '%s.%s' % (table, fmt)
+    if gz:
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        chunks = (chunk.encode() for chunk in chunks)
+        mimetype = MIMETYPES[fmt]
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+
+@bp.route('/export/<%s:table>.<%s:fmt>.gz' % (TABLES, FORMATS))
+def export_gz(table, fmt):
+    return export(table, fmt, gz=True)
+
+
+@bp.cli.command('export')
+@click.argument('table', type=click.Choice(list(LISTINGS)))
+@click.argument('output', default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+@click.option('--gzip', 'gz', is_flag=True, help='Compress the output with gzip.')
+@click.option('--date-from', help='Earliest AdoptionDate/PaymentDate (YYYY-MM-DD).')
+@click.option('--date-to', help='Latest AdoptionDate/PaymentDate (YYYY-MM-DD).')
+@click.option('--archive', 'with_archive', is_flag=True, help='Include archived adoptions/payments.')
+def export_command(table, output, fmt, gz, date_from, date_to, with_archive):
+    """Export TABLE to OUTPUT (default stdout) as CSV or JSONL."""
+    filters = export_filters(table, {'date_from': date_from, 'date_to': date_to,
+                                     'scope': 'all' if with_archive else None})
+    chunks = export_chunks(get_db(), table, filters, fmt)
+    if output == '-':
+        stream = sys.stdout.buffer
+        if gz:
+            stream = gzip.GzipFile(fileobj=stream, mode='wb')
+    else:
+        stream = gzip.open(output, 'wb') if gz else open(output, 'wb')
+    try:
+        for chunk in chunks:
+            stream.write(chunk.encode())
+    finally:
+        if stream is not sys.stdout.buffer:
+            stream.close()
+
+
+def init_app(app):
+    app.register_blueprint(bp)
@@ -0,0 +1,232 @@
+import csv
+import datetime
+import io
+import json
+import sqlite3
+import time
+
+import click
+from flask import Blueprint, render_template, request
+
+from cache import invalidate
+from db import get_db
+from templating import register_templates
+
+bp = Blueprint('importer', __name__, cli_group=None)
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+# Importable columns per table and how each value is validated. 'key' columns
+# may be left blank to let SQLite assign the next AdoptionID/PaymentID.
+IMPORTS = {
+    'pets': [('PetID', 'text'), ('PetName', 'text'), ('Breed', 'text'), ('Age', 'int'),
+             ('HealthStatus', 'text')],
+    'adopters': [('AdopterID', 'text'), ('FirstName', 'text'), ('LastName', 'text'),
+                 ('Contact', 'text'), ('Address', 'text'), ('City', 'text'),
+                 ('State', 'text'), ('Country', 'text')],
+    'adoptions': [('AdoptionID', 'key'), ('PetID', 'text'), ('AdopterID', 'text'),
+                  ('AdoptionDate', 'date')],
+    'payments': [('PaymentID', 'key'), ('AdoptionID', 'int'), ('Amount', 'real'),
+                 ('PaymentDate', 'date')],
+}
+
+
+# ---------- PARSING ----------
+def detect_format(filename, fmt=None):
+    if fmt:
+        return fmt.lower()
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_records(stream, fmt):
+    # Yields (line number, record) one row at a time; a record that cannot
+    # be parsed is yielded as the ValueError describing why.
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_num, ValueError('invalid JSON: %s' % e)
+                continue
+            if not isinstance(record, dict):
+                record = ValueError('expected a JSON object')
+            yield line_num, record
+    else:
+        raise ValueError('unsupported format: %s' % fmt)
+
+
+def clean_value(name, kind, value):
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == '':
+        if kind == 'key':
+            return None
+        raise ValueError('value is required')
+    if kind in ('int', 'key'):
+        value = int(value)
+        if value < 0:
+            raise ValueError('must not be negative')
+        return value
+    if kind == 'real':
+        return float(value)
+    if kind == 'date':
+        return datetime.date.fromisoformat(str(value)).isoformat()
+    return str(value)
+
+
+def clean_record(table, record):
+    values = []
+    for name, kind in IMPORTS[table]:
+        try:
+            values.append(clean_value(name, kind, record.get(name)))
+        except (TypeError, ValueError) as e:
+            raise ValueError('%s: %s' % (name, e))
+    return values
+
+
+# ---------- LOADING ----------
+class ImportReport:
+    def __init__(self, table):
+        self.table = table
+        self.rows = 0
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        return '%s: %d rows read, %d inserted, %d rejected in %.2fs (%.0f rows/s)' % (
+            self.table, self.rows, self.inserted, self.error_count, self.seconds,
+            self.rows_per_second)
+
+
+def flush_batch(conn, sql, batch, report):
+    # The whole batch goes in with one executemany; if any row violates a
+    # constraint the batch is replayed row by row to find the bad ones.
+    conn.execute('SAVEPOINT import_batch')
+    try:
+        conn.executemany(sql, [values for _, values in batch])
+        report.inserted += len(batch)
+    except sqlite3.IntegrityError:
+        conn.execute('ROLLBACK TO import_batch')
+        for line, values in batch:
+            try:
+                conn.execute(sql, values)
+                report.inserted += 1
+            except sqlite3.IntegrityError as e:
+                report.error(line, str(e))
+    conn.execute('RELEASE import_batch')
+    conn.commit()
+
+
+def import_records(conn, table, records, batch_size=BATCH_SIZE):
+    columns = [name for name, _ in IMPORTS[table]]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        table, ', '.join(columns), ', '.join('?' * len(columns)))
+    report = ImportReport(table)
+    batch = []
+    for line, record in records:
+        report.rows += 1
+        if isinstance(record, Exception):
+            report.error(line, str(record))
+            continue
+        try:
+            batch.append((line, clean_record(table, record)))
+        except ValueError as e:
+            report.error(line, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush_batch(conn, sql, batch, report)
+            batch = []
+    if batch:
+        flush_batch(conn, sql, batch, report)
+    report.seconds = time.perf_counter() - report.started
+    return report
+
+
+# ---------- ROUTES ----------
+import_html = """
+{% extends "base.html" %}
+{% block content %}
+<h4>Bulk Import</h4>
+{% if report %}
+<div class="alert {{ 'alert-warning' if report.error_count else 'alert-success' }}">{{ report.summary() }}</div>
+{% if report.errors %}
+<table class="table table-bordered table-sm">
+<tr><th>Line</th><th>Error</th></tr>
+{% for line, message in report.errors %}
+<tr><td>{{line}}</td><td>{{message}}</td></tr>
+{% endfor %}
+</table>
+{% if report.error_count > report.errors|length %}<p class="text-muted">Only the first {{ report.errors|length }} errors are shown.</p>{% endif %}
+{% endif %}
+{% endif %}
+<form method="POST" enctype="multipart/form-data">
+  <select name="table" class="form-select">
+    {% for t in tables %}<option value="{{t}}">{{t}}</option>{% endfor %}
+  </select><br>
+  <input name="file" type="file" class="form-control" accept=".csv,.jsonl,.ndjson" required><br>
+  <button class="btn btn-success">Import</button>
+</form>
+<p class="text-muted mt-3">CSV files need a header row; JSONL files hold one JSON object per line.
+Columns are the table's field names, e.g. {{ ', '.join(columns['pets']) }} for pets.</p>
+{% endblock %}
+"""
+
+
+@bp.route('/import', methods=['GET', 'POST'])
+def import_page():
+    report = None
+    if request.method == 'POST':
+        table = request.form['table']
+        if table not in IMPORTS:
+            return 'Unknown table', 400
+        upload = request.files['file']
+        fmt = detect_format(upload.filename, request.form.get('format'))
+        if fmt not in ('csv', 'jsonl'):
+            return 'Unsupported format', 400
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        report = import_records(get_db(), table, read_records(stream, fmt))
+        invalidate(table)
+    columns = {t: [name for name, _ in cols] for t, cols in IMPORTS.items()}
+    return render_template('import.html', report=report, tables=list(IMPORTS), columns=columns)
+
+
+@bp.cli.command('import')
+@click.argument('table', type=click.Choice(list(IMPORTS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+def import_command(table, path, fmt, batch_size):
+    """Bulk load TABLE from a CSV or JSONL file."""
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        report = import_records(get_db(), table, read_records(stream, detect_format(path, fmt)),
+                                batch_size=batch_size)
+    invalidate(table)
+    for line, message in report.errors:
+        click.echo('line %d: %s' % (line, message), err=True)
+    click.echo(report.summary())
+
+
+def init_app(app):
+    register_templates(app, {'import.html': import_html})
+    app.register_blueprint(bp)
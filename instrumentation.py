@@ -0,0 +1,490 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, before_render_template, current_app, g, has_app_context, request, template_rendered
+
+from db import get_pool
+
+PREFIX = 'petadoption_'
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# SQL text is used as the statement label, whitespace-collapsed and cut to
+# this length so the label set stays readable.
+STATEMENT_LABEL_LENGTH = 160
+
+DESCRIPTIONS = [
+    ('http_requests_total', 'counter', 'Requests served, by endpoint, method and status.'),
+    ('http_request_duration_seconds', 'histogram', 'Time from the start of a request to the last byte of its body.'),
+    ('http_response_bytes_total', 'counter', 'Response body bytes sent, by endpoint.'),
+    ('http_compressed_responses_total', 'counter', 'Responses sent compressed, by content encoding.'),
+    ('sql_statements_total', 'counter', 'SQL statements executed, by statement.'),
+    ('sql_seconds_total', 'counter', 'Time spent executing statements and fetching their rows.'),
+    ('sql_rows_total', 'counter', 'Rows fetched (or changed, for executemany), by statement.'),
+    ('template_render_seconds', 'histogram', 'Template render time, excluding the SQL it drives.'),
+    ('db_connections_created_total', 'counter', 'SQLite connections opened by the pool.'),
+    ('db_connect_seconds_total', 'counter', 'Time spent opening SQLite connections.'),
+    ('db_checkouts_total', 'counter', 'Connections handed out by the pool.'),
+    ('db_pool_waits_total', 'counter', 'Checkouts that had to wait for a free connection.'),
+    ('db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a free connection.'),
+    ('db_pool_connections', 'gauge', 'Pool connections, by state.'),
+    ('page_cache_lookups_total', 'counter', 'Page cache lookups, by result (not_modified: answered 304 from the ETag).'),
+    ('adoptions_total', 'counter', 'Adopt-and-pay requests, by result.'),
+    ('adoption_attempts_total', 'counter', 'Transaction attempts behind successful adoptions (more than one means busy retries).'),
+    ('writes_total', 'counter', 'Write-behind writes, by result (committed, failed, rejected when the queue is full).'),
+    ('write_batches_total', 'counter', 'Write-behind batches committed.'),
+    ('write_queue_wait_seconds', 'histogram', 'Time a write spent queued before its batch started.'),
+    ('write_commit_seconds', 'histogram', 'Time to run and commit one write-behind batch.'),
+    ('write_queue_depth', 'gauge', 'Writes waiting in the write-behind queue.'),
+    ('write_queue_capacity', 'gauge', 'Size of the write-behind queue.'),
+    ('match_refreshes_total', 'counter', 'Match index refreshes that applied changes, by mode (incremental, rebuild).'),
+    ('match_refresh_seconds', 'histogram', 'Time to apply one round of match index changes.'),
+    ('jobs_total', 'counter', 'Job runs finished, by job and result (done, retry, failed).'),
+    ('job_seconds', 'histogram', 'Time one job run took, by job.'),
+    ('tenants_open', 'gauge', 'Shelter databases this process has open.'),
+    ('tenant_evictions_total', 'counter', 'Idle shelter databases closed to make room for another.'),
+    ('snapshot_refreshes_total', 'counter', 'Reporting snapshot refreshes, by result (copied, unchanged, failed).'),
+    ('snapshot_refresh_seconds', 'histogram', 'Time to copy the live database into the reporting snapshot.'),
+    ('snapshot_age_seconds', 'gauge', 'Age of the reporting snapshot.'),
+]
+
+
+# ---------- METRICS ----------
+def label_text(labels):
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for k, v in labels)
+
+
+class Metrics:
+    """Thread-safe counters, gauges and histograms in the Prometheus text format."""
+
+    def __init__(self, descriptions=DESCRIPTIONS):
+        self.descriptions = descriptions
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(BUCKETS), 0, 0.0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += 1
+            histogram[2] += value
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted((k, (list(b), c, s)) for k, (b, c, s) in self._histograms.items())
+        lines = []
+        for name, kind, text in self.descriptions:
+            lines.append('# HELP %s%s %s' % (PREFIX, name, text))
+            lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+            if kind != 'histogram':
+                for (n, labels), value in values:
+                    if n == name:
+                        lines.append('%s%s%s %s' % (PREFIX, name, label_text(labels), value))
+                continue
+            for (n, labels), (buckets, count, total) in histograms:
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, hits in zip(BUCKETS, buckets):
+                    cumulative += hits
+                    lines.append('%s%s_bucket%s %d' % (PREFIX, name, label_text(labels + (('le', bound),)), cumulative))
+                lines.append('%s%s_bucket%s %d' % (PREFIX, name, label_text(labels + (('le', '+Inf'),)), count))
+                lines.append('%s%s_sum%s %r' % (PREFIX, name, label_text(labels), total))
+                lines.append('%s%s_count%s %d' % (PREFIX, name, label_text(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimings:
+    """What one request spent its time on; feeds the Server-Timing header."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_seconds = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.render_seconds = 0.0
+        self.renders = []
+
+    def server_timing(self, acquire_seconds=None):
+        ms = lambda seconds: '%.3f' % (seconds * 1000)
+        parts = []
+        if acquire_seconds is not None:
+            parts.append('db;desc="connection checkout";dur=' + ms(acquire_seconds))
+        parts.append('sql;desc="%d statements, %d rows";dur=%s' % (self.statements, self.rows, ms(self.sql_seconds)))
+        parts.append('tpl;desc="template render";dur=' + ms(self.render_seconds))
+        parts.append('app;desc="until headers";dur=' + ms(time.perf_counter() - self.started))
+        return ', '.join(parts)
+
+
+# ---------- SQL TIMING ----------
+@functools.lru_cache(maxsize=1024)
+def statement_label(sql):
+    return ' '.join(sql.split())[:STATEMENT_LABEL_LENGTH]
+
+
+def current_sink():
+    if not has_app_context():
+        return None
+    metrics = current_app.extensions.get('metrics')
+    if metrics is None:
+        return None
+    return metrics, g.get('timings')
+
+
+def record_statement(sink, label, seconds, rows, executed):
+    metrics, timings = sink
+    if executed:
+        metrics.inc('sql_statements_total', statement=label)
+    metrics.inc('sql_seconds_total', seconds, statement=label)
+    if rows:
+        metrics.inc('sql_rows_total', rows, statement=label)
+    if timings is not None:
+        timings.sql_seconds += seconds
+        timings.statements += executed
+        timings.rows += rows
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that charges execute and fetch time, and rows, to its statement.
+
+    Rows read by iterating the cursor are tallied locally and reported when
+    the iteration ends, the cursor is reused or closed, or it is collected,
+    so a streamed page does not take the metrics lock once per row.
+    """
+    _sink = None
+    _label = None
+    _pending_seconds = 0.0
+    _pending_rows = 0
+
+    def _flush(self):
+        if self._sink is not None and (self._pending_rows or self._pending_seconds):
+            record_statement(self._sink, self._label, self._pending_seconds, self._pending_rows, 0)
+        self._pending_seconds = 0.0
+        self._pending_rows = 0
+
+    def _timed(self, label, call, args, count_changes=False):
+        self._flush()
+        self._sink = current_sink()
+        self._label = label
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            if self._sink is not None:
+                rows = max(self.rowcount, 0) if count_changes else 0
+                record_statement(self._sink, label, time.perf_counter() - started, rows, 1)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(statement_label(sql), super().execute, (sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(statement_label(sql), super().executemany, (sql, seq_of_parameters), True)
+
+    def executescript(self, sql_script):
+        return self._timed('script', super().executescript, (sql_script,))
+
+    def _fetched(self, started, rows):
+        if self._sink is not None:
+            record_statement(self._sink, self._label, time.perf_counter() - started, rows, 0)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._pending_seconds += time.perf_counter() - started
+            self._flush()
+            raise
+        self._pending_seconds += time.perf_counter() - started
+        self._pending_rows += 1
+        return row
+
+    def close(self):
+        self._flush()
+        super().close()
+
+    def __del__(self):
+        self._flush()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose shortcut execute methods go through TimedCursor."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# ---------- TEMPLATE TIMING ----------
+def template_started(app, template, context, **extra):
+    timings = g.get('timings')
+    if timings is not None:
+        timings.renders.append((time.perf_counter(), timings.sql_seconds))
+
+
+def template_finished(app, template, context, **extra):
+    timings = g.get('timings')
+    if timings is None or not timings.renders:
+        return
+    started, sql_before = timings.renders.pop()
+    # Streamed pages pull their rows while rendering; that time is already
+    # counted as SQL, so it is taken out of the render time.
+    seconds = max(0.0, time.perf_counter() - started - (timings.sql_seconds - sql_before))
+    timings.render_seconds += seconds
+    app.extensions['metrics'].observe('template_render_seconds', seconds, template=template.name or '')
+
+
+# ---------- REQUEST HOOKS ----------
+def start_request():
+    g.timings = RequestTimings()
+
+
+def finish_request(metrics, timings, endpoint, method, status, size):
+    metrics.inc('http_requests_total', endpoint=endpoint, method=method, status=status)
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - timings.started, endpoint=endpoint)
+    metrics.inc('http_response_bytes_total', size, endpoint=endpoint)
+
+
+def counted(response, done):
+    # Streamed bodies are only finished once the last chunk is sent, so the
+    # duration and size are recorded from inside the body iterator.
+    original = response.response
+    chunks = response.iter_encoded()
+
+    def generate():
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            close = getattr(original, 'close', None)
+            if close is not None:
+                close()
+            done(size)
+    return generate()
+
+
+def end_request(response):
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    response.headers['Server-Timing'] = timings.server_timing(g.get('db_acquire_seconds'))
+    done = functools.partial(finish_request, current_app.extensions['metrics'], timings,
+                             request.endpoint or 'unmatched', request.method, str(response.status_code))
+    if response.is_streamed:
+        response.response = counted(response, done)
+    else:
+        done(response.calculate_content_length() or 0)
+    return response
+
+
+def metrics_view():
+    metrics = current_app.extensions['metrics']
+    stats = get_pool().stats()
+    metrics.set('db_connections_created_total', stats['created'])
+    metrics.set('db_connect_seconds_total', stats['connect_seconds'])
+    metrics.set('db_checkouts_total', stats['checkouts'])
+    metrics.set('db_pool_waits_total', stats['waits'])
+    metrics.set('db_pool_wait_seconds_total', stats['wait_seconds'])
+    for state in ('idle', 'in_use'):
+        metrics.set('db_pool_connections', stats[state], state=state)
+    page_cache = current_app.extensions.get('page_cache')
+    if page_cache is not None:
+        cache_stats = page_cache.stats()
+        for result, key in (('hit', 'hits'), ('miss', 'misses'), ('not_modified', 'not_modified')):
+            metrics.set('page_cache_lookups_total', cache_stats[key], result=result)
+    writer = current_app.extensions.get('write_behind')
+    if writer is not None:
+        write_stats = writer.stats()
+        metrics.set('write_queue_depth', write_stats['depth'])
+        metrics.set('write_queue_capacity', write_stats['capacity'])
+    snapshot = current_app.extensions.get('snapshot')
+    if snapshot is not None:
+        metrics.set('snapshot_age_seconds', round(snapshot.age(), 3))
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# ---------- PROFILING ----------
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval.
+
+    The samples are kept as folded stacks ('outer;inner;leaf count'), the
+    input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (getattr(code, 'co_qualname', code.co_name),
+                                             os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join('%s %d\n' % item for item in sorted(self.samples.items()))
+
+    def report(self, top=30):
+        total = sum(self.samples.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        out = io.StringIO()
+        out.write('%d samples every %.1f ms over %.1f ms\n' % (total, self.interval * 1000, self.elapsed * 1000))
+        for title, counts in (('self', own), ('total', inclusive)):
+            out.write('\nTop functions by %s samples\n' % title)
+            for frame, count in counts.most_common(top):
+                out.write('%6d %5.1f%%  %s\n' % (count, count * 100.0 / total if total else 0, frame))
+        return out.getvalue()
+
+
+class DeterministicProfiler:
+    """cProfile over one request, reported as pstats sorted by cumulative time."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self, top=40):
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(top)
+        return out.getvalue()
+
+
+def profiling_allowed():
+    if not current_app.config['PROFILE_ENABLED']:
+        return False
+    token = current_app.config['PROFILE_TOKEN']
+    return not token or token in (request.headers.get('X-Profile-Token'), request.args.get('token'))
+
+
+def start_profile():
+    # ?profile=1 samples the stack, ?profile=folded returns the raw samples
+    # for a flame graph and ?profile=cprofile traces every call.
+    mode = request.args.get('profile')
+    if not mode or not profiling_allowed():
+        return
+    if mode == 'cprofile':
+        profiler = DeterministicProfiler()
+    else:
+        profiler = SamplingProfiler(current_app.config['PROFILE_INTERVAL'])
+    g.profile = (mode, profiler)
+    g.cache_bypass = True
+    profiler.start()
+
+
+def end_profile(response):
+    # Runs before end_request (after_request hooks run in reverse), so the
+    # report replaces the page and the request's metrics describe the report.
+    mode, profiler = g.pop('profile', (None, None))
+    if profiler is None:
+        return response
+    try:
+        response.get_data()
+    finally:
+        profiler.stop()
+        response.close()
+    body = profiler.folded() if mode == 'folded' else profiler.report()
+    return Response(body, mimetype='text/plain')
+
+
+# ---------- FLASK INTEGRATION ----------
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('PROFILE_ENABLED', False)
+    app.config.setdefault('PROFILE_TOKEN', None)
+    app.config.setdefault('PROFILE_INTERVAL', 0.001)
+    if app.config['METRICS_ENABLED']:
+        app.extensions['metrics'] = Metrics()
+        app.extensions['db_pool'].factory = TimedConnection
+        before_render_template.connect(template_started, app)
+        template_rendered.connect(template_finished, app)
+        app.before_request(start_request)
+        app.after_request(end_request)
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+    if app.config['PROFILE_ENABLED']:
+        app.before_request(start_profile)
+        app.after_request(end_profile)
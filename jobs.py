@@ -0,0 +1,754 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import Blueprint, abort, current_app, g, redirect, render_template, send_from_directory, url_for
+
+import archive
+import dashboard
+import matching
+from cache import invalidate
+from db import ConnectionPool, get_db, run_immediate
+from exporter import export_chunks
+from templating import register_templates
+
+log = logging.getLogger(__name__)
+
+bp = Blueprint('jobs', __name__)
+
+# Periodic and one-off work that must not run inside a request. Every run is
+# a row in job_runs, so queued and interrupted runs survive a restart; jobs
+# holds each schedule's next run time. The runner (a scheduler thread plus a
+# small thread pool, started by the serving process or by "flask jobs
+# worker", never by CLI commands or the reloader's watcher process) claims
+# runs inside BEGIN IMMEDIATE, so several processes can share one queue.
+# Every database has its queue and runner: the app's own, and each shelter's
+# (tenancy.py) while it is open; schedules missed while a shelter was closed
+# run once when it is next opened.
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS jobs (
+        Name TEXT PRIMARY KEY,
+        Schedule TEXT,
+        NextRunAt TEXT,
+        Paused INTEGER NOT NULL DEFAULT 0
+    )''',
+    '''CREATE TABLE IF NOT EXISTS job_runs (
+        RunID INTEGER PRIMARY KEY,
+        Name TEXT NOT NULL,
+        Args TEXT NOT NULL DEFAULT '{}',
+        Status TEXT NOT NULL DEFAULT 'queued',
+        Attempts INTEGER NOT NULL DEFAULT 0,
+        MaxAttempts INTEGER NOT NULL DEFAULT 1,
+        RunAfter TEXT NOT NULL,
+        QueuedAt TEXT NOT NULL,
+        StartedAt TEXT,
+        FinishedAt TEXT,
+        LeaseUntil TEXT,
+        Owner TEXT,
+        Result TEXT,
+        Error TEXT
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_job_runs_queue ON job_runs(Status, RunAfter)",
+    "CREATE INDEX IF NOT EXISTS idx_job_runs_name ON job_runs(Name, RunID)",
+    # Follow-up calls due N days after an adoption. No foreign key: archived
+    # adoptions leave the hot database.
+    '''CREATE TABLE IF NOT EXISTS adoption_reminders (
+        AdoptionID INTEGER NOT NULL,
+        Days INTEGER NOT NULL,
+        DueDate TEXT NOT NULL,
+        CreatedAt TEXT NOT NULL,
+        DoneAt TEXT,
+        PRIMARY KEY (AdoptionID, Days)
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_adoption_reminders_open ON adoption_reminders(DoneAt, DueDate)",
+]
+
+
+# ---------- TIME ----------
+def utc(dt):
+    # A datetime (naive ones are local time) in the format of schema.NOW.
+    dt = dt.astimezone(datetime.timezone.utc)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (dt.microsecond // 1000)
+
+
+def utcnow(seconds=0):
+    return utc(datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=seconds))
+
+
+def parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError('step must be positive')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(v) for v in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError('%s is outside %d-%d' % (part, low, high))
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """A five-field cron schedule (minute hour day month weekday), local time."""
+
+    ALIASES = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *'}
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = self.ALIASES.get(expression, expression).split()
+        if len(fields) != 5:
+            raise ValueError('cron schedule %r must have five fields' % expression)
+        try:
+            self.minutes = parse_field(fields[0], 0, 59)
+            self.hours = parse_field(fields[1], 0, 23)
+            self.days = parse_field(fields[2], 1, 31)
+            self.months = parse_field(fields[3], 1, 12)
+            self.weekdays = {d % 7 for d in parse_field(fields[4], 0, 7)}
+        except ValueError as e:
+            raise ValueError('cron schedule %r: %s' % (expression, e))
+        # As in cron, a day restricted in both fields fires on either.
+        self.any_day = fields[2].startswith('*')
+        self.any_weekday = fields[4].startswith('*')
+
+    def day_matches(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, dt):
+        t = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=5 * 366)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError('cron schedule %r never fires' % self.expression)
+
+
+# ---------- REGISTRY ----------
+class Job:
+    """A job function, func(conn, **args), and how it is run."""
+
+    def __init__(self, name, func, schedule=None, retries=2, concurrency=1, timeout=3600):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.retries = retries
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.description = (func.__doc__ or '').strip()
+
+
+JOBS = {}
+
+
+def job(name, **options):
+    def decorator(func):
+        JOBS[name] = Job(name, func, **options)
+        return func
+    return decorator
+
+
+def schedules(config):
+    # {name: cron expression or None}, JOBS_SCHEDULES overriding the defaults
+    # (None switches a schedule off).
+    overrides = config.get('JOBS_SCHEDULES') or {}
+    return {name: overrides.get(name, spec.schedule) for name, spec in JOBS.items()}
+
+
+# ---------- QUEUE ----------
+def sync_schedules(conn, wanted):
+    # Brings the jobs table in line with the registered schedules; a changed
+    # schedule gets a fresh next run time.
+    def work(conn):
+        current = {row[0]: row[1] for row in conn.execute('SELECT Name, Schedule FROM jobs')}
+        for name, schedule in wanted.items():
+            if name in current and current[name] == schedule:
+                continue
+            next_run = utc(Cron(schedule).next_after(datetime.datetime.now())) if schedule else None
+            conn.execute('INSERT INTO jobs (Name, Schedule, NextRunAt) VALUES (?, ?, ?) '
+                         'ON CONFLICT(Name) DO UPDATE SET Schedule = excluded.Schedule, NextRunAt = excluded.NextRunAt',
+                         (name, schedule, next_run))
+    run_immediate(conn, work)
+
+
+def enqueue(conn, name, args=None, delay=0):
+    # Queues a run of a registered job; returns its RunID. Commits.
+    spec = JOBS[name]
+
+    def work(conn):
+        return conn.execute(
+            'INSERT INTO job_runs (Name, Args, MaxAttempts, RunAfter, QueuedAt) VALUES (?, ?, ?, ?, ?)',
+            (name, json.dumps(args or {}), spec.retries + 1, utcnow(delay), utcnow())).lastrowid
+    return run_immediate(conn, work)[0]
+
+
+def queue_due(conn):
+    # One queued run per schedule that has come due, however many times it
+    # was missed while nothing was running. Returns the names queued.
+    queued = []
+    for name, schedule, next_run in conn.execute(
+            'SELECT Name, Schedule, NextRunAt FROM jobs WHERE NOT Paused AND NextRunAt <= ?', (utcnow(),)).fetchall():
+        if name not in JOBS:
+            continue
+        following = utc(Cron(schedule).next_after(datetime.datetime.now()))
+
+        def work(conn):
+            # Another process may have queued it first.
+            if conn.execute('UPDATE jobs SET NextRunAt = ? WHERE Name = ? AND NextRunAt = ?',
+                            (following, name, next_run)).rowcount:
+                conn.execute('INSERT INTO job_runs (Name, MaxAttempts, RunAfter, QueuedAt) VALUES (?, ?, ?, ?)',
+                             (name, JOBS[name].retries + 1, next_run, utcnow()))
+                return True
+            return False
+        if run_immediate(conn, work)[0]:
+            queued.append(name)
+    return queued
+
+
+def owner_id():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def process_alive(owner):
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def renew_leases(conn, owner, running):
+    # Pushes out the lease of each run this process is still executing,
+    # {RunID: name}, so no process takes it for abandoned while it runs.
+    if not running:
+        return
+
+    def work(conn):
+        for run_id, name in running.items():
+            conn.execute("UPDATE job_runs SET LeaseUntil = ? WHERE RunID = ? AND Status = 'running' AND Owner = ?",
+                         (utcnow(JOBS[name].timeout), run_id, owner))
+    run_immediate(conn, work)
+
+
+def release_abandoned(conn, running=()):
+    # Runs whose process died (on this host) or whose lease ran out go back
+    # on the queue, or fail once out of attempts. running holds the RunIDs
+    # this process is executing, which are never abandoned.
+    now = utcnow()
+    stale = [row[0] for row in conn.execute("SELECT RunID, Owner, LeaseUntil FROM job_runs WHERE Status = 'running'")
+             if row[0] not in running and (row[2] < now or not process_alive(row[1] or ''))]
+    if not stale:
+        return 0
+
+    def work(conn):
+        for run_id in stale:
+            conn.execute('''UPDATE job_runs SET Status = CASE WHEN Attempts < MaxAttempts THEN 'queued' ELSE 'failed' END,
+                Owner = NULL, LeaseUntil = NULL, Error = 'abandoned by its worker',
+                FinishedAt = CASE WHEN Attempts < MaxAttempts THEN NULL ELSE ? END
+                WHERE RunID = ? AND Status = 'running' ''', (now, run_id))
+    run_immediate(conn, work)
+    return len(stale)
+
+
+QUEUED = ("SELECT RunID, Name, Args FROM job_runs WHERE Status = 'queued' AND RunAfter <= ? "
+          "ORDER BY RunAfter, RunID LIMIT 50")
+
+
+def claim(conn, owner, run_id=None):
+    # Takes the oldest queued run whose job is below its concurrency limit;
+    # returns (RunID, name, args, attempt) or None.
+    def work(conn):
+        now = utcnow()
+        running = dict(conn.execute("SELECT Name, COUNT(*) FROM job_runs WHERE Status = 'running' GROUP BY Name"))
+        if run_id is not None:
+            candidates = conn.execute("SELECT RunID, Name, Args FROM job_runs WHERE RunID = ? AND Status = 'queued'",
+                                      (run_id,)).fetchall()
+        else:
+            candidates = conn.execute(QUEUED, (now,)).fetchall()
+        for candidate, name, args in candidates:
+            spec = JOBS.get(name)
+            if spec is None:
+                conn.execute("UPDATE job_runs SET Status = 'failed', Error = 'unknown job', FinishedAt = ? WHERE RunID = ?",
+                             (now, candidate))
+                continue
+            if running.get(name, 0) >= spec.concurrency:
+                continue
+            conn.execute("UPDATE job_runs SET Status = 'running', Attempts = Attempts + 1, StartedAt = ?, "
+                         "LeaseUntil = ?, Owner = ?, Error = NULL WHERE RunID = ?",
+                         (now, utcnow(spec.timeout), owner, candidate))
+            attempt = conn.execute('SELECT Attempts FROM job_runs WHERE RunID = ?', (candidate,)).fetchone()[0]
+            return candidate, name, json.loads(args), attempt
+        return None
+    return run_immediate(conn, work)[0]
+
+
+def finish(conn, run_id, attempt, result=None, error=None, retry_delay=60):
+    # Records the outcome of one attempt. A failed run is queued again, with
+    # exponential backoff, until it is out of attempts. Returns the run's new
+    # status, or None when the run was released as abandoned (and perhaps
+    # claimed again) while the attempt ran, so the outcome is no longer its
+    # to record.
+    def work(conn):
+        row = conn.execute('SELECT Status, Attempts, MaxAttempts FROM job_runs WHERE RunID = ?', (run_id,)).fetchone()
+        if row is None or row[0] != 'running' or row[1] != attempt:
+            return None
+        _, attempts, max_attempts = row
+        if error is None:
+            status = 'done'
+        elif attempts < max_attempts:
+            status = 'queued'
+        else:
+            status = 'failed'
+        conn.execute('''UPDATE job_runs SET Status = ?, Result = ?, Error = ?, Owner = NULL, LeaseUntil = NULL,
+            FinishedAt = CASE WHEN ? = 'queued' THEN NULL ELSE ? END,
+            RunAfter = CASE WHEN ? = 'queued' THEN ? ELSE RunAfter END WHERE RunID = ?''',
+                     (status, None if result is None else json.dumps(result), error, status, utcnow(),
+                      status, utcnow(retry_delay * 2 ** (attempts - 1)), run_id))
+        return status
+    return run_immediate(conn, work)[0]
+
+
+def execute(app, conn, run, metrics=None, retry_delay=60, tenant=None):
+    # Runs one claimed run to completion and records it; returns its status.
+    # A shelter's runs see its name as g.tenant, like its requests do.
+    run_id, name, args, attempt = run
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            if tenant is not None:
+                g.tenant = tenant
+            result = JOBS[name].func(conn, **args)
+        error = None
+    except Exception as e:
+        log.exception('job %s (run %d, attempt %d) failed', name, run_id, attempt)
+        if conn.in_transaction:
+            conn.rollback()
+        result, error = None, '%s: %s' % (type(e).__name__, e)
+    status = finish(conn, run_id, attempt, result, error, retry_delay)
+    if status is None:
+        log.warning('job %s (run %d, attempt %d) finished after its run was released; outcome not recorded',
+                    name, run_id, attempt)
+    elif metrics is not None:
+        metrics.inc('jobs_total', job=name, result='retry' if status == 'queued' else status)
+        metrics.observe('job_seconds', time.perf_counter() - started, job=name)
+    return status
+
+
+# ---------- RUNNER ----------
+class JobRunner:
+    """Scheduler thread queuing due jobs and running queued ones on a thread pool."""
+
+    def __init__(self, app, pool, tenant=None, workers=2, interval=1.0, retry_delay=60, metrics=None):
+        self.app = app
+        self.tenant = tenant
+        self.workers = workers
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.metrics = metrics
+        self.owner = owner_id()
+        # Its own connections (one per worker, one for the scheduler), made
+        # like those of the request pool of the database it runs for.
+        self._pool = ConnectionPool(pool.database, size=workers + 1, busy_timeout=pool.busy_timeout,
+                                    factory=pool.factory, setup=pool.setup)
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='job')
+        self._busy = threading.Semaphore(workers)
+        # {RunID: name} of the runs being executed; their leases are renewed
+        # on every tick for as long as they run.
+        self._running = {}
+        self._running_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='job-scheduler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self._pool.connection() as conn:
+                    with self._running_lock:
+                        running = dict(self._running)
+                    renew_leases(conn, self.owner, running)
+                    release_abandoned(conn, running)
+                    queue_due(conn)
+                    while not self._stop.is_set() and self._busy.acquire(blocking=False):
+                        run = claim(conn, self.owner)
+                        if run is None:
+                            self._busy.release()
+                            break
+                        with self._running_lock:
+                            self._running[run[0]] = run[1]
+                        self._executor.submit(self._execute, run)
+            except Exception:
+                log.exception('job scheduler failed')
+            self._stop.wait(self.interval)
+
+    def _execute(self, run):
+        try:
+            with self._pool.connection() as conn:
+                execute(self.app, conn, run, self.metrics, self.retry_delay, self.tenant)
+        except Exception:
+            log.exception('could not record job run %d', run[0])
+        finally:
+            with self._running_lock:
+                self._running.pop(run[0], None)
+            self._busy.release()
+
+    def close(self, timeout=30.0):
+        # Runs still going are left 'running'; the next start puts them back
+        # on the queue.
+        self._stop.set()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._pool.close()
+
+
+# ---------- JOBS ----------
+@job('maintenance', schedule='30 3 * * *', timeout=1800)
+def maintenance_job(conn):
+    """ANALYZE, checkpoint and truncate the WAL, prune old job runs."""
+    conn.execute('ANALYZE')
+    conn.execute("DELETE FROM job_runs WHERE FinishedAt < ?",
+                 (utcnow(-86400 * current_app.config['JOBS_HISTORY_DAYS']),))
+    conn.commit()
+    busy, frames, checkpointed = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    return {'wal_frames': frames, 'checkpointed': checkpointed, 'busy': bool(busy)}
+
+
+@job('vacuum', schedule='0 4 * * 0', retries=0, timeout=7200)
+def vacuum_job(conn):
+    """Rebuild the database files to give freed pages back (blocks writers while it runs)."""
+    sizes = {}
+    for name in [row[1] for row in conn.execute('PRAGMA database_list') if row[1] != 'temp']:
+        before = conn.execute('PRAGMA %s.page_count' % name).fetchone()[0]
+        conn.execute('VACUUM %s' % name)
+        sizes[name] = [before, conn.execute('PRAGMA %s.page_count' % name).fetchone()[0]]
+    return {'pages': sizes}
+
+
+@job('dashboard-rebuild', schedule='0 2 * * *')
+def dashboard_job(conn):
+    """Recompute the dashboard aggregates from the base tables."""
+    dashboard.rebuild(conn)
+    invalidate('pets', 'adoptions', 'payments')
+
+
+@job('match-rebuild', schedule='30 2 * * *', timeout=7200)
+def match_job(conn):
+    """Rescore every pet against every adopter."""
+    config = current_app.config
+    pairs = matching.rebuild(conn, config['MATCH_CANDIDATES'],
+                             matching.shelter_location(config['MATCH_SHELTER_LOCATION']))
+    return {'pairs': pairs}
+
+
+@job('archive', schedule='0 1 * * *', timeout=7200)
+def archive_job(conn, before=None):
+    """Move closed adoptions and payments older than ARCHIVE_AFTER_DAYS to the archive."""
+    if 'archive' not in current_app.extensions:
+        return {'skipped': 'no archive database'}
+    cutoff = before or archive.cutoff_date(current_app.config['ARCHIVE_AFTER_DAYS'])
+    adoptions, payments = archive.archive_closed(conn, cutoff)
+    invalidate('adoptions', 'payments')
+    return {'before': cutoff, 'adoptions': adoptions, 'payments': payments}
+
+
+@job('payment-report', schedule='0 6 1 * *')
+def payment_report_job(conn, month=None):
+    """Write last month's payments (archive included) to a CSV file in JOBS_REPORT_DIR."""
+    if month is None:
+        month = (datetime.date.today().replace(day=1) - datetime.timedelta(days=1)).strftime('%Y-%m')
+    directory = report_dir()
+    os.makedirs(directory, exist_ok=True)
+    filename = 'payments-%s.csv' % month
+    filters = {'date_from': month + '-01', 'date_to': month + '-31', 'scope': 'all'}
+    partial = os.path.join(directory, filename + '.part')
+    with open(partial, 'w', newline='') as f:
+        for chunk in export_chunks(conn, 'payments', filters, 'csv'):
+            f.write(chunk)
+    os.replace(partial, os.path.join(directory, filename))
+    row = conn.execute('SELECT Payments, Revenue FROM monthly_revenue WHERE Month = ?', (month,)).fetchone()
+    return {'file': filename, 'payments': row[0] if row else 0, 'revenue': row[1] if row else 0.0}
+
+
+@job('adoption-reminders', schedule='0 8 * * *')
+def reminders_job(conn):
+    """Record follow-up calls due JOBS_REMINDER_DAYS after each adoption."""
+    created = 0
+    for days in current_app.config['JOBS_REMINDER_DAYS']:
+        # Adoptions that reached the mark in the last week, so a few missed
+        # runs still catch up without reaching back through years of history.
+        created += conn.execute('''INSERT OR IGNORE INTO adoption_reminders (AdoptionID, Days, DueDate, CreatedAt)
+            SELECT AdoptionID, ?, date(AdoptionDate, ?), ? FROM adoptions
+            WHERE AdoptionDate > date('now', ?) AND AdoptionDate <= date('now', ?)''',
+                                (days, '+%d days' % days, utcnow(), '-%d days' % (days + 7), '-%d days' % days)).rowcount
+    conn.commit()
+    return {'created': created}
+
+
+# ---------- PAGES ----------
+jobs_html = """
+{% extends "base.html" %}
+{% block content %}
+<h4>Jobs</h4>
+{% if not runner %}<p class="alert alert-secondary">No job runner in this process; queued runs wait for "flask jobs worker".</p>{% endif %}
+<table class="table table-bordered table-sm">
+<tr><th>Job</th><th>Schedule</th><th>Next run (UTC)</th><th>Last run</th><th>Running</th><th>Queued</th><th></th></tr>
+{% for j in jobs %}
+<tr>
+<td title="{{j.description}}">{{j.name}}</td><td>{{j.schedule or '-'}}</td><td>{{j.next_run or '-'}}</td>
+<td>{% if j.last %}<span class="badge {{ 'bg-success' if j.last[0] == 'done' else 'bg-danger' if j.last[0] == 'failed' else 'bg-secondary' }}">{{j.last[0]}}</span> {{j.last[1] or ''}}{% endif %}</td>
+<td>{{j.running}}</td><td>{{j.queued}}</td>
+<td><form method="POST" action="{{ url_for('jobs.run_now', name=j.name) }}"><button class="btn btn-outline-primary btn-sm">Run now</button></form></td>
+</tr>
+{% endfor %}
+</table>
+<h5>Recent runs</h5>
+<table class="table table-bordered table-sm">
+<tr><th>Run</th><th>Job</th><th>Status</th><th>Attempts</th><th>Queued</th><th>Started</th><th>Finished</th><th>Result / error</th></tr>
+{% for r in runs %}
+<tr><td>{{r[0]}}</td><td>{{r[1]}}</td><td>{{r[2]}}</td><td>{{r[3]}}/{{r[4]}}</td><td>{{r[5]}}</td><td>{{r[6] or ''}}</td><td>{{r[7] or ''}}</td>
+<td><small>{{r[9] or r[8] or ''}}</small></td></tr>
+{% endfor %}
+</table>
+{% if reports %}
+<h5>Reports</h5>
+<ul>{% for name in reports %}<li><a href="{{ url_for('jobs.report', filename=name) }}">{{name}}</a></li>{% endfor %}</ul>
+{% endif %}
+{% endblock %}
+"""
+
+reminders_html = """
+{% extends "base.html" %}
+{% block content %}
+<h4>Follow-up reminders</h4>
+<table class="table table-bordered">
+<tr><th>Due</th><th>Adoption</th><th>Pet</th><th>Adopter</th><th>Contact</th><th>Days</th><th></th></tr>
+{% for r in reminders %}
+<tr><td>{{r[2]}}</td><td>{{r[0]}}</td><td>{{r[3]}}</td><td>{{r[4]}} {{r[5]}}</td><td>{{r[6]}}</td><td>{{r[1]}}</td>
+<td><form method="POST" action="{{ url_for('jobs.reminder_done', adoption_id=r[0], days=r[1]) }}"><button class="btn btn-success btn-sm">Done</button></form></td></tr>
+{% else %}
+<tr><td colspan="7" class="text-muted">Nothing due</td></tr>
+{% endfor %}
+</table>
+{% endblock %}
+"""
+
+
+def report_dir():
+    # Each shelter's reports are kept apart from the others'.
+    directory = current_app.config['JOBS_REPORT_DIR']
+    tenant = g.get('tenant')
+    return os.path.join(directory, tenant) if tenant else directory
+
+
+def get_runner():
+    # A shelter's requests (see tenancy.py) see that shelter's runner.
+    if 'job_runner' in g:
+        return g.job_runner
+    return current_app.extensions.get('job_runner')
+
+
+def report_files():
+    directory = report_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted((name for name in os.listdir(directory) if name.endswith('.csv')), reverse=True)
+
+
+@bp.route('/admin/jobs')
+def status():
+    conn = get_db()
+    counts = {}
+    for name, state, count in conn.execute(
+            "SELECT Name, Status, COUNT(*) FROM job_runs WHERE Status IN ('queued', 'running') GROUP BY Name, Status"):
+        counts[name, state] = count
+    rows = {row[0]: row[1:] for row in conn.execute('SELECT Name, Schedule, NextRunAt FROM jobs')}
+    jobs = []
+    for name, spec in JOBS.items():
+        schedule, next_run = rows.get(name, (None, None))
+        last = conn.execute("SELECT Status, FinishedAt FROM job_runs WHERE Name = ? AND Status IN ('done', 'failed') "
+                            "ORDER BY RunID DESC LIMIT 1", (name,)).fetchone()
+        jobs.append({'name': name, 'description': spec.description, 'schedule': schedule, 'next_run': next_run,
+                     'last': last, 'running': counts.get((name, 'running'), 0), 'queued': counts.get((name, 'queued'), 0)})
+    runs = conn.execute('SELECT RunID, Name, Status, Attempts, MaxAttempts, QueuedAt, StartedAt, FinishedAt, Result, Error '
+                        'FROM job_runs ORDER BY RunID DESC LIMIT 50').fetchall()
+    return render_template('jobs.html', jobs=jobs, runs=runs, reports=report_files(),
+                           runner=get_runner() is not None)
+
+
+@bp.route('/admin/jobs/<name>/run', methods=['POST'])
+def run_now(name):
+    if name not in JOBS:
+        abort(404)
+    enqueue(get_db(), name)
+    return redirect(url_for('jobs.status'))
+
+
+@bp.route('/admin/jobs/reports/<filename>')
+def report(filename):
+    return send_from_directory(os.path.abspath(report_dir()), filename, as_attachment=True)
+
+
+OPEN_REMINDERS = '''
+    SELECT r.AdoptionID, r.Days, r.DueDate, p.PetName, a.FirstName, a.LastName, a.Contact
+    FROM adoption_reminders r
+    LEFT JOIN adoptions ad ON ad.AdoptionID = r.AdoptionID
+    LEFT JOIN pets p ON p.PetID = ad.PetID
+    LEFT JOIN adopters a ON a.AdopterID = ad.AdopterID
+    WHERE r.DoneAt IS NULL ORDER BY r.DueDate, r.AdoptionID LIMIT 500'''
+
+
+@bp.route('/reminders')
+def reminders():
+    rows = get_db().execute(OPEN_REMINDERS).fetchall()
+    return render_template('reminders.html', reminders=rows)
+
+
+@bp.route('/reminders/<int:adoption_id>/<int:days>/done', methods=['POST'])
+def reminder_done(adoption_id, days):
+    conn = get_db()
+    conn.execute('UPDATE adoption_reminders SET DoneAt = ? WHERE AdoptionID = ? AND Days = ?', (utcnow(), adoption_id, days))
+    conn.commit()
+    return redirect(url_for('jobs.reminders'))
+
+
+# ---------- CLI ----------
+def parse_job_args(ctx, param, values):
+    args = {}
+    for value in values:
+        key, sep, arg = value.partition('=')
+        if not sep or not key:
+            raise click.BadParameter('expected KEY=VALUE, got %r' % value)
+        args[key] = arg
+    return args
+
+
+@bp.cli.command('list')
+def list_command():
+    """Show every job, its schedule and its next run."""
+    conn = get_db()
+    rows = {row[0]: row[1:] for row in conn.execute('SELECT Name, Schedule, NextRunAt FROM jobs')}
+    for name, spec in JOBS.items():
+        schedule, next_run = rows.get(name, (spec.schedule, None))
+        click.echo('%-20s %-14s next %-26s %s' % (name, schedule or '-', next_run or '-', spec.description))
+
+
+@bp.cli.command('run')
+@click.argument('name', type=click.Choice(list(JOBS)))
+@click.option('--arg', 'args', multiple=True, metavar='KEY=VALUE', callback=parse_job_args,
+              help='Argument passed to the job.')
+def run_command(name, args):
+    """Run a job now, in this process, and record it like any other run."""
+    conn = get_db()
+    run_id = enqueue(conn, name, args)
+    run = claim(conn, owner_id(), run_id)
+    if run is None:
+        raise click.ClickException('%s is already running as often as it may' % name)
+    status = execute(current_app._get_current_object(), conn, run)
+    result, error = conn.execute('SELECT Result, Error FROM job_runs WHERE RunID = ?', (run_id,)).fetchone()
+    click.echo('%s run %d: %s %s' % (name, run_id, status, error or result or ''))
+
+
+@bp.cli.command('enqueue')
+@click.argument('name', type=click.Choice(list(JOBS)))
+@click.option('--arg', 'args', multiple=True, metavar='KEY=VALUE', callback=parse_job_args,
+              help='Argument passed to the job.')
+@click.option('--delay', default=0, show_default=True, help='Seconds to wait before it may start.')
+def enqueue_command(name, args, delay):
+    """Queue a run for the job runner."""
+    run_id = enqueue(get_db(), name, args, delay)
+    click.echo('queued %s as run %d' % (name, run_id))
+
+
+@bp.cli.command('worker')
+def worker_command():
+    """Run the scheduler and workers in the foreground (for PET_ADOPTION_JOBS=0 web processes)."""
+    app = current_app._get_current_object()
+    runner = start_runner(app)
+    click.echo('job runner started with %d workers; Ctrl-C to stop' % runner.workers)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        runner.close()
+
+
+_runner_lock = threading.Lock()
+
+
+def make_runner(app, pool, tenant=None):
+    # One runner per database: the app's own and each open shelter's, with
+    # connections made like that database's request pool.
+    config = app.config
+    with pool.connection() as conn:
+        sync_schedules(conn, schedules(config))
+    return JobRunner(app, pool, tenant, workers=config['JOBS_WORKERS'], interval=config['JOBS_POLL_INTERVAL'],
+                     retry_delay=config['JOBS_RETRY_DELAY'], metrics=app.extensions.get('metrics'))
+
+
+def start_runner(app):
+    # Starts the app's runner unless it is already running; returns it.
+    with _runner_lock:
+        if 'job_runner' in app.extensions:
+            return app.extensions['job_runner']
+        runner = make_runner(app, app.extensions['db_pool'])
+        app.extensions['job_runner'] = runner
+    atexit.register(runner.close)
+    return runner
+
+
+def start_serving():
+    # Importing the app (flask CLI commands, the reloader's watcher) starts
+    # nothing; the process that serves requests starts the runner with its
+    # first one. serve.py starts it up front.
+    app = current_app._get_current_object()
+    if 'job_runner' not in app.extensions:
+        start_runner(app)
+
+
+def init_app(app):
+    app.config.setdefault('JOBS_ENABLED', True)
+    app.config.setdefault('JOBS_WORKERS', 2)
+    app.config.setdefault('JOBS_POLL_INTERVAL', 1.0)
+    app.config.setdefault('JOBS_RETRY_DELAY', 60)
+    app.config.setdefault('JOBS_SCHEDULES', {})
+    app.config.setdefault('JOBS_HISTORY_DAYS', 30)
+    app.config.setdefault('JOBS_REMINDER_DAYS', (7, 30))
+    app.config.setdefault('JOBS_REPORT_DIR', '%s_reports' % os.path.splitext(app.config['DATABASE'])[0])
+    for schedule in schedules(app.config).values():
+        if schedule:
+            Cron(schedule)
+    register_templates(app, {'jobs.html': jobs_html, 'reminders.html': reminders_html})
+    app.register_blueprint(bp)
+    if app.config['JOBS_ENABLED']:
+        app.before_request(start_serving)
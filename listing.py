@@ -0,0 +1,255 @@
+import base64
+import binascii
+import json
+
+from flask import current_app, request, url_for
+
+from db import get_db
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Sortable columns and query-string filters for each list page. Filters map
+# a query-string argument to (column, operator, input type). Soft-deleted
+# tables hide rows with a DeletedAt; archived tables read the view over hot
+# and archived rows with ?scope=all.
+LISTINGS = {
+    'pets': {
+        'key': 'PetID',
+        'soft_delete': True,
+        'sorts': ('PetID', 'PetName', 'Breed', 'Age', 'HealthStatus', 'Status'),
+        'filters': {
+            'Breed': ('Breed', '=', 'text'),
+            'HealthStatus': ('HealthStatus', '=', 'text'),
+            'Status': ('Status', '=', 'text'),
+        },
+    },
+    'adopters': {
+        'key': 'AdopterID',
+        'soft_delete': True,
+        'sorts': ('AdopterID', 'FirstName', 'LastName', 'City', 'State', 'Country'),
+        'filters': {
+            'City': ('City', '=', 'text'),
+            'State': ('State', '=', 'text'),
+            'Country': ('Country', '=', 'text'),
+        },
+    },
+    'adoptions': {
+        'key': 'AdoptionID',
+        'archive': 'all_adoptions',
+        'sorts': ('AdoptionID', 'PetID', 'AdopterID', 'AdoptionDate'),
+        'filters': {
+            'PetID': ('PetID', '=', 'text'),
+            'AdopterID': ('AdopterID', '=', 'text'),
+            'date_from': ('AdoptionDate', '>=', 'date'),
+            'date_to': ('AdoptionDate', '<=', 'date'),
+        },
+    },
+    'payments': {
+        'key': 'PaymentID',
+        'archive': 'all_payments',
+        'sorts': ('PaymentID', 'AdoptionID', 'Amount', 'PaymentDate'),
+        'filters': {
+            'AdoptionID': ('AdoptionID', '=', 'number'),
+            'date_from': ('PaymentDate', '>=', 'date'),
+            'date_to': ('PaymentDate', '<=', 'date'),
+        },
+    },
+}
+
+
+# ---------- ROW COUNTERS ----------
+def create_counters(c):
+    # Totals are kept in row_counts by triggers so list pages never have to
+    # run COUNT(*) over a whole table.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS row_counts (
+        TableName TEXT PRIMARY KEY,
+        Total INTEGER NOT NULL
+    )
+    ''')
+    for table in LISTINGS:
+        c.execute("INSERT OR IGNORE INTO row_counts (TableName, Total) SELECT ?, COUNT(*) FROM %s" % table, (table,))
+        c.execute('''
+        CREATE TRIGGER IF NOT EXISTS %(t)s_count_insert AFTER INSERT ON %(t)s
+        BEGIN UPDATE row_counts SET Total = Total + 1 WHERE TableName = '%(t)s'; END
+        ''' % {'t': table})
+        c.execute('''
+        CREATE TRIGGER IF NOT EXISTS %(t)s_count_delete AFTER DELETE ON %(t)s
+        BEGIN UPDATE row_counts SET Total = Total - 1 WHERE TableName = '%(t)s'; END
+        ''' % {'t': table})
+
+
+def soft_delete_statements():
+    # Deleting a pet or adopter sets DeletedAt instead of removing the row, so
+    # the adoptions and payments that point at it stay intact. The counters
+    # follow DeletedAt; a later hard delete of a soft-deleted row is not
+    # counted twice.
+    statements = []
+    for table, spec in LISTINGS.items():
+        if not spec.get('soft_delete'):
+            continue
+        params = {'t': table}
+        statements += [sql % params for sql in (
+            "ALTER TABLE %(t)s ADD COLUMN DeletedAt TEXT",
+            "DROP TRIGGER IF EXISTS %(t)s_count_delete",
+            '''CREATE TRIGGER %(t)s_count_delete AFTER DELETE ON %(t)s WHEN OLD.DeletedAt IS NULL
+            BEGIN UPDATE row_counts SET Total = Total - 1 WHERE TableName = '%(t)s'; END''',
+            '''CREATE TRIGGER %(t)s_count_soft_delete AFTER UPDATE OF DeletedAt ON %(t)s
+            WHEN (OLD.DeletedAt IS NULL) != (NEW.DeletedAt IS NULL)
+            BEGIN UPDATE row_counts SET Total = Total + (CASE WHEN NEW.DeletedAt IS NULL THEN 1 ELSE -1 END)
+                WHERE TableName = '%(t)s'; END''',
+        )]
+    return statements
+
+
+def archive_scope(table, args):
+    # True when args ask for archived rows too and the archive is attached.
+    return (args.get('scope') == 'all' and 'archive' in LISTINGS[table]
+            and 'archive' in current_app.extensions)
+
+
+def total_rows(table, scope_all=False):
+    conn = get_db()
+    row = conn.execute("SELECT Total FROM row_counts WHERE TableName=?", (table,)).fetchone()
+    total = row[0] if row else 0
+    if scope_all:
+        row = conn.execute("SELECT Total FROM archive.archive_counts WHERE TableName=?", (table,)).fetchone()
+        total += row[0] if row else 0
+    return total
+
+
+# ---------- KEYSET PAGINATION ----------
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) not in (1, 2):
+        return None
+    # Anything but a column value would only fail when bound to the query.
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        return None
+    return values
+
+
+def page_limit(args):
+    try:
+        limit = int(args.get('limit', PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def build_query(table, args, columns='*'):
+    spec = LISTINGS[table]
+    key = spec['key']
+    sort = args.get('sort', key)
+    if sort not in spec['sorts']:
+        sort = key
+    descending = args.get('order') == 'desc'
+    direction = 'DESC' if descending else 'ASC'
+    where, params = [], []
+    if spec.get('soft_delete'):
+        where.append('DeletedAt IS NULL')
+    for arg, (column, op, _) in spec['filters'].items():
+        value = args.get(arg, '').strip()
+        if value:
+            where.append('%s %s ?' % (column, op))
+            params.append(value)
+    cursor = decode_cursor(args.get('cursor'))
+    if cursor:
+        # Resume strictly after the last row of the previous page; ties on
+        # the sort column are broken by the primary key.
+        op = '<' if descending else '>'
+        if sort == key:
+            where.append('%s %s ?' % (key, op))
+            params.append(cursor[-1])
+        elif len(cursor) == 2:
+            where.append('(%s, %s) %s (?, ?)' % (sort, key, op))
+            params.extend(cursor)
+    source = spec['archive'] if archive_scope(table, args) else table
+    sql = 'SELECT %s FROM %s' % (columns, source)
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    if sort == key:
+        sql += ' ORDER BY %s %s' % (key, direction)
+    else:
+        sql += ' ORDER BY %s %s, %s %s' % (sort, direction, key, direction)
+    return sql, params, sort
+
+
+def list_queries():
+    # Every query shape the list pages can issue for a single sort or filter,
+    # as (label, sql) pairs for the query plan audit.
+    queries = []
+    for table, spec in LISTINGS.items():
+        for sort in spec['sorts']:
+            for order in ('asc', 'desc'):
+                args = {'sort': sort, 'order': order, 'cursor': encode_cursor([None, None])}
+                sql, _, _ = build_query(table, args)
+                queries.append(('%s sorted by %s %s' % (table, sort, order), sql + ' LIMIT ?'))
+            if archive_scope(table, {'scope': 'all'}):
+                args = {'sort': sort, 'scope': 'all', 'cursor': encode_cursor([None, None])}
+                sql, _, _ = build_query(table, args)
+                queries.append(('%s with archive sorted by %s' % (table, sort), sql + ' LIMIT ?'))
+        # Filters on the same column (date_from/date_to) are audited as one range.
+        columns = {}
+        for arg, (column, _, _) in spec['filters'].items():
+            columns.setdefault(column, []).append(arg)
+        for column, args in columns.items():
+            sql, _, _ = build_query(table, {arg: '?' for arg in args})
+            queries.append(('%s filtered by %s' % (table, column), sql + ' LIMIT ?'))
+    return queries
+
+
+def fetch_page(table, args=None):
+    # Rows are yielded straight off the cursor so a streamed page never holds
+    # the whole result; page['next_url'] is filled in once they are consumed.
+    args = request.args if args is None else args
+    spec = LISTINGS[table]
+    limit = page_limit(args)
+    sql, params, sort = build_query(table, args)
+    scope_all = archive_scope(table, args)
+    first_args = {k: v for k, v in args.items() if k != 'cursor'}
+    filter_args = {k: v for k, v in args.items() if k in spec['filters'] and v}
+    if scope_all:
+        filter_args['scope'] = 'all'
+    page = {
+        'table': table,
+        'filter_args': filter_args,
+        'sort': sort,
+        'sorts': spec['sorts'],
+        'order': 'desc' if args.get('order') == 'desc' else 'asc',
+        'limit': limit,
+        'max_limit': MAX_PAGE_SIZE,
+        'filters': [
+            {'name': arg, 'type': kind, 'value': args.get(arg, '')}
+            for arg, (_, _, kind) in spec['filters'].items()
+        ],
+        'total': total_rows(table, scope_all),
+        'archived': 'archive' in spec and 'archive' in current_app.extensions,
+        'scope': 'all' if scope_all else 'hot',
+        'cursor': args.get('cursor'),
+        'first_url': url_for(request.endpoint, **first_args),
+        'next_url': None,
+    }
+    c = get_db().execute(sql + ' LIMIT ?', params + [limit + 1])
+    names = [d[0] for d in c.description]
+
+    def rows():
+        last = None
+        for count, row in enumerate(c, 1):
+            if count > limit:
+                token = encode_cursor([last[names.index(sort)], last[names.index(spec['key'])]])
+                page['next_url'] = url_for(request.endpoint, **dict(args.items(), cursor=token))
+                break
+            last = row
+            yield row
+    return rows(), page
@@ -0,0 +1,629 @@
+import atexit
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+
+import click
+from flask import Blueprint, abort, current_app, redirect, render_template, request, url_for
+
+from db import ConnectionPool, get_db, run_immediate
+from templating import register_templates
+from writebehind import execute_write
+
+try:
+    import numpy
+except ImportError:  # rebuild() falls back to scoring pair by pair
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+bp = Blueprint('matching', __name__)
+
+# How well a pet fits an adopter, from 0 to the sum of the weights. An
+# adopter with no preference for a field scores NO_PREFERENCE on it; an age
+# outside the wanted range loses a point per AGE_SLACK years. Location is how
+# close the adopter lives to the shelter (MATCH_SHELTER_LOCATION, "City,
+# State, Country"): the same city scores 1, the same state 0.6, the same
+# country 0.3.
+WEIGHTS = {'breed': 3.0, 'age': 2.0, 'health': 1.0, 'location': 1.0}
+NO_PREFERENCE = 0.5
+AGE_SLACK = 5.0
+
+# The candidate index: the best MATCH_CANDIDATES adopters of every available
+# pet and the best pets of every adopter, so a match page is one index range
+# scan instead of scoring every pet against every adopter. Triggers record
+# what changed in match_dirty (a row per pet or adopter, re-numbered each time
+# it changes again) and the refresher rescores just those; a full rebuild
+# (nightly, or when too much has changed) recomputes both lists from scratch.
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS adopter_preferences (
+        AdopterID TEXT PRIMARY KEY REFERENCES adopters(AdopterID) ON DELETE CASCADE,
+        Breed TEXT,
+        MinAge INTEGER,
+        MaxAge INTEGER,
+        HealthStatus TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS pet_matches (
+        PetID TEXT NOT NULL,
+        AdopterID TEXT NOT NULL,
+        Score REAL NOT NULL,
+        PRIMARY KEY (PetID, AdopterID)
+    ) WITHOUT ROWID''',
+    "CREATE INDEX IF NOT EXISTS idx_pet_matches_rank ON pet_matches(PetID, Score DESC, AdopterID)",
+    "CREATE INDEX IF NOT EXISTS idx_pet_matches_adopter ON pet_matches(AdopterID, PetID)",
+    '''CREATE TABLE IF NOT EXISTS adopter_matches (
+        AdopterID TEXT NOT NULL,
+        PetID TEXT NOT NULL,
+        Score REAL NOT NULL,
+        PRIMARY KEY (AdopterID, PetID)
+    ) WITHOUT ROWID''',
+    "CREATE INDEX IF NOT EXISTS idx_adopter_matches_rank ON adopter_matches(AdopterID, Score DESC, PetID)",
+    "CREATE INDEX IF NOT EXISTS idx_adopter_matches_pet ON adopter_matches(PetID, AdopterID)",
+    '''CREATE TABLE IF NOT EXISTS match_dirty (
+        Seq INTEGER PRIMARY KEY,
+        Kind TEXT NOT NULL,
+        ID TEXT NOT NULL
+    )''',
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_match_dirty_key ON match_dirty(Kind, ID)",
+    '''CREATE TRIGGER IF NOT EXISTS pets_match_insert AFTER INSERT ON pets BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('pet', NEW.PetID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pets_match_update AFTER UPDATE OF PetID, Breed, Age, HealthStatus, Status ON pets BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('pet', OLD.PetID);
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('pet', NEW.PetID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pets_match_delete AFTER DELETE ON pets BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('pet', OLD.PetID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS adopters_match_insert AFTER INSERT ON adopters BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('adopter', NEW.AdopterID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS adopters_match_update AFTER UPDATE OF AdopterID, City, State, Country ON adopters BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('adopter', OLD.AdopterID);
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('adopter', NEW.AdopterID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS adopters_match_delete AFTER DELETE ON adopters BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('adopter', OLD.AdopterID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS preferences_match_insert AFTER INSERT ON adopter_preferences BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('adopter', NEW.AdopterID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS preferences_match_update AFTER UPDATE ON adopter_preferences BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('adopter', NEW.AdopterID);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS preferences_match_delete AFTER DELETE ON adopter_preferences BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('adopter', OLD.AdopterID);
+    END''',
+    # Existing rows are indexed by the first refresh, as one rebuild.
+    "INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('all', '')",
+]
+
+# Soft deletes (migration 8) take a pet or adopter out of the index like a
+# delete does.
+SOFT_DELETE_SCHEMA = [
+    "DROP TRIGGER IF EXISTS pets_match_update",
+    '''CREATE TRIGGER pets_match_update AFTER UPDATE OF PetID, Breed, Age, HealthStatus, Status, DeletedAt ON pets BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('pet', OLD.PetID);
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('pet', NEW.PetID);
+    END''',
+    "DROP TRIGGER IF EXISTS adopters_match_update",
+    '''CREATE TRIGGER adopters_match_update AFTER UPDATE OF AdopterID, City, State, Country, DeletedAt ON adopters BEGIN
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('adopter', OLD.AdopterID);
+        INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES ('adopter', NEW.AdopterID);
+    END''',
+]
+
+# Candidate lists by owner kind: (table, owner column, candidate column).
+LISTS = {
+    'pet': ('pet_matches', 'PetID', 'AdopterID'),
+    'adopter': ('adopter_matches', 'AdopterID', 'PetID'),
+}
+OTHER = {'pet': 'adopter', 'adopter': 'pet'}
+
+
+# ---------- SCORING ----------
+def text_key(value):
+    return (value or '').strip().lower()
+
+
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def shelter_location(value):
+    # "City, State, Country" -> (city, state, country) keys, or None.
+    if not value:
+        return None
+    parts = [text_key(part) for part in value.split(',')] if isinstance(value, str) else [text_key(v) for v in value]
+    if len(parts) != 3:
+        raise ValueError('MATCH_SHELTER_LOCATION must be "City, State, Country"')
+    return tuple(parts)
+
+
+def location_score(city, state, country, shelter):
+    if shelter is None or text_key(country) != shelter[2]:
+        return 0.0
+    if text_key(state) != shelter[1]:
+        return 0.3
+    if text_key(city) != shelter[0]:
+        return 0.6
+    return 1.0
+
+
+def load(conn, shelter):
+    # Scoring features of every available pet and every adopter still on file:
+    #   pets     {PetID: (breed, age, health)}
+    #   adopters {AdopterID: (breed, min age, max age, health, location)}
+    # with None for "no preference".
+    pets = {pet_id: (text_key(breed), number(age) or 0.0, text_key(health))
+            for pet_id, breed, age, health in conn.execute(
+                "SELECT PetID, Breed, Age, HealthStatus FROM pets WHERE Status = 'available' AND DeletedAt IS NULL")}
+    adopters = {}
+    for row in conn.execute('''
+            SELECT a.AdopterID, a.City, a.State, a.Country, p.Breed, p.MinAge, p.MaxAge, p.HealthStatus
+            FROM adopters a LEFT JOIN adopter_preferences p ON p.AdopterID = a.AdopterID
+            WHERE a.DeletedAt IS NULL'''):
+        adopters[row[0]] = (text_key(row[4]) or None, number(row[5]), number(row[6]), text_key(row[7]) or None,
+                            location_score(row[1], row[2], row[3], shelter))
+    return pets, adopters
+
+
+def score(pet, adopter):
+    breed, age, health = pet
+    want_breed, min_age, max_age, want_health, location = adopter
+    breed_score = NO_PREFERENCE if want_breed is None else float(breed == want_breed)
+    if min_age is None and max_age is None:
+        age_score = NO_PREFERENCE
+    else:
+        off_by = max((min_age if min_age is not None else age) - age, age - (max_age if max_age is not None else age), 0.0)
+        age_score = max(0.0, 1.0 - off_by / AGE_SLACK)
+    health_score = NO_PREFERENCE if want_health is None else float(health == want_health)
+    return (WEIGHTS['breed'] * breed_score + WEIGHTS['age'] * age_score
+            + WEIGHTS['health'] * health_score + WEIGHTS['location'] * location)
+
+
+def feature_arrays(pets, adopters):
+    # Columns for score_matrix(); text is coded to integers, -1 for None.
+    codes = {}
+    code = lambda value: -1 if value is None else codes.setdefault(value, len(codes))
+    pet_columns = {
+        'breed': numpy.array([code(p[0]) for p in pets], dtype=numpy.int64),
+        'age': numpy.array([p[1] for p in pets], dtype=numpy.float64),
+        'health': numpy.array([code(p[2]) for p in pets], dtype=numpy.int64),
+    }
+    adopter_columns = {
+        'breed': numpy.array([code(a[0]) for a in adopters], dtype=numpy.int64),
+        'min_age': numpy.array([-numpy.inf if a[1] is None else a[1] for a in adopters]),
+        'max_age': numpy.array([numpy.inf if a[2] is None else a[2] for a in adopters]),
+        'any_age': numpy.array([a[1] is None and a[2] is None for a in adopters]),
+        'health': numpy.array([code(a[3]) for a in adopters], dtype=numpy.int64),
+        'location': numpy.array([a[4] for a in adopters], dtype=numpy.float64),
+    }
+    return pet_columns, adopter_columns
+
+
+def score_matrix(pets, adopters, rows):
+    # score() for pets[rows] x every adopter at once, as a 2-D array; the
+    # arithmetic is done in the same order so both agree to the bit.
+    age = pets['age'][rows][:, None]
+    breed = numpy.where(adopters['breed'] < 0, NO_PREFERENCE,
+                        (pets['breed'][rows][:, None] == adopters['breed']).astype(numpy.float64))
+    off_by = numpy.maximum(numpy.maximum(adopters['min_age'] - age, age - adopters['max_age']), 0.0)
+    age_score = numpy.where(adopters['any_age'], NO_PREFERENCE, numpy.maximum(0.0, 1.0 - off_by / AGE_SLACK))
+    health = numpy.where(adopters['health'] < 0, NO_PREFERENCE,
+                         (pets['health'][rows][:, None] == adopters['health']).astype(numpy.float64))
+    return (WEIGHTS['breed'] * breed + WEIGHTS['age'] * age_score
+            + WEIGHTS['health'] * health + WEIGHTS['location'] * adopters['location'])
+
+
+def best(scored, count):
+    # The count best (candidate, score) pairs, best first, ties by id.
+    return [(key, -value) for value, key in heapq.nsmallest(count, ((-value, key) for key, value in scored))]
+
+
+# ---------- FULL REBUILD ----------
+BLOCK_ROWS = 256
+
+
+def rank_numpy(pets, adopters, count):
+    # Top-count lists for both sides, scoring BLOCK_ROWS pets against every
+    # adopter per step so memory stays at a few (BLOCK_ROWS x adopters) arrays.
+    pet_ids, adopter_ids = list(pets), list(adopters)
+    pet_columns, adopter_columns = feature_arrays([pets[k] for k in pet_ids], [adopters[k] for k in adopter_ids])
+    pet_lists, adopter_lists = [], []
+    keep = min(count, len(adopter_ids))
+    top_scores = numpy.full((count, len(adopter_ids)), -numpy.inf)
+    top_pets = numpy.full((count, len(adopter_ids)), -1, dtype=numpy.int64)
+    for start in range(0, len(pet_ids), BLOCK_ROWS):
+        rows = numpy.arange(start, min(start + BLOCK_ROWS, len(pet_ids)))
+        scores = score_matrix(pet_columns, adopter_columns, rows)
+        if keep:
+            picked = numpy.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            for i, columns in zip(rows, picked):
+                pet_lists.append((pet_ids[i], [(adopter_ids[j], float(scores[i - start, j])) for j in columns]))
+        merged_scores = numpy.concatenate([top_scores, scores])
+        merged_pets = numpy.concatenate([top_pets, numpy.broadcast_to(rows[:, None], scores.shape)])
+        picked = numpy.argpartition(-merged_scores, count - 1, axis=0)[:count]
+        top_scores = numpy.take_along_axis(merged_scores, picked, axis=0)
+        top_pets = numpy.take_along_axis(merged_pets, picked, axis=0)
+    for j, adopter in enumerate(adopter_ids):
+        adopter_lists.append((adopter, [(pet_ids[i], float(s)) for i, s in zip(top_pets[:, j], top_scores[:, j])
+                                        if i >= 0]))
+    return pet_lists, adopter_lists
+
+
+def rank_python(pets, adopters, count):
+    pet_lists, heaps = [], {adopter: [] for adopter in adopters}
+    for pet, features in pets.items():
+        scored = [(adopter, score(features, wanted)) for adopter, wanted in adopters.items()]
+        pet_lists.append((pet, best(scored, count)))
+        for adopter, value in scored:
+            heap = heaps[adopter]
+            if len(heap) < count:
+                heapq.heappush(heap, (value, pet))
+            elif value > heap[0][0]:
+                heapq.heapreplace(heap, (value, pet))
+    return pet_lists, [(adopter, [(pet, value) for value, pet in heap]) for adopter, heap in heaps.items()]
+
+
+def snapshot(conn, shelter):
+    # Features plus the last match_dirty entry they account for, read in one
+    # transaction so nothing changes in between.
+    conn.execute('BEGIN')
+    try:
+        last = conn.execute('SELECT COALESCE(MAX(Seq), 0) FROM match_dirty').fetchone()[0]
+        pets, adopters = load(conn, shelter)
+    finally:
+        conn.commit()
+    return last, pets, adopters
+
+
+def rebuild(conn, count=32, shelter=None):
+    # Recomputes both candidate lists. Only the final swap holds the write
+    # lock; changes made while scoring stay in match_dirty for the next
+    # refresh. Returns the number of pairs stored.
+    last, pets, adopters = snapshot(conn, shelter)
+    rank = rank_numpy if numpy is not None else rank_python
+    pet_lists, adopter_lists = rank(pets, adopters, count)
+    rows = {
+        'pet': [(owner, key, value) for owner, pairs in pet_lists for key, value in pairs],
+        'adopter': [(owner, key, value) for owner, pairs in adopter_lists for key, value in pairs],
+    }
+
+    def work(conn):
+        for kind, (table, owner, candidate) in LISTS.items():
+            conn.execute('DELETE FROM %s' % table)
+            conn.executemany('INSERT INTO %s (%s, %s, Score) VALUES (?, ?, ?)' % (table, owner, candidate), rows[kind])
+        conn.execute('DELETE FROM match_dirty WHERE Seq <= ?', (last,))
+    run_immediate(conn, work)
+    return len(rows['pet']) + len(rows['adopter'])
+
+
+# ---------- INCREMENTAL REFRESH ----------
+def list_sizes(conn, kind):
+    # {owner: (candidates held, lowest score held)} for one side.
+    table, owner, _ = LISTS[kind]
+    return {key: (held, lowest) for key, held, lowest in
+            conn.execute('SELECT %s, COUNT(*), MIN(Score) FROM %s GROUP BY %s' % (owner, table, owner))}
+
+
+def mark_dirty(conn, kind, keys):
+    conn.executemany('INSERT OR REPLACE INTO match_dirty (Kind, ID) VALUES (?, ?)', [(kind, key) for key in keys])
+
+
+def refill_size(count):
+    # A list stays exact when members leave it (what remains is still the top
+    # of what remains), it just gets shorter; it is only rescored once it
+    # holds fewer than this, which is also the most a page may ask for.
+    return count * 3 // 4
+
+
+def apply_owner(conn, kind, key, scored, count, sizes):
+    # Writes one pet's (or adopter's) fresh scores: its own list becomes its
+    # top count candidates, and it is placed into, re-scored in, or (scored
+    # None: gone or adopted) removed from the candidates' lists. sizes holds
+    # (length, lowest score) of every list, by kind, and is kept up to date. A list
+    # that gets too short, or may now be missing a better candidate, is
+    # marked dirty so its own refresh refills it.
+    table, owner, candidate = LISTS[kind]
+    other_table, other_owner, other_candidate = LISTS[OTHER[kind]]
+    params = {'t': other_table, 'o': other_owner, 'c': other_candidate}
+    refill = refill_size(count)
+    conn.execute('DELETE FROM %s WHERE %s = ?' % (table, owner), (key,))
+    held = dict(conn.execute('SELECT %(o)s, Score FROM %(t)s WHERE %(c)s = ?' % params, (key,)).fetchall())
+    scores = {} if scored is None else dict(scored)
+    top = best(scored, count) if scored is not None else []
+    conn.executemany('INSERT INTO %s (%s, %s, Score) VALUES (?, ?, ?)' % (table, owner, candidate),
+                     [(key, other, value) for other, value in top])
+    if top:
+        sizes[kind][key] = (len(top), top[-1][1])
+    else:
+        sizes[kind].pop(key, None)
+    sizes = sizes[OTHER[kind]]
+    touched, short = [], []
+    for other, old in held.items():
+        value = scores.get(other)
+        size, lowest = sizes[other]
+        if value is not None and value >= lowest:
+            # Still at or above the rest of the list: the order stays exact.
+            if value != old:
+                conn.execute('UPDATE %(t)s SET Score = ? WHERE %(o)s = ? AND %(c)s = ?' % params, (value, other, key))
+            continue
+        # Gone, or fallen below the list: leave it out.
+        conn.execute('DELETE FROM %(t)s WHERE %(o)s = ? AND %(c)s = ?' % params, (other, key))
+        sizes[other] = (size - 1, lowest)
+        if size - 1 < refill:
+            short.append(other)
+    for other, value in scored or ():
+        if other in held:
+            continue
+        size, lowest = sizes.get(other, (0, None))
+        if size and value > lowest:
+            conn.execute('INSERT INTO %(t)s (%(o)s, %(c)s, Score) VALUES (?, ?, ?)' % params, (other, key, value))
+            touched.append(other)
+        elif size < refill:
+            short.append(other)
+    for other in touched:
+        conn.execute('''DELETE FROM %(t)s WHERE %(o)s = ? AND %(c)s NOT IN (
+                        SELECT %(c)s FROM %(t)s WHERE %(o)s = ? ORDER BY Score DESC, %(c)s LIMIT ?)''' % params,
+                     (other, other, count))
+        sizes[other] = conn.execute('SELECT COUNT(*), MIN(Score) FROM %(t)s WHERE %(o)s = ?' % params,
+                                    (other,)).fetchone()
+    mark_dirty(conn, OTHER[kind], short)
+
+
+def refresh(conn, count=32, shelter=None, batch=200):
+    # Applies what match_dirty says has changed. More than `batch` changes
+    # (a bulk import, a new database) are cheaper as one rebuild. Returns
+    # ('incremental' or 'rebuild', changes handled).
+    dirty = conn.execute('SELECT Seq, Kind, ID FROM match_dirty ORDER BY Seq LIMIT ?', (batch + 1,)).fetchall()
+    if not dirty:
+        return 'incremental', 0
+    if len(dirty) > batch or any(kind == 'all' for _, kind, _ in dirty):
+        total = conn.execute('SELECT COUNT(*) FROM match_dirty').fetchone()[0]
+        rebuild(conn, count, shelter)
+        return 'rebuild', total
+    _, pets, adopters = snapshot(conn, shelter)
+    changes = []
+    for seq, kind, key in dirty:
+        if kind == 'pet':
+            features = pets.get(key)
+            scored = None if features is None else [(a, score(features, f)) for a, f in adopters.items()]
+        else:
+            features = adopters.get(key)
+            scored = None if features is None else [(p, score(f, features)) for p, f in pets.items()]
+        changes.append((seq, kind, key, scored))
+
+    def work(conn):
+        sizes = {kind: list_sizes(conn, kind) for kind in LISTS}
+        for seq, kind, key, scored in changes:
+            apply_owner(conn, kind, key, scored, count, sizes)
+            conn.execute('DELETE FROM match_dirty WHERE Seq = ?', (seq,))
+    run_immediate(conn, work)
+    return 'incremental', len(changes)
+
+
+class MatchRefresher:
+    """Background thread keeping the candidate index in step with match_dirty."""
+
+    def __init__(self, database, count=32, shelter=None, batch=200, interval=1.0, busy_timeout=5000,
+                 factory=sqlite3.Connection, setup=None, metrics=None):
+        self.count = count
+        self.shelter = shelter
+        self.batch = batch
+        self.interval = interval
+        self.metrics = metrics
+        self._pool = ConnectionPool(database, size=1, busy_timeout=busy_timeout, factory=factory, setup=setup)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='match-refresh', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            try:
+                with self._pool.connection() as conn:
+                    mode, changes = refresh(conn, self.count, self.shelter, self.batch)
+            except Exception:
+                log.exception('match index refresh failed')
+                changes = 0
+            if changes and self.metrics is not None:
+                self.metrics.inc('match_refreshes_total', mode=mode)
+                self.metrics.observe('match_refresh_seconds', time.perf_counter() - started, mode=mode)
+            # Keep going straight away while there is a backlog.
+            if not changes:
+                self._stop.wait(self.interval)
+
+    def close(self, timeout=30.0):
+        self._stop.set()
+        self._thread.join(timeout)
+        self._pool.close()
+
+
+# ---------- PAGES ----------
+def top_matches(conn, kind, key, limit):
+    # Cursor over the best `limit` candidates, best first.
+    if kind == 'pet':
+        return conn.execute('''
+            SELECT m.AdopterID, m.Score, a.FirstName, a.LastName, a.City, a.State, a.Country
+            FROM pet_matches m JOIN adopters a ON a.AdopterID = m.AdopterID
+            WHERE m.PetID = ? AND a.DeletedAt IS NULL ORDER BY m.Score DESC, m.AdopterID LIMIT ?''', (key, limit))
+    # A pet adopted or deleted since the last refresh is left out straight away.
+    return conn.execute('''
+        SELECT m.PetID, m.Score, p.PetName, p.Breed, p.Age, p.HealthStatus
+        FROM adopter_matches m JOIN pets p ON p.PetID = m.PetID
+        WHERE m.AdopterID = ? AND p.Status = 'available' AND p.DeletedAt IS NULL ORDER BY m.Score DESC, m.PetID LIMIT ?''', (key, limit))
+
+
+def match_limit():
+    config = current_app.config
+    limit = request.args.get('limit', type=int) or config['MATCH_LIMIT']
+    return max(1, min(limit, refill_size(config['MATCH_CANDIDATES'])))
+
+
+def pending_changes(conn):
+    return conn.execute('SELECT COUNT(*) FROM match_dirty').fetchone()[0]
+
+
+pet_matches_html = """
+{% extends "base.html" %}
+{% block content %}
+<h4>Best adopters for {{pet[1]}} <small class="text-muted">{{pet[0]}} &middot; {{pet[2]}}, {{pet[3]}} years, {{pet[4]}}</small></h4>
+{% if pet[7] != 'available' %}<p class="alert alert-secondary">This pet has been adopted.</p>{% endif %}
+{% if pending %}<p class="text-muted">{{pending}} recent changes are still being scored.</p>{% endif %}
+<table class="table table-bordered">
+<tr><th>Adopter</th><th>Name</th><th>Location</th><th>Score</th><th></th></tr>
+{% for m in matches %}
+<tr>
+<td><a href="{{ url_for('matching.adopter_matches', adopter_id=m[0]) }}">{{m[0]}}</a></td><td>{{m[2]}} {{m[3]}}</td>
+<td>{{m[4]}}, {{m[5]}}, {{m[6]}}</td><td>{{ '%.2f'|format(m[1]) }}</td>
+<td>{% if pet[7] == 'available' %}
+<form method="POST" action="/adopt" class="d-flex">
+  <input type="hidden" name="PetID" value="{{pet[0]}}"><input type="hidden" name="AdopterID" value="{{m[0]}}">
+  <input type="date" name="AdoptionDate" class="form-control form-control-sm me-1" required>
+  <button class="btn btn-success btn-sm">Adopt</button>
+</form>{% endif %}</td>
+</tr>
+{% endfor %}
+</table>
+{% endblock %}
+"""
+
+adopter_matches_html = """
+{% extends "base.html" %}
+{% block content %}
+<h4>Best pets for {{adopter[1]}} {{adopter[2]}} <small class="text-muted">{{adopter[0]}} &middot; {{adopter[5]}}, {{adopter[6]}}, {{adopter[7]}}</small></h4>
+{% if pending %}<p class="text-muted">{{pending}} recent changes are still being scored.</p>{% endif %}
+<table class="table table-bordered">
+<tr><th>Pet</th><th>Name</th><th>Breed</th><th>Age</th><th>Health</th><th>Score</th></tr>
+{% for m in matches %}
+<tr>
+<td><a href="{{ url_for('matching.pet_matches', pet_id=m[0]) }}">{{m[0]}}</a></td>
+<td>{{m[2]}}</td><td>{{m[3]}}</td><td>{{m[4]}}</td><td>{{m[5]}}</td><td>{{ '%.2f'|format(m[1]) }}</td>
+</tr>
+{% endfor %}
+</table>
+
+<h5>Preferences</h5>
+<form method="POST" action="{{ url_for('matching.save_preferences', adopter_id=adopter[0]) }}" class="row g-2">
+  <div class="col-auto"><input name="Breed" class="form-control" placeholder="Breed (any)" value="{{prefs[0] or ''}}"></div>
+  <div class="col-auto"><input name="MinAge" type="number" class="form-control" placeholder="Min age" value="{{prefs[1] if prefs[1] is not none else ''}}"></div>
+  <div class="col-auto"><input name="MaxAge" type="number" class="form-control" placeholder="Max age" value="{{prefs[2] if prefs[2] is not none else ''}}"></div>
+  <div class="col-auto"><input name="HealthStatus" class="form-control" placeholder="Health (any)" value="{{prefs[3] or ''}}"></div>
+  <div class="col-auto"><button class="btn btn-primary">Save</button></div>
+</form>
+{% endblock %}
+"""
+
+
+@bp.route('/pets/<pet_id>/matches')
+def pet_matches(pet_id):
+    conn = get_db()
+    pet = conn.execute('SELECT * FROM pets WHERE PetID = ? AND DeletedAt IS NULL', (pet_id,)).fetchone()
+    if pet is None:
+        abort(404)
+    return render_template('pet_matches.html', pet=pet, matches=top_matches(conn, 'pet', pet_id, match_limit()).fetchall(),
+                           pending=pending_changes(conn))
+
+
+@bp.route('/adopters/<adopter_id>/matches')
+def adopter_matches(adopter_id):
+    conn = get_db()
+    adopter = conn.execute('SELECT * FROM adopters WHERE AdopterID = ? AND DeletedAt IS NULL', (adopter_id,)).fetchone()
+    if adopter is None:
+        abort(404)
+    prefs = conn.execute('SELECT Breed, MinAge, MaxAge, HealthStatus FROM adopter_preferences WHERE AdopterID = ?',
+                         (adopter_id,)).fetchone() or (None, None, None, None)
+    return render_template('adopter_matches.html', adopter=adopter, prefs=prefs,
+                           matches=top_matches(conn, 'adopter', adopter_id, match_limit()).fetchall(),
+                           pending=pending_changes(conn))
+
+
+@bp.route('/adopters/<adopter_id>/preferences', methods=['POST'])
+def save_preferences(adopter_id):
+    values = [request.form.get(name, '').strip() or None for name in ('Breed', 'MinAge', 'MaxAge', 'HealthStatus')]
+    try:
+        values[1:3] = [int(v) if v is not None else None for v in values[1:3]]
+    except ValueError:
+        abort(400, 'MinAge and MaxAge must be whole numbers')
+    execute_write('INSERT OR REPLACE INTO adopter_preferences (AdopterID, Breed, MinAge, MaxAge, HealthStatus) '
+                  'VALUES (?, ?, ?, ?, ?)', [adopter_id] + values, ('adopter_preferences',))
+    return redirect(url_for('matching.adopter_matches', adopter_id=adopter_id))
+
+
+@bp.cli.command('rebuild')
+def rebuild_command():
+    """Rescore every pet against every adopter (run nightly)."""
+    config = current_app.config
+    started = time.perf_counter()
+    pairs = rebuild(get_db(), config['MATCH_CANDIDATES'], shelter_location(config['MATCH_SHELTER_LOCATION']))
+    click.echo('Match index rebuilt with %d pairs in %.2fs%s' % (
+        pairs, time.perf_counter() - started, '' if numpy is not None else ' (without NumPy)'))
+
+
+@bp.cli.command('refresh')
+def refresh_command():
+    """Apply pending changes to the match index once."""
+    config = current_app.config
+    mode, changes = refresh(get_db(), config['MATCH_CANDIDATES'], shelter_location(config['MATCH_SHELTER_LOCATION']),
+                            config['MATCH_REFRESH_BATCH'])
+    click.echo('%d changes applied (%s)' % (changes, mode))
+
+
+def start_refresher(app, pool):
+    # One refresher per database: the app's own and each open tenant's, with
+    # connections made like that database's request pool.
+    config = app.config
+    return MatchRefresher(pool.database,
+                          count=config['MATCH_CANDIDATES'],
+                          shelter=shelter_location(config['MATCH_SHELTER_LOCATION']),
+                          batch=config['MATCH_REFRESH_BATCH'],
+                          interval=config['MATCH_REFRESH_INTERVAL'],
+                          busy_timeout=config['DB_BUSY_TIMEOUT'],
+                          factory=pool.factory,
+                          setup=pool.setup,
+                          metrics=app.extensions.get('metrics'))
+
+
+_refresher_lock = threading.Lock()
+
+
+def start_app_refresher(app):
+    # Starts the refresher for the app's own database unless it is already
+    # running; returns it.
+    with _refresher_lock:
+        if 'match_refresher' in app.extensions:
+            return app.extensions['match_refresher']
+        refresher = start_refresher(app, app.extensions['db_pool'])
+        app.extensions['match_refresher'] = refresher
+    atexit.register(refresher.close)
+    return refresher
+
+
+def start_serving():
+    # As with the job runner, importing the app (flask CLI commands, the
+    # reloader's watcher) starts no thread; the process that serves requests
+    # starts the refresher with its first one. serve.py starts it up front.
+    app = current_app._get_current_object()
+    if 'match_refresher' not in app.extensions:
+        start_app_refresher(app)
+
+
+def init_app(app):
+    app.config.setdefault('MATCH_CANDIDATES', 32)
+    app.config.setdefault('MATCH_LIMIT', 10)
+    app.config.setdefault('MATCH_SHELTER_LOCATION', None)
+    app.config.setdefault('MATCH_REFRESH', True)
+    app.config.setdefault('MATCH_REFRESH_BATCH', 200)
+    app.config.setdefault('MATCH_REFRESH_INTERVAL', 1.0)
+    # A malformed location fails at startup rather than in the refresher.
+    shelter_location(app.config['MATCH_SHELTER_LOCATION'])
+    register_templates(app, {'pet_matches.html': pet_matches_html, 'adopter_matches.html': adopter_matches_html})
+    app.register_blueprint(bp)
+    if app.config['MATCH_REFRESH']:
+        app.before_request(start_serving)
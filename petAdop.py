@@ -1,46 +1,50 @@
-from flask import Flask, render_template_string, request, redirect, url_for
-import sqlite3
+import os
+
+from flask import Flask, render_template, request, redirect, url_for
+
+import assets
+import db
+import schema
+import tenancy
+from db import get_db
+from templating import register_templates, stream_page
 
 app = Flask(__name__)
 DB_NAME = 'pet_adoption.db'
+app.config['DATABASE'] = os.environ.get('PET_ADOPTION_DB', DB_NAME)
+app.config['ASSETS_CDN_FALLBACK'] = os.environ.get('PET_ADOPTION_ASSETS_CDN', '1') != '0'
+# One database per shelter under this directory, picked per request by the
+# X-Shelter header or a subdomain (see tenancy.py).
+app.config['TENANT_DIR'] = os.environ.get('PET_ADOPTION_TENANT_DIR')
+app.config['TENANT_DOMAIN'] = os.environ.get('PET_ADOPTION_TENANT_DOMAIN')
+pool = db.init_app(app)
+assets.init_app(app)
 
 # ---------- DATABASE ----------
+# Same file, same tables as petadopupdate.py: see schema.py. Rows from the
+# Pet/Adopter tables this app used to create are moved over with
+# "flask --app petAdop schema copy-legacy".
+schema.init_app(app)
+
 def init_db():
-    with sqlite3.connect(DB_NAME) as con:
-        con.execute("""CREATE TABLE IF NOT EXISTS Pet (
-            PetID INTEGER PRIMARY KEY,
-            PetName TEXT,
-            Breed TEXT,
-            Age INTEGER,
-            HealthStatus TEXT
-        )""")
-        con.execute("""CREATE TABLE IF NOT EXISTS Adopter (
-            AdopterID INTEGER PRIMARY KEY,
-            FirstName TEXT,
-            LastName TEXT,
-            Contact TEXT,
-            Address TEXT,
-            City TEXT,
-            State TEXT,
-            Country TEXT
-        )""")
+    schema.init_db(pool)
 
 # ---------- ROUTES ----------
 @app.route('/')
 def home():
-    return render_template_string(base_html, content="<h3>Welcome to the Pet Adoption System 🐾</h3>")
+    return render_template('home.html')
 
 # --- PETS CRUD ---
 @app.route('/pets')
 def pets():
-    con = sqlite3.connect(DB_NAME)
-    pets = con.execute("SELECT * FROM Pet").fetchall()
-    return render_template_string(base_html, content=render_template_string(pets_html, pets=pets))
+    con = get_db()
+    pets = con.execute("SELECT * FROM pets WHERE DeletedAt IS NULL")
+    return stream_page('pets.html', pets=pets)
 
 @app.route('/add_pet', methods=['POST'])
 def add_pet():
-    con = sqlite3.connect(DB_NAME)
-    con.execute("INSERT INTO Pet VALUES (?, ?, ?, ?, ?)", (
+    con = get_db()
+    con.execute("INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES (?, ?, ?, ?, ?)", (
         request.form['PetID'],
         request.form['PetName'],
         request.form['Breed'],
@@ -50,11 +54,11 @@ def add_pet():
     con.commit()
     return redirect('/pets')
 
-@app.route('/edit_pet/<int:pet_id>', methods=['GET', 'POST'])
+@app.route('/edit_pet/<pet_id>', methods=['GET', 'POST'])
 def edit_pet(pet_id):
-    con = sqlite3.connect(DB_NAME)
+    con = get_db()
     if request.method == 'POST':
-        con.execute("""UPDATE Pet SET PetName=?, Breed=?, Age=?, HealthStatus=? WHERE PetID=?""", (
+        con.execute("""UPDATE pets SET PetName=?, Breed=?, Age=?, HealthStatus=? WHERE PetID=?""", (
             request.form['PetName'],
             request.form['Breed'],
             request.form['Age'],
@@ -63,27 +67,28 @@ def edit_pet(pet_id):
         ))
         con.commit()
         return redirect('/pets')
-    pet = con.execute("SELECT * FROM Pet WHERE PetID=?", (pet_id,)).fetchone()
-    return render_template_string(base_html, content=render_template_string(edit_pet_html, pet=pet))
+    pet = con.execute("SELECT * FROM pets WHERE PetID=?", (pet_id,)).fetchone()
+    return render_template('edit_pet.html', pet=pet)
 
-@app.route('/delete_pet/<int:pet_id>')
+@app.route('/delete_pet/<pet_id>')
 def delete_pet(pet_id):
-    con = sqlite3.connect(DB_NAME)
-    con.execute("DELETE FROM Pet WHERE PetID=?", (pet_id,))
+    con = get_db()
+    con.execute("UPDATE pets SET DeletedAt=%s WHERE PetID=? AND DeletedAt IS NULL" % schema.NOW, (pet_id,))
     con.commit()
     return redirect('/pets')
 
 # --- ADOPTERS CRUD ---
 @app.route('/adopters')
 def adopters():
-    con = sqlite3.connect(DB_NAME)
-    adopters = con.execute("SELECT * FROM Adopter").fetchall()
-    return render_template_string(base_html, content=render_template_string(adopters_html, adopters=adopters))
+    con = get_db()
+    adopters = con.execute("SELECT * FROM adopters WHERE DeletedAt IS NULL")
+    return stream_page('adopters.html', adopters=adopters)
 
 @app.route('/add_adopter', methods=['POST'])
 def add_adopter():
-    con = sqlite3.connect(DB_NAME)
-    con.execute("INSERT INTO Adopter VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+    con = get_db()
+    con.execute("""INSERT INTO adopters (AdopterID, FirstName, LastName, Contact, Address, City, State, Country)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", (
         request.form['AdopterID'],
         request.form['FirstName'],
         request.form['LastName'],
@@ -96,11 +101,11 @@ def add_adopter():
     con.commit()
     return redirect('/adopters')
 
-@app.route('/edit_adopter/<int:adopter_id>', methods=['GET', 'POST'])
+@app.route('/edit_adopter/<adopter_id>', methods=['GET', 'POST'])
 def edit_adopter(adopter_id):
-    con = sqlite3.connect(DB_NAME)
+    con = get_db()
     if request.method == 'POST':
-        con.execute("""UPDATE Adopter SET FirstName=?, LastName=?, Contact=?, Address=?, City=?, State=?, Country=? WHERE AdopterID=?""", (
+        con.execute("""UPDATE adopters SET FirstName=?, LastName=?, Contact=?, Address=?, City=?, State=?, Country=? WHERE AdopterID=?""", (
             request.form['FirstName'],
             request.form['LastName'],
             request.form['Contact'],
@@ -112,13 +117,13 @@ def edit_adopter(adopter_id):
         ))
         con.commit()
         return redirect('/adopters')
-    adopter = con.execute("SELECT * FROM Adopter WHERE AdopterID=?", (adopter_id,)).fetchone()
-    return render_template_string(base_html, content=render_template_string(edit_adopter_html, adopter=adopter))
+    adopter = con.execute("SELECT * FROM adopters WHERE AdopterID=?", (adopter_id,)).fetchone()
+    return render_template('edit_adopter.html', adopter=adopter)
 
-@app.route('/delete_adopter/<int:adopter_id>')
+@app.route('/delete_adopter/<adopter_id>')
 def delete_adopter(adopter_id):
-    con = sqlite3.connect(DB_NAME)
-    con.execute("DELETE FROM Adopter WHERE AdopterID=?", (adopter_id,))
+    con = get_db()
+    con.execute("UPDATE adopters SET DeletedAt=%s WHERE AdopterID=? AND DeletedAt IS NULL" % schema.NOW, (adopter_id,))
     con.commit()
     return redirect('/adopters')
 
@@ -128,7 +133,7 @@ base_html = """
 <html>
 <head>
   <title>Pet Adoption</title>
-  <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css">
+  <link rel="stylesheet" href="{{ asset_url('bootstrap.min.css') }}">
 </head>
 <body>
 <div class="container mt-4">
@@ -138,13 +143,15 @@ base_html = """
     <a href="/pets" class="btn btn-success">Pets</a>
     <a href="/adopters" class="btn btn-warning">Adopters</a>
   </nav>
-  {{ content|safe }}
+  {% block content %}{% endblock %}
 </div>
 </body>
 </html>
 """
 
 pets_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>All Pets</h4>
 <table class="table table-bordered">
 <tr><th>ID</th><th>Name</th><th>Breed</th><th>Age</th><th>Health</th><th>Actions</th></tr>
@@ -168,9 +175,12 @@ pets_html = """
   <input name="HealthStatus" class="form-control" placeholder="Health"><br>
   <button class="btn btn-primary">Add Pet</button>
 </form>
+{% endblock %}
 """
 
 edit_pet_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>Edit Pet</h4>
 <form method="POST">
   <input name="PetName" class="form-control" value="{{pet[1]}}"><br>
@@ -179,9 +189,12 @@ edit_pet_html = """
   <input name="HealthStatus" class="form-control" value="{{pet[4]}}"><br>
   <button class="btn btn-success">Update Pet</button>
 </form>
+{% endblock %}
 """
 
 adopters_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>All Adopters</h4>
 <table class="table table-bordered">
 <tr><th>ID</th><th>Name</th><th>Contact</th><th>City</th><th>Actions</th></tr>
@@ -208,9 +221,12 @@ adopters_html = """
   <input name="Country" class="form-control" placeholder="Country"><br>
   <button class="btn btn-warning">Add Adopter</button>
 </form>
+{% endblock %}
 """
 
 edit_adopter_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>Edit Adopter</h4>
 <form method="POST">
   <input name="FirstName" class="form-control" value="{{adopter[1]}}"><br>
@@ -222,8 +238,24 @@ edit_adopter_html = """
   <input name="Country" class="form-control" value="{{adopter[7]}}"><br>
   <button class="btn btn-success">Update Adopter</button>
 </form>
+{% endblock %}
 """
 
+home_html = """
+{% extends "base.html" %}
+{% block content %}<h3>Welcome to the Pet Adoption System 🐾</h3>{% endblock %}
+"""
+
+register_templates(app, {
+    'base.html': base_html,
+    'home.html': home_html,
+    'pets.html': pets_html,
+    'edit_pet.html': edit_pet_html,
+    'adopters.html': adopters_html,
+    'edit_adopter.html': edit_adopter_html,
+})
+tenancy.init_app(app)
+
 # ---------- MAIN ----------
 if __name__ == '__main__':
     init_db()
@@ -1,62 +1,68 @@
-from flask import Flask, render_template_string, request, redirect
+from flask import Flask, abort, render_template, request, redirect
+import os
 import sqlite3
 
+import adoption
+import api
+import archive
+import assets
+import cache
+import compression
+import dashboard
+import db
+import exporter
+import importer
+import instrumentation
+import jobs
+import matching
+import schema
+import search
+import snapshot
+import tenancy
+import writebehind
+from cache import cached, invalidates
+from adoption import PetUnavailable, adopt
+from db import DatabaseBusy, get_db
+from importer import clean_record, clean_value
+from listing import fetch_page, list_queries
+from templating import register_templates, stream_page
+from writebehind import execute_write
+
 app = Flask(__name__)
+app.config['DATABASE'] = os.environ.get('PET_ADOPTION_DB', 'pet_adoption.db')
+app.config['DB_POOL_SIZE'] = int(os.environ.get('PET_ADOPTION_DB_POOL_SIZE', 5))
+app.config['CACHE_ENABLED'] = os.environ.get('PET_ADOPTION_CACHE', '1') != '0'
+app.config['METRICS_ENABLED'] = os.environ.get('PET_ADOPTION_METRICS', '1') != '0'
+app.config['COMPRESS_ENABLED'] = os.environ.get('PET_ADOPTION_COMPRESS', '1') != '0'
+app.config['ASSETS_CDN_FALLBACK'] = os.environ.get('PET_ADOPTION_ASSETS_CDN', '1') != '0'
+app.config['PROFILE_ENABLED'] = os.environ.get('PET_ADOPTION_PROFILE', '0') == '1'
+app.config['PROFILE_TOKEN'] = os.environ.get('PET_ADOPTION_PROFILE_TOKEN')
+app.config['WRITE_BEHIND'] = os.environ.get('PET_ADOPTION_WRITE_BEHIND', '0') == '1'
+app.config['WRITE_BEHIND_ACK'] = os.environ.get('PET_ADOPTION_WRITE_ACK', 'commit')
+app.config['MATCH_SHELTER_LOCATION'] = os.environ.get('PET_ADOPTION_SHELTER')
+app.config['MATCH_REFRESH'] = os.environ.get('PET_ADOPTION_MATCH_REFRESH', '1') != '0'
+app.config['ARCHIVE_DATABASE'] = os.environ.get('PET_ADOPTION_ARCHIVE_DB')
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('PET_ADOPTION_ARCHIVE_AFTER_DAYS', 365))
+app.config['JOBS_ENABLED'] = os.environ.get('PET_ADOPTION_JOBS', '1') != '0'
+app.config['JOBS_WORKERS'] = int(os.environ.get('PET_ADOPTION_JOBS_WORKERS', 2))
+app.config['TENANT_DIR'] = os.environ.get('PET_ADOPTION_TENANT_DIR')
+app.config['TENANT_DOMAIN'] = os.environ.get('PET_ADOPTION_TENANT_DOMAIN')
+app.config['SNAPSHOT_MODE'] = os.environ.get('PET_ADOPTION_SNAPSHOT')
+app.config['SNAPSHOT_INTERVAL'] = float(os.environ.get('PET_ADOPTION_SNAPSHOT_INTERVAL', 30))
+app.config['SNAPSHOT_MAX_AGE'] = float(os.environ.get('PET_ADOPTION_SNAPSHOT_MAX_AGE', 120))
+pool = db.init_app(app)
+cache.init_app(app)
+instrumentation.init_app(app)
+compression.init_app(app)
+assets.init_app(app)
+adoption.init_app(app)
+archive.init_app(app)
+writebehind.init_app(app)
+schema.init_app(app)
 
 # Database setup
-def init_db():
-    conn = sqlite3.connect('pet_adoption.db')
-    c = conn.cursor()
-    
-    # Create tables
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS pets (
-        PetID TEXT PRIMARY KEY,
-        PetName TEXT NOT NULL,
-        Breed TEXT NOT NULL,
-        Age INTEGER NOT NULL,
-        HealthStatus TEXT NOT NULL
-    )
-    ''')
-    
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS adopters (
-        AdopterID TEXT PRIMARY KEY,
-        FirstName TEXT NOT NULL,
-        LastName TEXT NOT NULL,
-        Contact TEXT NOT NULL,
-        Address TEXT NOT NULL,
-        City TEXT NOT NULL,
-        State TEXT NOT NULL,
-        Country TEXT NOT NULL
-    )
-    ''')
-
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS adoptions (
-        AdoptionID INTEGER PRIMARY KEY AUTOINCREMENT,
-        PetID TEXT NOT NULL,
-        AdopterID TEXT NOT NULL,
-        AdoptionDate TEXT NOT NULL,
-        FOREIGN KEY (PetID) REFERENCES pets(PetID),
-        FOREIGN KEY (AdopterID) REFERENCES adopters(AdopterID)
-    )
-    ''')
-
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS payments (
-        PaymentID INTEGER PRIMARY KEY AUTOINCREMENT,
-        AdoptionID INTEGER NOT NULL,
-        Amount REAL NOT NULL,
-        PaymentDate TEXT NOT NULL,
-        FOREIGN KEY (AdoptionID) REFERENCES adoptions(AdoptionID)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-init_db()
+schema.init_db(pool)
+matching.init_app(app)
 
 # HTML Templates
 base_html = """
@@ -64,7 +70,7 @@ base_html = """
 <html lang="en">
 <head>
     <title>Pet Adoption System</title>
-    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css">
+    <link rel="stylesheet" href="{{ asset_url('bootstrap.min.css') }}">
 </head>
 <body class="p-4">
     <h2>Pet Adoption Management</h2>
@@ -73,29 +79,83 @@ base_html = """
         <a href="/adopters" class="btn btn-primary">Adopters</a>
         <a href="/adoptions" class="btn btn-primary">Adoptions</a>
         <a href="/payments" class="btn btn-primary">Payments</a>
+        <a href="/dashboard" class="btn btn-outline-primary">Dashboard</a>
+        <a href="/reminders" class="btn btn-outline-primary">Reminders</a>
+        <a href="/import" class="btn btn-outline-primary">Import</a>
+        <form action="/search" class="d-inline-flex ms-2"><input name="q" class="form-control" placeholder="Search"></form>
     </nav>
     <div>
-        {{ content|safe }}
+        {% block content %}{% endblock %}
     </div>
 </body>
 </html>
 """
 
+# --- LIST PAGE CONTROLS ---
+list_controls_html = """
+<form method="GET" class="row g-2 align-items-center mb-2">
+  {% for f in page.filters %}
+  <div class="col-auto">
+    <input name="{{f.name}}" type="{{f.type}}" value="{{f.value}}" class="form-control form-control-sm" placeholder="{{f.name}}" title="{{f.name}}">
+  </div>
+  {% endfor %}
+  <div class="col-auto">
+    <select name="sort" class="form-select form-select-sm">
+      {% for s in page.sorts %}<option value="{{s}}" {% if s == page.sort %}selected{% endif %}>Sort by {{s}}</option>{% endfor %}
+    </select>
+  </div>
+  <div class="col-auto">
+    <select name="order" class="form-select form-select-sm">
+      <option value="asc">Ascending</option>
+      <option value="desc" {% if page.order == 'desc' %}selected{% endif %}>Descending</option>
+    </select>
+  </div>
+  <div class="col-auto">
+    <input name="limit" type="number" min="1" max="{{page.max_limit}}" value="{{page.limit}}" class="form-control form-control-sm" title="Rows per page">
+  </div>
+  {% if page.archived %}
+  <div class="col-auto form-check">
+    <input name="scope" value="all" type="checkbox" id="scope" class="form-check-input" {% if page.scope == 'all' %}checked{% endif %}>
+    <label for="scope" class="form-check-label">Include archive</label>
+  </div>
+  {% endif %}
+  <div class="col-auto">
+    <button class="btn btn-secondary btn-sm">Apply</button>
+    <a href="?" class="btn btn-link btn-sm">Reset</a>
+  </div>
+</form>
+<p class="text-muted">{{page.total}} records in total &middot;
+  Export <a href="{{ url_for('exporter.export', table=page.table, fmt='csv', **page.filter_args) }}">CSV</a>
+  / <a href="{{ url_for('exporter.export', table=page.table, fmt='jsonl', **page.filter_args) }}">JSONL</a></p>
+"""
+
+pager_html = """
+<div class="mb-4">
+  {% if page.cursor %}<a href="{{page.first_url}}" class="btn btn-outline-secondary btn-sm">First page</a>{% endif %}
+  {% if page.next_url %}<a href="{{page.next_url}}" class="btn btn-outline-primary btn-sm">Next page</a>{% endif %}
+</div>
+"""
+
 # --- PETS TEMPLATE ---
 pets_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>All Pets</h4>
+{% include "list_controls.html" %}
 <table class="table table-bordered">
-<tr><th>ID</th><th>Name</th><th>Breed</th><th>Age</th><th>Health</th><th>Actions</th></tr>
+<tr><th>ID</th><th>Name</th><th>Breed</th><th>Age</th><th>Health</th><th>Status</th><th>Actions</th></tr>
 {% for p in pets %}
 <tr>
-<td>{{p[0]}}</td><td>{{p[1]}}</td><td>{{p[2]}}</td><td>{{p[3]}}</td><td>{{p[4]}}</td>
+<td>{{p[0]}}</td><td>{{p[1]}}</td><td>{{p[2]}}</td><td>{{p[3]}}</td><td>{{p[4]}}</td><td>{{p[7]}}</td>
 <td>
+  <a href="/pets/{{p[0]}}/matches" class="btn btn-info btn-sm">Matches</a>
   <a href="/edit_pet/{{p[0]}}" class="btn btn-warning btn-sm">Edit</a>
   <a href="/delete_pet/{{p[0]}}" class="btn btn-danger btn-sm">Delete</a>
 </td>
 </tr>
 {% endfor %}
 </table>
+{% include "pager.html" %}
 
 <h5>Add New Pet</h5>
 <form method="POST" action="/add_pet">
@@ -106,9 +166,12 @@ pets_html = """
   <input name="HealthStatus" class="form-control" placeholder="Health Status" required><br>
   <button class="btn btn-success">Add Pet</button>
 </form>
+{% endblock %}
 """
 
 edit_pet_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>Edit Pet</h4>
 <form method="POST">
   <input name="PetName" class="form-control" placeholder="Pet Name" value="{{pet[1]}}" required><br>
@@ -117,23 +180,29 @@ edit_pet_html = """
   <input name="HealthStatus" class="form-control" placeholder="Health Status" value="{{pet[4]}}" required><br>
   <button class="btn btn-warning">Update Pet</button>
 </form>
+{% endblock %}
 """
 
 # --- ADOPTERS TEMPLATE ---
 adopters_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>All Adopters</h4>
+{% include "list_controls.html" %}
 <table class="table table-bordered">
 <tr><th>ID</th><th>First Name</th><th>Last Name</th><th>Contact</th><th>City</th><th>Actions</th></tr>
 {% for a in adopters %}
 <tr>
 <td>{{a[0]}}</td><td>{{a[1]}}</td><td>{{a[2]}}</td><td>{{a[3]}}</td><td>{{a[5]}}</td>
 <td>
+  <a href="/adopters/{{a[0]}}/matches" class="btn btn-info btn-sm">Matches</a>
   <a href="/edit_adopter/{{a[0]}}" class="btn btn-warning btn-sm">Edit</a>
   <a href="/delete_adopter/{{a[0]}}" class="btn btn-danger btn-sm">Delete</a>
 </td>
 </tr>
 {% endfor %}
 </table>
+{% include "pager.html" %}
 
 <h5>Add New Adopter</h5>
 <form method="POST" action="/add_adopter">
@@ -147,9 +216,12 @@ adopters_html = """
   <input name="Country" class="form-control" placeholder="Country" required><br>
   <button class="btn btn-warning">Add Adopter</button>
 </form>
+{% endblock %}
 """
 
 edit_adopter_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>Edit Adopter</h4>
 <form method="POST">
   <input name="FirstName" class="form-control" placeholder="First Name" value="{{adopter[1]}}" required><br>
@@ -161,36 +233,48 @@ edit_adopter_html = """
   <input name="Country" class="form-control" placeholder="Country" value="{{adopter[7]}}" required><br>
   <button class="btn btn-warning">Update Adopter</button>
 </form>
+{% endblock %}
 """
 
 # --- ADOPTIONS TEMPLATE ---
 adoptions_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>All Adoptions</h4>
+{% include "list_controls.html" %}
 <table class="table table-bordered">
 <tr><th>ID</th><th>Pet ID</th><th>Adopter ID</th><th>Date</th></tr>
 {% for a in adoptions %}
 <tr><td>{{a[0]}}</td><td>{{a[1]}}</td><td>{{a[2]}}</td><td>{{a[3]}}</td></tr>
 {% endfor %}
 </table>
+{% include "pager.html" %}
 
 <h5>New Adoption</h5>
-<form method="POST" action="/add_adoption">
+<form method="POST" action="/adopt">
   <input name="PetID" class="form-control" placeholder="Pet ID" required><br>
   <input name="AdopterID" class="form-control" placeholder="Adopter ID" required><br>
   <input name="AdoptionDate" class="form-control" placeholder="Adoption Date (YYYY-MM-DD)" required><br>
+  <input name="Amount" class="form-control" type="number" step="0.01" placeholder="Adoption fee (optional, recorded as a payment)"><br>
+  <input name="PaymentDate" class="form-control" placeholder="Payment Date (YYYY-MM-DD, defaults to the adoption date)"><br>
   <button class="btn btn-success">Add Adoption</button>
 </form>
+{% endblock %}
 """
 
 # --- PAYMENTS TEMPLATE ---
 payments_html = """
+{% extends "base.html" %}
+{% block content %}
 <h4>All Payments</h4>
+{% include "list_controls.html" %}
 <table class="table table-bordered">
 <tr><th>ID</th><th>Adoption ID</th><th>Amount</th><th>Payment Date</th></tr>
 {% for p in payments %}
 <tr><td>{{p[0]}}</td><td>{{p[1]}}</td><td>{{p[2]}}</td><td>{{p[3]}}</td></tr>
 {% endfor %}
 </table>
+{% include "pager.html" %}
 
 <h5>New Payment</h5>
 <form method="POST" action="/add_payment">
@@ -199,135 +283,256 @@ payments_html = """
   <input name="PaymentDate" class="form-control" placeholder="Payment Date (YYYY-MM-DD)" required><br>
   <button class="btn btn-success">Add Payment</button>
 </form>
+{% endblock %}
+"""
+
+# --- ADMIN TEMPLATES ---
+explain_html = """
+{% extends "base.html" %}
+{% block content %}
+<h4>Query Plans</h4>
+<p class="text-muted">{{ warnings }} of {{ plans|length }} queries scan a whole table or sort without an index.</p>
+<table class="table table-bordered table-sm">
+<tr><th>Query</th><th>Plan</th></tr>
+{% for p in plans %}
+<tr class="{{ 'table-warning' if p.warning else '' }}">
+<td><strong>{{p.label}}</strong><br><code>{{p.sql}}</code></td>
+<td><pre class="mb-0">{{ p.plan|join('\n') }}</pre></td>
+</tr>
+{% endfor %}
+</table>
+{% endblock %}
+"""
+
+error_html = """
+{% extends "base.html" %}
+{% block content %}
+<div class="alert alert-danger">{{ message }}</div>
+<a href="javascript:history.back()" class="btn btn-secondary">Back</a>
+{% endblock %}
 """
 
+templates = {
+    'base.html': base_html,
+    'list_controls.html': list_controls_html,
+    'pager.html': pager_html,
+    'pets.html': pets_html,
+    'edit_pet.html': edit_pet_html,
+    'adopters.html': adopters_html,
+    'edit_adopter.html': edit_adopter_html,
+    'adoptions.html': adoptions_html,
+    'payments.html': payments_html,
+    'explain.html': explain_html,
+    'error.html': error_html,
+}
+register_templates(app, templates)
+importer.init_app(app)
+exporter.init_app(app)
+api.init_app(app)
+dashboard.init_app(app)
+search.init_app(app)
+jobs.init_app(app)
+tenancy.init_app(app)
+snapshot.init_app(app)
+
+# Statements issued by the CRUD routes, in addition to the list-page queries,
+# audited by /admin/explain.
+QUERIES = [
+    ('pet by id', "SELECT * FROM pets WHERE PetID=? AND DeletedAt IS NULL"),
+    ('insert pet', "INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES (?, ?, ?, ?, ?)"),
+    ('update pet', "UPDATE pets SET PetName=?, Breed=?, Age=?, HealthStatus=? WHERE PetID=? AND DeletedAt IS NULL"),
+    ('delete pet', "UPDATE pets SET DeletedAt=%s WHERE PetID=? AND DeletedAt IS NULL" % schema.NOW),
+    ('adopter by id', "SELECT * FROM adopters WHERE AdopterID=? AND DeletedAt IS NULL"),
+    ('insert adopter', "INSERT INTO adopters (AdopterID, FirstName, LastName, Contact, Address, City, State, Country) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"),
+    ('update adopter', "UPDATE adopters SET FirstName=?, LastName=?, Contact=?, Address=?, City=?, State=?, Country=? WHERE AdopterID=? AND DeletedAt IS NULL"),
+    ('delete adopter', "UPDATE adopters SET DeletedAt=%s WHERE AdopterID=? AND DeletedAt IS NULL" % schema.NOW),
+    ('claim pet', "UPDATE pets SET Status = 'adopted' WHERE PetID = ? AND Status = 'available' AND DeletedAt IS NULL"),
+    ('insert adoption', "INSERT INTO adoptions (PetID, AdopterID, AdoptionDate) VALUES (?, ?, ?)"),
+    ('insert payment', "INSERT INTO payments (AdoptionID, Amount, PaymentDate) VALUES (?, ?, ?)"),
+    ('row count', "SELECT Total FROM row_counts WHERE TableName=?"),
+    ('search pets', "SELECT t.* FROM pets_fts JOIN pets t ON t.rowid = pets_fts.rowid WHERE pets_fts MATCH ? AND t.DeletedAt IS NULL ORDER BY pets_fts.rank LIMIT ?"),
+    ('search adopters', "SELECT t.* FROM adopters_fts JOIN adopters t ON t.rowid = adopters_fts.rowid WHERE adopters_fts MATCH ? AND t.DeletedAt IS NULL ORDER BY adopters_fts.rank LIMIT ?"),
+    # Foreign key check made when the archiver deletes a moved adoption
+    ('fk check payments.AdoptionID', "SELECT 1 FROM payments WHERE AdoptionID=?"),
+    ('archive closed adoptions', archive.CLOSED_ADOPTIONS),
+    ('queued job runs', jobs.QUEUED),
+    ('open reminders', jobs.OPEN_REMINDERS),
+]
+
+def plan_warning(plan):
+    # A SCAN without an index reads the whole table; sorts after an index
+    # SEARCH only touch the matching range and are not flagged, nor are FTS
+    # lookups, which the planner reports as a virtual table scan.
+    return any(line.startswith('SCAN ') and ' USING ' not in line and ' VIRTUAL TABLE INDEX ' not in line
+               for line in plan)
+
+@app.errorhandler(sqlite3.IntegrityError)
+def integrity_error(e):
+    return render_template('error.html', message='The change was rejected by the database: %s' % e), 409
+
+@app.errorhandler(400)
+def bad_request(e):
+    return render_template('error.html', message=e.description), 400
+
+@app.errorhandler(PetUnavailable)
+def pet_unavailable(e):
+    return render_template('error.html', message=str(e)), 409
+
+@app.errorhandler(DatabaseBusy)
+def database_busy(e):
+    return render_template('error.html', message='The database is busy, please try again.'), 503, {'Retry-After': '1'}
+
 # ROUTES
 
 @app.route('/')
 def home():
     return redirect('/pets')
 
+def form_values(table, **fixed):
+    # Checked like an import row, so a bad value is turned away with a 400
+    # here rather than failing later inside a write-behind batch. fixed holds
+    # values taken from the URL rather than the form.
+    record = request.form.to_dict()
+    record.update(fixed)
+    try:
+        return clean_record(table, record)
+    except ValueError as e:
+        abort(400, description=str(e))
+
+def form_value(name, kind):
+    # An optional form field outside the table's import columns; None when
+    # left blank.
+    if not request.form.get(name, '').strip():
+        return None
+    try:
+        return clean_value(name, kind, request.form[name])
+    except (TypeError, ValueError) as e:
+        abort(400, description='%s: %s' % (name, e))
+
 @app.route('/pets', methods=['GET'])
+@cached('pets')
 def pets():
-    conn = sqlite3.connect('pet_adoption.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM pets")
-    pets = c.fetchall()
-    conn.close()
-    return render_template_string(base_html, content=render_template_string(pets_html, pets=pets))
+    pets, page = fetch_page('pets')
+    return stream_page('pets.html', pets=pets, page=page)
 
 @app.route('/add_pet', methods=['POST'])
+@invalidates('pets')
 def add_pet():
-    data = (request.form['PetID'], request.form['PetName'], request.form['Breed'], request.form['Age'], request.form['HealthStatus'])
-    conn = sqlite3.connect('pet_adoption.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO pets VALUES (?, ?, ?, ?, ?)", data)
-    conn.commit()
-    conn.close()
+    data = form_values('pets')
+    execute_write("INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES (?, ?, ?, ?, ?)", data, ('pets',))
     return redirect('/pets')
 
 @app.route('/edit_pet/<PetID>', methods=['GET', 'POST'])
+@cached('pets')
+@invalidates('pets', methods=['POST'])
 def edit_pet(PetID):
-    conn = sqlite3.connect('pet_adoption.db')
+    conn = get_db()
     c = conn.cursor()
     if request.method == 'POST':
-        data = (request.form['PetName'], request.form['Breed'], request.form['Age'], request.form['HealthStatus'], PetID)
-        c.execute("UPDATE pets SET PetName=?, Breed=?, Age=?, HealthStatus=? WHERE PetID=?", data)
+        data = form_values('pets', PetID=PetID)[1:] + [PetID]
+        c.execute("UPDATE pets SET PetName=?, Breed=?, Age=?, HealthStatus=? WHERE PetID=? AND DeletedAt IS NULL", data)
         conn.commit()
         return redirect('/pets')
-    c.execute("SELECT * FROM pets WHERE PetID=?", (PetID,))
+    c.execute("SELECT * FROM pets WHERE PetID=? AND DeletedAt IS NULL", (PetID,))
     pet = c.fetchone()
-    return render_template_string(base_html, content=render_template_string(edit_pet_html, pet=pet))
+    if pet is None:
+        abort(404)
+    return render_template('edit_pet.html', pet=pet)
 
 @app.route('/delete_pet/<PetID>')
+@invalidates('pets')
 def delete_pet(PetID):
-    conn = sqlite3.connect('pet_adoption.db')
+    conn = get_db()
     c = conn.cursor()
-    c.execute("DELETE FROM pets WHERE PetID=?", (PetID,))
+    # Soft delete: the pet's adoptions and payments keep pointing at it.
+    c.execute("UPDATE pets SET DeletedAt=%s WHERE PetID=? AND DeletedAt IS NULL" % schema.NOW, (PetID,))
     conn.commit()
-    conn.close()
     return redirect('/pets')
 
 @app.route('/adopters', methods=['GET'])
+@cached('adopters')
 def adopters():
-    conn = sqlite3.connect('pet_adoption.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM adopters")
-    adopters = c.fetchall()
-    conn.close()
-    return render_template_string(base_html, content=render_template_string(adopters_html, adopters=adopters))
+    adopters, page = fetch_page('adopters')
+    return stream_page('adopters.html', adopters=adopters, page=page)
 
 @app.route('/add_adopter', methods=['POST'])
+@invalidates('adopters')
 def add_adopter():
-    data = (request.form['AdopterID'], request.form['FirstName'], request.form['LastName'], request.form['Contact'],
-            request.form['Address'], request.form['City'], request.form['State'], request.form['Country'])
-    conn = sqlite3.connect('pet_adoption.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO adopters VALUES (?, ?, ?, ?, ?, ?, ?, ?)", data)
-    conn.commit()
-    conn.close()
+    data = form_values('adopters')
+    execute_write("INSERT INTO adopters (AdopterID, FirstName, LastName, Contact, Address, City, State, Country) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                  data, ('adopters',))
     return redirect('/adopters')
 
 @app.route('/edit_adopter/<AdopterID>', methods=['GET', 'POST'])
+@cached('adopters')
+@invalidates('adopters', methods=['POST'])
 def edit_adopter(AdopterID):
-    conn = sqlite3.connect('pet_adoption.db')
+    conn = get_db()
     c = conn.cursor()
     if request.method == 'POST':
-        data = (request.form['FirstName'], request.form['LastName'], request.form['Contact'], request.form['Address'],
-                request.form['City'], request.form['State'], request.form['Country'], AdopterID)
-        c.execute("UPDATE adopters SET FirstName=?, LastName=?, Contact=?, Address=?, City=?, State=?, Country=? WHERE AdopterID=?", data)
+        data = form_values('adopters', AdopterID=AdopterID)[1:] + [AdopterID]
+        c.execute("UPDATE adopters SET FirstName=?, LastName=?, Contact=?, Address=?, City=?, State=?, Country=? WHERE AdopterID=? AND DeletedAt IS NULL", data)
         conn.commit()
         return redirect('/adopters')
-    c.execute("SELECT * FROM adopters WHERE AdopterID=?", (AdopterID,))
+    c.execute("SELECT * FROM adopters WHERE AdopterID=? AND DeletedAt IS NULL", (AdopterID,))
     adopter = c.fetchone()
-    return render_template_string(base_html, content=render_template_string(edit_adopter_html, adopter=adopter))
+    if adopter is None:
+        abort(404)
+    return render_template('edit_adopter.html', adopter=adopter)
 
 @app.route('/delete_adopter/<AdopterID>')
+@invalidates('adopters')
 def delete_adopter(AdopterID):
-    conn = sqlite3.connect('pet_adoption.db')
+    conn = get_db()
     c = conn.cursor()
-    c.execute("DELETE FROM adopters WHERE AdopterID=?", (AdopterID,))
+    c.execute("UPDATE adopters SET DeletedAt=%s WHERE AdopterID=? AND DeletedAt IS NULL" % schema.NOW, (AdopterID,))
     conn.commit()
-    conn.close()
     return redirect('/adopters')
 
 @app.route('/adoptions', methods=['GET'])
+@cached('adoptions')
 def adoptions():
-    conn = sqlite3.connect('pet_adoption.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM adoptions")
-    adoptions = c.fetchall()
-    conn.close()
-    return render_template_string(base_html, content=render_template_string(adoptions_html, adoptions=adoptions))
+    adoptions, page = fetch_page('adoptions')
+    return stream_page('adoptions.html', adoptions=adoptions, page=page)
 
 @app.route('/add_adoption', methods=['POST'])
 def add_adoption():
-    data = (request.form['PetID'], request.form['AdopterID'], request.form['AdoptionDate'])
-    conn = sqlite3.connect('pet_adoption.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO adoptions (PetID, AdopterID, AdoptionDate) VALUES (?, ?, ?)", data)
-    conn.commit()
-    conn.close()
+    _, pet_id, adopter_id, adoption_date = form_values('adoptions')
+    adopt(pet_id, adopter_id, adoption_date)
     return redirect('/adoptions')
 
+@app.route('/adopt', methods=['POST'])
+def adopt_pet():
+    # Adoption and its fee in one transaction; see adoption.adopt_and_pay.
+    _, pet_id, adopter_id, adoption_date = form_values('adoptions')
+    amount = form_value('Amount', 'real')
+    adopt(pet_id, adopter_id, adoption_date, amount, form_value('PaymentDate', 'date'))
+    return redirect('/payments' if amount is not None else '/adoptions')
+
 @app.route('/payments', methods=['GET'])
+@cached('payments')
 def payments():
-    conn = sqlite3.connect('pet_adoption.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM payments")
-    payments = c.fetchall()
-    conn.close()
-    return render_template_string(base_html, content=render_template_string(payments_html, payments=payments))
+    payments, page = fetch_page('payments')
+    return stream_page('payments.html', payments=payments, page=page)
 
 @app.route('/add_payment', methods=['POST'])
+@invalidates('payments')
 def add_payment():
-    data = (request.form['AdoptionID'], request.form['Amount'], request.form['PaymentDate'])
-    conn = sqlite3.connect('pet_adoption.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO payments (AdoptionID, Amount, PaymentDate) VALUES (?, ?, ?)", data)
-    conn.commit()
-    conn.close()
+    data = form_values('payments')[1:]
+    execute_write("INSERT INTO payments (AdoptionID, Amount, PaymentDate) VALUES (?, ?, ?)", data, ('payments',))
     return redirect('/payments')
 
+@app.route('/admin/explain')
+def explain():
+    conn = get_db()
+    plans = []
+    for label, sql in list_queries() + QUERIES:
+        params = [None] * sql.count('?')
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        plan = [row[-1] for row in rows]
+        plans.append({'label': label, 'sql': sql, 'plan': plan, 'warning': plan_warning(plan)})
+    warnings = sum(1 for p in plans if p['warning'])
+    return render_template('explain.html', plans=plans, warnings=warnings)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,404 @@
+import logging
+import sqlite3
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import adoption
+import archive
+import dashboard
+import jobs
+import matching
+import search
+from db import get_db, run_immediate
+from listing import create_counters, soft_delete_statements
+
+log = logging.getLogger(__name__)
+
+# The one schema both entry points run against: the base tables, as column
+# definitions and table constraints. Everything added since lives in
+# MIGRATIONS.
+BASE_COLUMNS = {
+    'pets': [
+        ('PetID', 'TEXT PRIMARY KEY'),
+        ('PetName', 'TEXT NOT NULL'),
+        ('Breed', 'TEXT NOT NULL'),
+        ('Age', 'INTEGER NOT NULL'),
+        ('HealthStatus', 'TEXT NOT NULL'),
+    ],
+    'adopters': [
+        ('AdopterID', 'TEXT PRIMARY KEY'),
+        ('FirstName', 'TEXT NOT NULL'),
+        ('LastName', 'TEXT NOT NULL'),
+        ('Contact', 'TEXT NOT NULL'),
+        ('Address', 'TEXT NOT NULL'),
+        ('City', 'TEXT NOT NULL'),
+        ('State', 'TEXT NOT NULL'),
+        ('Country', 'TEXT NOT NULL'),
+    ],
+    'adoptions': [
+        ('AdoptionID', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('PetID', 'TEXT NOT NULL'),
+        ('AdopterID', 'TEXT NOT NULL'),
+        ('AdoptionDate', 'TEXT NOT NULL'),
+    ],
+    'payments': [
+        ('PaymentID', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('AdoptionID', 'INTEGER NOT NULL'),
+        ('Amount', 'REAL NOT NULL'),
+        ('PaymentDate', 'TEXT NOT NULL'),
+    ],
+}
+
+TABLE_CONSTRAINTS = {
+    'adoptions': [
+        'FOREIGN KEY (PetID) REFERENCES pets(PetID)',
+        'FOREIGN KEY (AdopterID) REFERENCES adopters(AdopterID)',
+    ],
+    'payments': [
+        'FOREIGN KEY (AdoptionID) REFERENCES adoptions(AdoptionID)',
+    ],
+}
+
+
+def create_table(table, definitions, if_not_exists=True):
+    return 'CREATE TABLE %s%s (\n    %s\n)' % ('IF NOT EXISTS ' if if_not_exists else '', table,
+                                              ',\n    '.join(definitions))
+
+
+TABLES = [create_table(table, ['%s %s' % column for column in columns] + TABLE_CONSTRAINTS.get(table, []))
+          for table, columns in BASE_COLUMNS.items()]
+
+NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+
+def row_version_statements():
+    # Every row carries RowVersion/UpdatedAt and every table a Version and
+    # ModifiedAt in row_counts, all maintained by triggers; the JSON API
+    # derives its ETag and Last-Modified headers from them.
+    statements = [
+        "ALTER TABLE row_counts ADD COLUMN Version INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE row_counts ADD COLUMN ModifiedAt TEXT",
+        "UPDATE row_counts SET ModifiedAt = %s" % NOW,
+    ]
+    for table in ('pets', 'adopters', 'adoptions', 'payments'):
+        params = {
+            't': table,
+            'now': NOW,
+            'touch': "UPDATE row_counts SET Version = Version + 1, ModifiedAt = %s WHERE TableName = '%s';" % (NOW, table),
+        }
+        statements += [sql % params for sql in (
+            "ALTER TABLE %(t)s ADD COLUMN RowVersion INTEGER NOT NULL DEFAULT 1",
+            "ALTER TABLE %(t)s ADD COLUMN UpdatedAt TEXT",
+            "UPDATE %(t)s SET UpdatedAt = %(now)s",
+            '''CREATE TRIGGER %(t)s_touch_insert AFTER INSERT ON %(t)s
+            BEGIN UPDATE %(t)s SET UpdatedAt = %(now)s WHERE rowid = NEW.rowid; %(touch)s END''',
+            # Statements that set UpdatedAt themselves (including the trigger
+            # above) are left alone, everything else bumps the row version.
+            '''CREATE TRIGGER %(t)s_touch_update AFTER UPDATE ON %(t)s WHEN NEW.UpdatedAt IS OLD.UpdatedAt
+            BEGIN UPDATE %(t)s SET RowVersion = OLD.RowVersion + 1, UpdatedAt = %(now)s WHERE rowid = NEW.rowid; %(touch)s END''',
+            '''CREATE TRIGGER %(t)s_touch_delete AFTER DELETE ON %(t)s
+            BEGIN %(touch)s END''',
+        )]
+    return statements
+
+
+def rebuilt_table(conn, table, text_key, int_key):
+    # CREATE TABLE for table's rebuild: the base columns, with text_key NOT
+    # NULL UNIQUE instead of the primary key, then the columns migrations have
+    # added since (as PRAGMA table_info reports them), int_key last and the
+    # base table constraints.
+    base = dict(BASE_COLUMNS[table])
+    definitions = ['%s %s' % (name, 'TEXT NOT NULL UNIQUE' if name == text_key else definition)
+                   for name, definition in BASE_COLUMNS[table]]
+    for _, name, kind, notnull, default, _ in conn.execute('PRAGMA table_info(%s)' % table):
+        if name not in base:
+            definitions.append('%s %s%s%s' % (name, kind, ' NOT NULL' if notnull else '',
+                                              '' if default is None else ' DEFAULT %s' % default))
+    definitions.append('%s INTEGER PRIMARY KEY' % int_key)
+    return create_table(table + '_rebuild', definitions + TABLE_CONSTRAINTS.get(table, []), if_not_exists=False)
+
+
+def integer_key(table, text_key, int_key):
+    # Rebuilds table with int_key INTEGER PRIMARY KEY, an alias for the rowid
+    # filled from the current rowids. Without it VACUUM may renumber the
+    # rowids that the FTS index and the search join rely on. Lookups, foreign
+    # keys, URLs and the API keep using text_key, now NOT NULL UNIQUE. The new
+    # column goes last, so the positions of the others do not move. Runs
+    # inside the migration's transaction, with foreign keys off (see
+    # migrate()).
+    def step(conn):
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(%s)' % table)]
+        if int_key in columns:
+            return
+        dependents = [row[0] for row in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+            (table,))]
+        conn.execute(rebuilt_table(conn, table, text_key, int_key))
+        conn.execute('INSERT INTO %s_rebuild (%s, %s) SELECT rowid, %s FROM %s' % (
+            table, int_key, ', '.join(columns), ', '.join(columns), table))
+        conn.execute('DROP TABLE %s' % table)
+        # Triggers on other tables name this one; the legacy rename leaves
+        # them as they are, and they resolve again once it is back.
+        conn.execute('PRAGMA legacy_alter_table = ON')
+        try:
+            conn.execute('ALTER TABLE %s_rebuild RENAME TO %s' % (table, table))
+        finally:
+            conn.execute('PRAGMA legacy_alter_table = OFF')
+        for dependent in dependents:
+            conn.execute(dependent)
+    return step
+
+
+# Schema migrations, applied in order on top of the base tables. A step is a
+# SQL statement or a function run with the connection. The number of
+# migrations already applied is stored in PRAGMA user_version, and each one is
+# logged with the time it ran in schema_version.
+MIGRATIONS = [
+    # 1: indexes for foreign keys, date ranges and list-page filters/sorts
+    [
+        "CREATE INDEX IF NOT EXISTS idx_adoptions_pet ON adoptions(PetID)",
+        "CREATE INDEX IF NOT EXISTS idx_adoptions_adopter ON adoptions(AdopterID)",
+        "CREATE INDEX IF NOT EXISTS idx_adoptions_date ON adoptions(AdoptionDate)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_adoption ON payments(AdoptionID)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_date ON payments(PaymentDate)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_amount ON payments(Amount)",
+        "CREATE INDEX IF NOT EXISTS idx_pets_breed ON pets(Breed, PetID)",
+        "CREATE INDEX IF NOT EXISTS idx_pets_health ON pets(HealthStatus, PetID)",
+        "CREATE INDEX IF NOT EXISTS idx_pets_name ON pets(PetName, PetID)",
+        "CREATE INDEX IF NOT EXISTS idx_pets_age ON pets(Age, PetID)",
+        "CREATE INDEX IF NOT EXISTS idx_adopters_first_name ON adopters(FirstName, AdopterID)",
+        "CREATE INDEX IF NOT EXISTS idx_adopters_last_name ON adopters(LastName, AdopterID)",
+        "CREATE INDEX IF NOT EXISTS idx_adopters_city ON adopters(City, AdopterID)",
+        "CREATE INDEX IF NOT EXISTS idx_adopters_state ON adopters(State, AdopterID)",
+        "CREATE INDEX IF NOT EXISTS idx_adopters_country ON adopters(Country, AdopterID)",
+    ],
+    # 2: row and table versions for ETag/Last-Modified
+    row_version_statements(),
+    # 3: incrementally maintained dashboard aggregates, backfilled
+    dashboard.SCHEMA + dashboard.rebuild_statements(),
+    # 4: FTS5 search indexes over pets and adopters, backfilled
+    search.schema_statements(),
+    # 5: pet availability, claimed atomically by adopt-and-pay
+    adoption.SCHEMA,
+    # 6: progress of the copy out of petAdop.py's old Pet/Adopter tables
+    [
+        '''CREATE TABLE IF NOT EXISTS legacy_copy (
+            TableName TEXT PRIMARY KEY,
+            LastKey INTEGER NOT NULL DEFAULT 0,
+            Copied INTEGER NOT NULL DEFAULT 0,
+            Skipped INTEGER NOT NULL DEFAULT 0,
+            FinishedAt TEXT
+        )''',
+    ],
+    # 7: pet/adopter matching: preferences and the candidate index
+    matching.SCHEMA,
+    # 8: soft deletes for pets and adopters
+    soft_delete_statements() + dashboard.SOFT_DELETE_SCHEMA + matching.SOFT_DELETE_SCHEMA,
+    # 9: archiving of closed adoptions and payments
+    archive.SCHEMA,
+    # 10: job schedules, the persistent job queue and adoption follow-ups
+    jobs.SCHEMA,
+    # 11: rowids of pets and adopters pinned by an INTEGER key, text ids kept unique
+    [integer_key('pets', 'PetID', 'PetKey'), integer_key('adopters', 'AdopterID', 'AdopterKey')],
+    # 12: dashboard total of pets open for adoption, backfilled
+    dashboard.OPEN_PETS_SCHEMA,
+]
+
+
+def migrate(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        Version INTEGER PRIMARY KEY,
+        AppliedAt TEXT
+    )''')
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    # Databases migrated before the log existed: record what they already
+    # have, without a date.
+    conn.executemany('INSERT OR IGNORE INTO schema_version (Version) VALUES (?)',
+                     [(number,) for number in range(1, version + 1)])
+    conn.commit()
+    if version >= len(MIGRATIONS):
+        return
+    # Rebuilt tables are dropped and recreated under their children's
+    # foreign keys; the pragma only takes effect outside a transaction.
+    foreign_keys = conn.execute('PRAGMA foreign_keys').fetchone()[0]
+    conn.execute('PRAGMA foreign_keys = OFF')
+    try:
+        for number, statements in enumerate(MIGRATIONS[version:], version + 1):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for sql in statements:
+                    if callable(sql):
+                        sql(conn)
+                    else:
+                        conn.execute(sql)
+                # With foreign keys off nothing else would notice a step
+                # that leaves a child row without its parent.
+                violations = conn.execute('PRAGMA foreign_key_check').fetchall()
+                if violations:
+                    raise sqlite3.IntegrityError('migration %d leaves %d rows without their parent, the first in %s' % (
+                        number, len(violations), violations[0][0]))
+                conn.execute('INSERT OR REPLACE INTO schema_version (Version, AppliedAt) VALUES (?, %s)' % NOW,
+                             (number,))
+                conn.execute('PRAGMA user_version = %d' % number)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        conn.execute('PRAGMA foreign_keys = %d' % foreign_keys)
+
+
+def init_db(pool):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        for sql in TABLES:
+            c.execute(sql)
+        create_counters(c)
+        conn.commit()
+        migrate(conn)
+        conn.execute('PRAGMA optimize')
+        pending = legacy_pending(conn)
+        if pending:
+            log.warning('%d rows in the old Pet/Adopter tables have not been copied; '
+                        'run "flask schema copy-legacy"', sum(pending.values()))
+
+
+# ---------- LEGACY TABLES ----------
+# petAdop.py used to keep its own Pet/Adopter tables (INTEGER keys, nullable
+# columns) in the same file. copy_legacy() moves their rows into pets and
+# adopters while the app keeps serving: the old tables are walked in rowid
+# order, a chunk per short write transaction, so readers (WAL) never wait and
+# writers wait at most one chunk. Progress is kept in legacy_copy, so an
+# interrupted copy picks up where it stopped.
+LEGACY = {
+    'Pet': ('pets', [
+        ('PetID', 'CAST(PetID AS TEXT)'),
+        ('PetName', "COALESCE(PetName, '')"),
+        ('Breed', "COALESCE(Breed, '')"),
+        ('Age', 'COALESCE(Age, 0)'),
+        ('HealthStatus', "COALESCE(HealthStatus, '')"),
+    ]),
+    'Adopter': ('adopters', [
+        ('AdopterID', 'CAST(AdopterID AS TEXT)'),
+        ('FirstName', "COALESCE(FirstName, '')"),
+        ('LastName', "COALESCE(LastName, '')"),
+        ('Contact', "COALESCE(Contact, '')"),
+        ('Address', "COALESCE(Address, '')"),
+        ('City', "COALESCE(City, '')"),
+        ('State', "COALESCE(State, '')"),
+        ('Country', "COALESCE(Country, '')"),
+    ]),
+}
+
+
+def legacy_tables(conn):
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return [legacy for legacy in LEGACY if legacy in names]
+
+
+def legacy_pending(conn):
+    # Rows of each old table not yet copied, {legacy table: count}.
+    pending = {}
+    for legacy in legacy_tables(conn):
+        row = conn.execute('SELECT LastKey FROM legacy_copy WHERE TableName = ?', (legacy,)).fetchone()
+        count = conn.execute('SELECT COUNT(*) FROM %s WHERE rowid > ?' % legacy, (row[0] if row else 0,)).fetchone()[0]
+        if count:
+            pending[legacy] = count
+    return pending
+
+
+def copy_chunk(legacy, chunk_size):
+    # work(conn) copying the next chunk_size rows of one old table; returns
+    # (rows copied, rows skipped, rows read).
+    target, columns = LEGACY[legacy]
+    insert = 'INSERT OR IGNORE INTO %s (%s) SELECT %s FROM %s WHERE rowid > ? AND rowid <= ?' % (
+        target, ', '.join(name for name, _ in columns), ', '.join(expr for _, expr in columns), legacy)
+
+    def work(conn):
+        conn.execute('INSERT OR IGNORE INTO legacy_copy (TableName) VALUES (?)', (legacy,))
+        last = conn.execute('SELECT LastKey FROM legacy_copy WHERE TableName = ?', (legacy,)).fetchone()[0]
+        # The chunk is a rowid range: a seek into the table's B-tree, not an
+        # OFFSET scan that grows with every chunk already copied.
+        keys = conn.execute('SELECT rowid FROM %s WHERE rowid > ? ORDER BY rowid LIMIT ?' % legacy,
+                            (last, chunk_size)).fetchall()
+        if not keys:
+            conn.execute('UPDATE legacy_copy SET FinishedAt = COALESCE(FinishedAt, %s) WHERE TableName = ?' % NOW,
+                         (legacy,))
+            return 0, 0, 0
+        copied = conn.execute(insert, (last, keys[-1][0])).rowcount
+        skipped = len(keys) - copied
+        conn.execute('UPDATE legacy_copy SET LastKey = ?, Copied = Copied + ?, Skipped = Skipped + ?, '
+                     'FinishedAt = NULL WHERE TableName = ?', (keys[-1][0], copied, skipped, legacy))
+        return copied, skipped, len(keys)
+    return work
+
+
+def copy_legacy(conn, chunk_size=500, pause=0.01, progress=None):
+    # Copies every old table into its canonical one. Rows whose id is already
+    # taken in the canonical table are skipped, not overwritten. Returns
+    # {legacy table: (copied, skipped)}.
+    totals = {}
+    for legacy in legacy_tables(conn):
+        copied = skipped = 0
+        work = copy_chunk(legacy, chunk_size)
+        while True:
+            (n_copied, n_skipped, n_read), _ = run_immediate(conn, work)
+            copied += n_copied
+            skipped += n_skipped
+            if progress is not None:
+                progress(legacy, copied, skipped)
+            if not n_read:
+                break
+            # Let queued writers in between chunks.
+            time.sleep(pause)
+        totals[legacy] = copied, skipped
+    return totals
+
+
+# ---------- CLI ----------
+cli = AppGroup('schema', help='Inspect and migrate the database schema.')
+
+
+@cli.command('status')
+def status_command():
+    """Show the schema version and any uncopied legacy rows."""
+    conn = get_db()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    click.echo('schema version %d of %d' % (version, len(MIGRATIONS)))
+    for number, applied in conn.execute('SELECT Version, AppliedAt FROM schema_version ORDER BY Version'):
+        click.echo('  %d  %s' % (number, applied or '(before the log)'))
+    pending = legacy_pending(conn)
+    for legacy in legacy_tables(conn):
+        click.echo('%s: %d rows left to copy' % (legacy, pending.get(legacy, 0)))
+
+
+@cli.command('copy-legacy')
+@click.option('--chunk-size', default=500, show_default=True, help='Rows per write transaction.')
+@click.option('--pause', default=0.01, show_default=True, help='Seconds to sleep between chunks.')
+@click.option('--drop', is_flag=True, help='Drop the old tables once every row is copied.')
+def copy_legacy_command(chunk_size, pause, drop):
+    """Copy petAdop.py's old Pet/Adopter rows into pets/adopters."""
+    conn = get_db()
+    started = time.perf_counter()
+    totals = copy_legacy(conn, chunk_size, pause)
+    # petAdop.py runs without a page cache.
+    page_cache = current_app.extensions.get('page_cache')
+    if page_cache is not None:
+        page_cache.invalidate('pets', 'adopters')
+    for legacy, (copied, skipped) in totals.items():
+        click.echo('%s -> %s: %d copied, %d skipped (id already taken)' % (legacy, LEGACY[legacy][0], copied, skipped))
+    click.echo('Done in %.2fs' % (time.perf_counter() - started))
+    if drop and totals:
+        if legacy_pending(conn):
+            raise click.ClickException('rows were added while copying; run copy-legacy again')
+        for legacy in totals:
+            conn.execute('DROP TABLE %s' % legacy)
+        conn.commit()
+        click.echo('Dropped %s' % ', '.join(totals))
+
+
+def init_app(app):
+    app.cli.add_command(cli)
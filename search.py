@@ -0,0 +1,119 @@
+import re
+
+from flask import Blueprint, render_template, request
+
+from cache import cached
+from db import get_db
+from templating import register_templates
+
+bp = Blueprint('search', __name__)
+
+DEFAULT_RESULTS = 20
+MAX_RESULTS = 100
+
+# Full-text indexes over the searchable columns. They are external-content
+# FTS5 tables (the text lives only in pets/adopters) kept in sync by triggers;
+# prefix indexes make the prefix queries built below cheap.
+SEARCHES = {
+    'pets': ('PetName', 'Breed', 'HealthStatus'),
+    'adopters': ('FirstName', 'LastName', 'City', 'State', 'Country'),
+}
+
+
+def schema_statements():
+    statements = []
+    for table, columns in SEARCHES.items():
+        params = {
+            't': table,
+            'cols': ', '.join(columns),
+            'new': ', '.join('NEW.' + c for c in columns),
+            'old': ', '.join('OLD.' + c for c in columns),
+        }
+        statements += [sql % params for sql in (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS %(t)s_fts USING fts5(%(cols)s, content='%(t)s', prefix='2 3')",
+            '''CREATE TRIGGER IF NOT EXISTS %(t)s_fts_insert AFTER INSERT ON %(t)s BEGIN
+                INSERT INTO %(t)s_fts (rowid, %(cols)s) VALUES (NEW.rowid, %(new)s);
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS %(t)s_fts_delete AFTER DELETE ON %(t)s BEGIN
+                INSERT INTO %(t)s_fts (%(t)s_fts, rowid, %(cols)s) VALUES ('delete', OLD.rowid, %(old)s);
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS %(t)s_fts_update AFTER UPDATE OF %(cols)s ON %(t)s BEGIN
+                INSERT INTO %(t)s_fts (%(t)s_fts, rowid, %(cols)s) VALUES ('delete', OLD.rowid, %(old)s);
+                INSERT INTO %(t)s_fts (rowid, %(cols)s) VALUES (NEW.rowid, %(new)s);
+            END''',
+            "INSERT INTO %(t)s_fts (%(t)s_fts) VALUES ('rebuild')",
+        )]
+    return statements
+
+
+def match_expression(text):
+    # Every word the user typed must match, as a prefix, in any column:
+    # 'golden retr' becomes '"golden"* "retr"*'.
+    words = re.findall(r'\w+', text)
+    return ' '.join('"%s"*' % word for word in words)
+
+
+def search_table(table, expression, limit):
+    sql = '''SELECT t.* FROM %(t)s_fts JOIN %(t)s t ON t.rowid = %(t)s_fts.rowid
+             WHERE %(t)s_fts MATCH ? AND t.DeletedAt IS NULL ORDER BY %(t)s_fts.rank LIMIT ?''' % {'t': table}
+    return get_db().execute(sql, (expression, limit)).fetchall()
+
+
+search_html = """
+{% extends "base.html" %}
+{% block content %}
+<h4>Search</h4>
+<form method="GET" class="row g-2 mb-3">
+  <div class="col"><input name="q" value="{{ q }}" class="form-control" placeholder="Pet name, breed, health, adopter name or location" autofocus></div>
+  <div class="col-auto"><button class="btn btn-primary">Search</button></div>
+</form>
+{% if q %}
+<h5>Pets</h5>
+<table class="table table-bordered">
+<tr><th>ID</th><th>Name</th><th>Breed</th><th>Age</th><th>Health</th><th>Actions</th></tr>
+{% for p in pets %}
+<tr>
+<td>{{p[0]}}</td><td>{{p[1]}}</td><td>{{p[2]}}</td><td>{{p[3]}}</td><td>{{p[4]}}</td>
+<td><a href="/edit_pet/{{p[0]}}" class="btn btn-warning btn-sm">Edit</a></td>
+</tr>
+{% else %}
+<tr><td colspan="6" class="text-muted">No matching pets</td></tr>
+{% endfor %}
+</table>
+
+<h5>Adopters</h5>
+<table class="table table-bordered">
+<tr><th>ID</th><th>First Name</th><th>Last Name</th><th>Contact</th><th>City</th><th>State</th><th>Country</th><th>Actions</th></tr>
+{% for a in adopters %}
+<tr>
+<td>{{a[0]}}</td><td>{{a[1]}}</td><td>{{a[2]}}</td><td>{{a[3]}}</td><td>{{a[5]}}</td><td>{{a[6]}}</td><td>{{a[7]}}</td>
+<td><a href="/edit_adopter/{{a[0]}}" class="btn btn-warning btn-sm">Edit</a></td>
+</tr>
+{% else %}
+<tr><td colspan="8" class="text-muted">No matching adopters</td></tr>
+{% endfor %}
+</table>
+{% endif %}
+{% endblock %}
+"""
+
+
+@bp.route('/search')
+@cached('pets', 'adopters')
+def search():
+    q = request.args.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.args.get('k', DEFAULT_RESULTS)), MAX_RESULTS))
+    except ValueError:
+        limit = DEFAULT_RESULTS
+    expression = match_expression(q)
+    pets = adopters = []
+    if expression:
+        pets = search_table('pets', expression, limit)
+        adopters = search_table('adopters', expression, limit)
+    return render_template('search.html', q=q, pets=pets, adopters=adopters)
+
+
+def init_app(app):
+    register_templates(app, {'search.html': search_html})
+    app.register_blueprint(bp)
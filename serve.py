@@ -0,0 +1,56 @@
+"""Production entry point: no debugger, no reloader.
+
+    python serve.py                       # ASGI under uvicorn (pip install uvicorn)
+    python serve.py --mode wsgi           # threaded WSGI server, no extra packages
+    python serve.py --host 0.0.0.0 --port 8000
+
+The database and the other settings come from the PET_ADOPTION_* environment
+variables read by petadopupdate.py.
+"""
+import argparse
+import logging
+import sys
+
+
+def start_workers():
+    # The match refresher and scheduled jobs run from startup here rather
+    # than from the first request.
+    import jobs
+    import matching
+    from petadopupdate import app
+    if app.config['MATCH_REFRESH']:
+        matching.start_app_refresher(app)
+    if app.config['JOBS_ENABLED']:
+        jobs.start_runner(app)
+
+
+def serve_asgi(host, port):
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('ASGI mode needs uvicorn (pip install uvicorn), or use --mode wsgi')
+    uvicorn.run('asgi:application', host=host, port=port, log_level='warning', access_log=False)
+
+
+def serve_wsgi(host, port):
+    from werkzeug.serving import run_simple
+    from petadopupdate import app
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    run_simple(host, port, app, threaded=True, use_reloader=False, use_debugger=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['asgi', 'wsgi'], default='asgi')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    start_workers()
+    if args.mode == 'asgi':
+        serve_asgi(args.host, args.port)
+    else:
+        serve_wsgi(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
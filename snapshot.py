@@ -0,0 +1,224 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+import click
+from flask import Blueprint, current_app, g, jsonify, request
+
+from db import ConnectionPool
+
+log = logging.getLogger(__name__)
+
+bp = Blueprint('snapshot', __name__)
+
+# Reporting reads (list pages, exports, the dashboard) served apart from the
+# clerks' writes, so a long report never holds up add_adoption/add_payment:
+#
+#   backup    a copy of the database (SNAPSHOT_DATABASE) refreshed every
+#             SNAPSHOT_INTERVAL seconds with SQLite's online backup API and
+#             read through a read-only pool of its own. The copy is made in
+#             one step into a WAL database, so readers keep the old copy
+#             until the new one commits. Pages read from a copy older than
+#             SNAPSHOT_MAX_AGE fall back to the live database.
+#   readonly  a read-only (mode=ro) pool on the live database: always
+#             current, and off the request pool, but a long read still
+#             holds back WAL checkpoints.
+#
+# Responses read this way carry X-Snapshot-Age (seconds). A browser that
+# has just written reads live data for SNAPSHOT_INTERVAL seconds, so a clerk
+# sees the pet they just added.
+ENDPOINTS = ('pets', 'adopters', 'adoptions', 'payments', 'dashboard.dashboard', 'exporter.export',
+             'exporter.export_gz')
+
+WROTE_COOKIE = 'recent_write'
+
+
+def read_only_uri(database):
+    return 'file:%s?mode=ro' % quote(os.path.abspath(database))
+
+
+class Snapshot:
+    """Backup copy of the live database, refreshed by a background thread."""
+
+    def __init__(self, database, path, interval=30.0, size=5, busy_timeout=5000, factory=sqlite3.Connection,
+                 setup=None, metrics=None):
+        self.database = database
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics
+        self.taken = None
+        self.version = 0
+        self._data_version = None
+        self._source = None
+        self._lock = threading.Lock()
+        self._stats = {'copied': 0, 'unchanged': 0, 'failed': 0, 'copy_seconds': 0.0}
+        self.refresh()
+        self.pool = ConnectionPool(read_only_uri(path), size=size, busy_timeout=busy_timeout, factory=factory,
+                                   setup=setup, uri=True)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='snapshot', daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        # Copies the live database unless nothing has been committed to it
+        # since the last copy; either way the copy is current as of now.
+        # Returns 'copied' or 'unchanged'.
+        with self._lock:
+            started = time.time()
+            if self._source is None:
+                self._source = sqlite3.connect(self.database, check_same_thread=False)
+            data_version = self._source.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._data_version and self.taken is not None:
+                self.taken = started
+                result = 'unchanged'
+            else:
+                target = sqlite3.connect(self.path, timeout=0.1)
+                try:
+                    target.execute('PRAGMA journal_mode=WAL')
+                    self._source.backup(target)
+                    # Readers of the old copy can hold this back; it is
+                    # retried after the next copy.
+                    target.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                finally:
+                    target.close()
+                self._data_version = data_version
+                self.taken = started
+                self.version += 1
+                result = 'copied'
+            seconds = time.time() - started
+            self._stats[result] += 1
+            if result == 'copied':
+                self._stats['copy_seconds'] += seconds
+        if self.metrics is not None:
+            self.metrics.inc('snapshot_refreshes_total', result=result)
+            if result == 'copied':
+                self.metrics.observe('snapshot_refresh_seconds', seconds)
+        return result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                log.exception('snapshot refresh failed')
+                with self._lock:
+                    self._stats['failed'] += 1
+                if self.metrics is not None:
+                    self.metrics.inc('snapshot_refreshes_total', result='failed')
+
+    def age(self):
+        return time.time() - self.taken
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(mode='backup', path=self.path, version=self.version, age=round(self.age(), 3),
+                     pool=self.pool.stats())
+        return stats
+
+    def close(self, timeout=30.0):
+        self._stop.set()
+        self._thread.join(timeout)
+        self.pool.close()
+        with self._lock:
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+
+
+class ReadOnlyPool:
+    """Read-only pool on the live database: the snapshot is always current."""
+
+    version = None
+
+    def __init__(self, database, size=5, busy_timeout=5000, factory=sqlite3.Connection, setup=None):
+        self.pool = ConnectionPool(read_only_uri(database), size=size, busy_timeout=busy_timeout, factory=factory,
+                                   setup=setup, uri=True)
+
+    def age(self):
+        return 0.0
+
+    def stats(self):
+        return {'mode': 'readonly', 'age': 0.0, 'pool': self.pool.stats()}
+
+    def close(self):
+        self.pool.close()
+
+
+# ---------- ROUTING ----------
+def start_request():
+    config = current_app.config
+    if (request.method not in ('GET', 'HEAD') or request.endpoint not in config['SNAPSHOT_ENDPOINTS']
+            or g.get('tenant') or request.cookies.get(WROTE_COOKIE)):
+        return
+    snapshot = current_app.extensions['snapshot']
+    age = snapshot.age()
+    if age > config['SNAPSHOT_MAX_AGE']:
+        return
+    g.db_pool = snapshot.pool
+    g.snapshot = snapshot.version
+    g.snapshot_age = age
+
+
+def end_request(response):
+    age = g.get('snapshot_age')
+    if age is not None:
+        response.headers['X-Snapshot-Age'] = '%d' % age
+    elif request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        response.set_cookie(WROTE_COOKIE, '1', max_age=int(current_app.config['SNAPSHOT_INTERVAL']) + 1,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+@bp.route('/admin/snapshot')
+def snapshot_stats():
+    return jsonify(current_app.extensions['snapshot'].stats())
+
+
+@bp.cli.command('refresh')
+def refresh_command():
+    """Copy the live database to SNAPSHOT_DATABASE now."""
+    config = current_app.config
+    snapshot = current_app.extensions.get('snapshot')
+    if not isinstance(snapshot, Snapshot):
+        raise click.ClickException('snapshot mode is not "backup"')
+    started = time.perf_counter()
+    result = snapshot.refresh()
+    click.echo('%s: %s in %.2fs' % (config['SNAPSHOT_DATABASE'], result, time.perf_counter() - started))
+
+
+def init_app(app):
+    # Must run after tenancy (shelter requests are left alone) and after
+    # instrumentation and archive, whose connection hooks it copies.
+    app.config.setdefault('SNAPSHOT_MODE', None)
+    app.config.setdefault('SNAPSHOT_DATABASE', None)
+    app.config.setdefault('SNAPSHOT_INTERVAL', 30.0)
+    app.config.setdefault('SNAPSHOT_MAX_AGE', 120.0)
+    app.config.setdefault('SNAPSHOT_POOL_SIZE', app.config['DB_POOL_SIZE'])
+    app.config.setdefault('SNAPSHOT_ENDPOINTS', ENDPOINTS)
+    mode = app.config['SNAPSHOT_MODE']
+    if not mode:
+        return None
+    if mode not in ('backup', 'readonly'):
+        raise ValueError("SNAPSHOT_MODE must be 'backup' or 'readonly'")
+    if not app.config['SNAPSHOT_DATABASE']:
+        app.config['SNAPSHOT_DATABASE'] = '%s_snapshot.db' % os.path.splitext(app.config['DATABASE'])[0]
+    main_pool = app.extensions['db_pool']
+    options = dict(size=app.config['SNAPSHOT_POOL_SIZE'], busy_timeout=app.config['DB_BUSY_TIMEOUT'],
+                   factory=main_pool.factory, setup=main_pool.setup)
+    if mode == 'backup':
+        snapshot = Snapshot(app.config['DATABASE'], app.config['SNAPSHOT_DATABASE'],
+                            interval=app.config['SNAPSHOT_INTERVAL'], metrics=app.extensions.get('metrics'),
+                            **options)
+    else:
+        snapshot = ReadOnlyPool(app.config['DATABASE'], **options)
+    app.extensions['snapshot'] = snapshot
+    atexit.register(snapshot.close)
+    app.register_blueprint(bp)
+    app.before_request(start_request)
+    app.after_request(end_request)
+    return snapshot
@@ -0,0 +1,47 @@
+import hashlib
+
+from flask import Response, before_render_template, current_app, stream_with_context, template_rendered
+from jinja2 import ChoiceLoader, DictLoader
+
+# Number of template output chunks joined before each write to the socket.
+STREAM_BUFFER = 32
+
+
+def register_templates(app, templates):
+    # Module-level template strings are served from a DictLoader so Jinja
+    # compiles each one once and caches it, and pages can use
+    # {% extends %}/{% include %} instead of nesting render calls.
+    loader = DictLoader(templates)
+    if app.jinja_env.loader is None:
+        app.jinja_env.loader = loader
+    else:
+        app.jinja_env.loader = ChoiceLoader([loader, app.jinja_env.loader])
+    for name in templates:
+        app.jinja_env.get_template(name)
+    update_template_digest(app, *(name + source for name, source in sorted(templates.items())))
+
+
+def update_template_digest(app, *parts):
+    # A hash of everything pages are rendered from, part of their ETags, so a
+    # deploy that changes a template does not leave stale pages behind 304s.
+    digest = hashlib.sha1(app.extensions.get('template_digest', '').encode())
+    for part in parts:
+        digest.update(part.encode())
+    app.extensions['template_digest'] = digest.hexdigest()
+
+
+def stream_page(name, **context):
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template(name)
+    app.update_template_context(context)
+    stream = template.stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+
+    # Send the same signals as render_template, with template_rendered
+    # only once the last chunk has been produced.
+    def generate():
+        yield from stream
+        template_rendered.send(app, _async_wrapper=app.ensure_sync, template=template, context=context)
+
+    before_render_template.send(app, _async_wrapper=app.ensure_sync, template=template, context=context)
+    return Response(stream_with_context(generate()), mimetype='text/html')
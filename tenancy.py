@@ -0,0 +1,398 @@
+import atexit
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import click
+from flask import Blueprint, abort, current_app, g, render_template, request
+
+import archive
+import jobs
+import matching
+import schema
+import writebehind
+from db import ConnectionPool, close_db
+from templating import register_templates
+
+bp = Blueprint('tenants', __name__)
+
+# One database file per shelter, so shelters no longer queue behind each
+# other's writes: TENANT_DIR/<name>.db (and <name>_archive.db when archiving
+# is on). A request picks its shelter with the TENANT_HEADER header or a
+# subdomain of TENANT_DOMAIN; requests naming no shelter use the app's own
+# DATABASE. Each open shelter has its own connection pool, and job runner,
+# match refresher and write-behind writer when the app runs those; at most
+# TENANT_OPEN_MAX shelters are kept open, the least recently used idle one
+# being closed to make room.
+NAME = re.compile(r'[a-z0-9][a-z0-9-]{0,62}')
+
+
+class Tenant:
+    """An open shelter database: its pool and background workers."""
+
+    def __init__(self, app, name, database):
+        config = app.config
+        main_pool = app.extensions['db_pool']
+        self.name = name
+        self.database = database
+        self.active = 0
+        setup = None
+        if 'archive' in app.extensions:
+            setup = archive.attach('%s_archive.db' % os.path.splitext(database)[0])
+        self.pool = ConnectionPool(database, size=config['DB_POOL_SIZE'], timeout=config['DB_POOL_TIMEOUT'],
+                                   busy_timeout=config['DB_BUSY_TIMEOUT'], factory=main_pool.factory, setup=setup)
+        try:
+            schema.init_db(self.pool)
+        except Exception:
+            self.pool.close()
+            raise
+        self.writer = None
+        if 'write_behind' in app.extensions:
+            self.writer = writebehind.start_writer(app, self.pool)
+        self.refresher = None
+        self.runner = None
+        self._starting = threading.Lock()
+        self.start_workers(app)
+
+    def start_workers(self, app):
+        # The app's match refresher and job runner start with the first
+        # request it serves; a shelter opened before then (by that request,
+        # or by "flask tenants create") gets its own copies on its next one.
+        with self._starting:
+            if self.refresher is None and 'match_refresher' in app.extensions:
+                self.refresher = matching.start_refresher(app, self.pool)
+            if self.runner is None and 'job_runner' in app.extensions:
+                self.runner = jobs.make_runner(app, self.pool, self.name)
+
+    def close(self):
+        # The writer commits what is still queued before the pool goes.
+        if self.writer is not None:
+            self.writer.close()
+        if self.refresher is not None:
+            self.refresher.close()
+        if self.runner is not None:
+            self.runner.close()
+        self.pool.close()
+
+
+class Tenants:
+    """The open shelters, least recently used first."""
+
+    def __init__(self, app, directory, capacity=16, metrics=None):
+        self.app = app
+        self.directory = directory
+        self.capacity = capacity
+        self.metrics = metrics
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        # Opening runs migrations; one at a time, without holding up
+        # checkouts of shelters that are already open.
+        self._opening = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, '%s.db' % name)
+
+    def exists(self, name):
+        return NAME.fullmatch(name) is not None and os.path.exists(self.path(name))
+
+    def names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-3] for name in os.listdir(self.directory)
+                      if name.endswith('.db') and NAME.fullmatch(name[:-3]))
+
+    def checkout(self, name):
+        # The open shelter, counted as in use until release(); None when
+        # there is no such shelter.
+        tenant = self._take(name)
+        if tenant is not None:
+            return tenant
+        if not self.exists(name):
+            return None
+        with self._opening:
+            tenant = self._take(name)
+            if tenant is not None:
+                return tenant
+            tenant = Tenant(self.app, name, self.path(name))
+            with self._lock:
+                tenant.active += 1
+                self._open[name] = tenant
+                idle = [t for t in self._open.values() if not t.active]
+                evicted = idle[:max(0, len(self._open) - self.capacity)]
+                for victim in evicted:
+                    del self._open[victim.name]
+                count = len(self._open)
+        for victim in evicted:
+            victim.close()
+        if self.metrics is not None:
+            self.metrics.set('tenants_open', count)
+            self.metrics.inc('tenant_evictions_total', len(evicted))
+        return tenant
+
+    def _take(self, name):
+        with self._lock:
+            tenant = self._open.get(name)
+            if tenant is not None:
+                tenant.active += 1
+                self._open.move_to_end(name)
+            return tenant
+
+    def release(self, tenant):
+        with self._lock:
+            tenant.active -= 1
+
+    def create(self, name):
+        if NAME.fullmatch(name) is None:
+            raise ValueError('shelter names are lowercase letters, digits and dashes')
+        os.makedirs(self.directory, exist_ok=True)
+        open(self.path(name), 'ab').close()
+        # Opening it runs the migrations.
+        self.release(self.checkout(name))
+
+    def stats(self):
+        with self._lock:
+            return {name: {'active': t.active, 'pool': t.pool.stats()} for name, t in self._open.items()}
+
+    def close(self):
+        with self._lock:
+            tenants = list(self._open.values())
+            self._open.clear()
+        for tenant in tenants:
+            tenant.close()
+
+
+def get_tenants():
+    return current_app.extensions['tenants']
+
+
+# ---------- ROUTING ----------
+def requested_tenant():
+    config = current_app.config
+    name = request.headers.get(config['TENANT_HEADER'])
+    if name:
+        return name.strip().lower()
+    domain = config['TENANT_DOMAIN']
+    if domain:
+        host = request.host.split(':', 1)[0].lower()
+        suffix = '.' + domain.lower()
+        if host.endswith(suffix) and '.' not in host[:-len(suffix)]:
+            return host[:-len(suffix)]
+    return None
+
+
+def start_request():
+    name = requested_tenant()
+    if name is None:
+        return
+    tenant = get_tenants().checkout(name)
+    if tenant is None:
+        abort(404, 'There is no shelter named %r.' % name)
+    g.tenant = name
+    g.tenant_handle = tenant
+    tenant.start_workers(current_app._get_current_object())
+    g.db_pool = tenant.pool
+    g.write_behind = tenant.writer
+    g.job_runner = tenant.runner
+
+
+def vary_on_tenant(response):
+    response.vary.add(current_app.config['TENANT_HEADER'])
+    return response
+
+
+def end_request(exc=None):
+    tenant = g.pop('tenant_handle', None)
+    if tenant is not None:
+        # Hand the connection back to the shelter's pool before the shelter
+        # can be closed.
+        close_db()
+        get_tenants().release(tenant)
+
+
+# ---------- CROSS-SHELTER REPORTS ----------
+def read_only(database):
+    conn = sqlite3.connect('file:%s?mode=ro' % quote(os.path.abspath(database)), uri=True,
+                           check_same_thread=False)
+    conn.execute('PRAGMA query_only=ON')
+    return conn
+
+
+def fan_out(databases, query, workers=4):
+    # Runs query(conn) against every {name: database} on a thread pool, each
+    # on a read-only connection of its own (the open pools are left to the
+    # requests). Returns {name: result}, and {name: error} for the ones
+    # that failed, so one broken shelter does not sink the report.
+    def one(database):
+        conn = read_only(database)
+        try:
+            return query(conn)
+        finally:
+            conn.close()
+
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max(1, min(workers, len(databases)))) as pool:
+        futures = {name: pool.submit(one, database) for name, database in databases.items()}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except sqlite3.Error as e:
+                errors[name] = str(e)
+    return results, errors
+
+
+def merge_rows(results, keys=1):
+    # Rows from every shelter summed column by column, grouped by their
+    # first `keys` columns.
+    merged = {}
+    for rows in results.values():
+        for row in rows:
+            key, values = tuple(row[:keys]), row[keys:]
+            total = merged.get(key)
+            merged[key] = list(values) if total is None else [a + b for a, b in zip(total, values)]
+    return [key + tuple(values) for key, values in sorted(merged.items())]
+
+
+def shelter_report(conn):
+    totals = dict(conn.execute('SELECT TableName, Total FROM row_counts'))
+    adopted = conn.execute("SELECT Value FROM dashboard_totals WHERE Name='adopted_pets'").fetchone()
+    return {
+        'totals': totals,
+        'adopted': adopted[0] if adopted else 0,
+        'revenue': conn.execute('SELECT COALESCE(SUM(Revenue), 0.0) FROM monthly_revenue').fetchone()[0],
+        'months': conn.execute('''
+            SELECT Month, SUM(Adoptions), SUM(Payments), SUM(Revenue) FROM (
+                SELECT Month, Adoptions, 0 AS Payments, 0.0 AS Revenue FROM monthly_adoptions
+                UNION ALL
+                SELECT Month, 0, Payments, Revenue FROM monthly_revenue
+            ) GROUP BY Month''').fetchall(),
+        'breeds': conn.execute('SELECT Breed, Pets, TotalAge FROM breed_stats WHERE Pets > 0').fetchall(),
+    }
+
+
+def report(tenants, names=None, workers=4):
+    names = tenants.names() if names is None else names
+    results, errors = fan_out({name: tenants.path(name) for name in names}, shelter_report, workers)
+    months = merge_rows({name: r['months'] for name, r in results.items()})
+    breeds = merge_rows({name: r['breeds'] for name, r in results.items()})
+    return {
+        'shelters': results,
+        'errors': errors,
+        'months': [m for m in reversed(months) if m[1] or m[2]],
+        'breeds': [(breed, pets, age / pets) for breed, pets, age in breeds if pets],
+    }
+
+
+shelters_html = """
+{% extends "base.html" %}
+{% block content %}
+<h4>Shelters</h4>
+<p class="text-muted">{{ report.shelters|length }} shelters, gathered in {{ '%.0f'|format(seconds * 1000) }} ms.</p>
+{% for name, error in report.errors.items() %}<p class="alert alert-warning">{{name}}: {{error}}</p>{% endfor %}
+<table class="table table-bordered table-sm">
+<tr><th>Shelter</th><th>Pets</th><th>Adopted</th><th>Adopters</th><th>Adoptions</th><th>Payments</th><th>Revenue</th><th>Open</th></tr>
+{% for name, s in report.shelters.items() %}
+<tr><td>{{name}}</td><td>{{s.totals.get('pets', 0)}}</td><td>{{s.adopted}}</td><td>{{s.totals.get('adopters', 0)}}</td>
+<td>{{s.totals.get('adoptions', 0)}}</td><td>{{s.totals.get('payments', 0)}}</td><td>{{ '%.2f'|format(s.revenue) }}</td>
+<td>{{ 'yes' if name in open else '' }}</td></tr>
+{% endfor %}
+</table>
+<div class="row">
+  <div class="col-md-6">
+    <h5>Adoptions and Revenue per Month, all shelters</h5>
+    <table class="table table-bordered table-sm">
+    <tr><th>Month</th><th>Adoptions</th><th>Payments</th><th>Revenue</th></tr>
+    {% for m in report.months[:24] %}
+    <tr><td>{{m[0]}}</td><td>{{m[1]}}</td><td>{{m[2]}}</td><td>{{ '%.2f'|format(m[3]) }}</td></tr>
+    {% endfor %}
+    </table>
+  </div>
+  <div class="col-md-6">
+    <h5>Average Age by Breed, all shelters</h5>
+    <table class="table table-bordered table-sm">
+    <tr><th>Breed</th><th>Pets</th><th>Average Age</th></tr>
+    {% for b in report.breeds %}
+    <tr><td>{{b[0]}}</td><td>{{b[1]}}</td><td>{{ '%.1f'|format(b[2]) }}</td></tr>
+    {% endfor %}
+    </table>
+  </div>
+</div>
+{% endblock %}
+"""
+
+
+@bp.route('/admin/shelters')
+def shelters():
+    tenants = get_tenants()
+    started = time.perf_counter()
+    result = report(tenants, workers=current_app.config['TENANT_REPORT_WORKERS'])
+    return render_template('shelters.html', report=result, seconds=time.perf_counter() - started,
+                           open=tenants.stats())
+
+
+# ---------- CLI ----------
+@bp.cli.command('list')
+def list_command():
+    """Show every shelter database and whether this process has it open."""
+    tenants = get_tenants()
+    for name in tenants.names():
+        click.echo('%-24s %10d bytes  %s' % (name, os.path.getsize(tenants.path(name)), tenants.path(name)))
+
+
+@bp.cli.command('create')
+@click.argument('name')
+def create_command(name):
+    """Create a shelter database (or bring an existing one's schema up to date)."""
+    try:
+        get_tenants().create(name)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo('%s: %s' % (name, get_tenants().path(name)))
+
+
+@bp.cli.command('migrate')
+def migrate_command():
+    """Bring every shelter database's schema up to date."""
+    tenants = get_tenants()
+    for name in tenants.names():
+        tenants.create(name)
+        click.echo('%s: up to date' % name)
+
+
+@bp.cli.command('report')
+def report_command():
+    """Totals for every shelter and all of them together."""
+    started = time.perf_counter()
+    result = report(get_tenants(), workers=current_app.config['TENANT_REPORT_WORKERS'])
+    for name, s in result['shelters'].items():
+        click.echo('%-24s %8d pets %8d adoptions %12.2f revenue' % (
+            name, s['totals'].get('pets', 0), s['totals'].get('adoptions', 0), s['revenue']))
+    for name, error in result['errors'].items():
+        click.echo('%-24s failed: %s' % (name, error))
+    click.echo('%d shelters in %.0f ms' % (len(result['shelters']), (time.perf_counter() - started) * 1000))
+
+
+def init_app(app):
+    # Must run after the services whose per-shelter copies it starts
+    # (archive, jobs, matching, write-behind) and after instrumentation.
+    app.config.setdefault('TENANT_DIR', None)
+    app.config.setdefault('TENANT_HEADER', 'X-Shelter')
+    app.config.setdefault('TENANT_DOMAIN', None)
+    app.config.setdefault('TENANT_OPEN_MAX', 16)
+    app.config.setdefault('TENANT_REPORT_WORKERS', 4)
+    if not app.config['TENANT_DIR']:
+        return None
+    tenants = Tenants(app, app.config['TENANT_DIR'], app.config['TENANT_OPEN_MAX'],
+                      metrics=app.extensions.get('metrics'))
+    app.extensions['tenants'] = tenants
+    atexit.register(tenants.close)
+    register_templates(app, {'shelters.html': shelters_html})
+    app.register_blueprint(bp)
+    app.before_request(start_request)
+    app.after_request(vary_on_tenant)
+    app.teardown_appcontext(end_request)
+    return tenants
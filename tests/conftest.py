@@ -0,0 +1,77 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO not in sys.path:
+    sys.path.insert(0, REPO)
+
+# Background threads that would make the tests race with themselves stay off
+# unless a test asks for them.
+DEFAULT_ENV = {
+    'PET_ADOPTION_JOBS': '0',
+    'PET_ADOPTION_MATCH_REFRESH': '0',
+    'PET_ADOPTION_WRITE_BEHIND': '0',
+    'PET_ADOPTION_CACHE': '1',
+}
+
+# Extensions with threads or pools of their own, closed after each test.
+CLOSING = ('write_behind', 'match_refresher', 'job_runner', 'snapshot', 'tenants', 'db_pool')
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    # petadopupdate reads its settings from the environment at import time,
+    # so every app is a fresh import against its own database.
+    apps = []
+
+    def make(**env):
+        settings = dict(DEFAULT_ENV, PET_ADOPTION_DB=str(tmp_path / 'pets.db'))
+        settings.update(env)
+        for name, value in settings.items():
+            if value is None:
+                monkeypatch.delenv(name, raising=False)
+            else:
+                monkeypatch.setenv(name, value)
+        sys.modules.pop('petadopupdate', None)
+        app = importlib.import_module('petadopupdate').app
+        app.config['TESTING'] = True
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        for name in CLOSING:
+            extension = app.extensions.get(name)
+            if extension is not None:
+                extension.close()
+    sys.modules.pop('petadopupdate', None)
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_pet(client, pet_id, headers=None, **fields):
+    body = dict(PetID=pet_id, PetName='Rex', Breed='Beagle', Age=2, HealthStatus='Healthy')
+    body.update(fields)
+    response = client.post('/api/v1/pets', json=body, headers=headers)
+    assert response.status_code == 201, response.data
+    return response.get_json()
+
+
+def add_adopter(client, adopter_id, headers=None, **fields):
+    body = dict(AdopterID=adopter_id, FirstName='Ada', LastName='Lee', Contact='555-0100', Address='1 Main St',
+                City='Springfield', State='IL', Country='USA')
+    body.update(fields)
+    response = client.post('/api/v1/adopters', json=body, headers=headers)
+    assert response.status_code == 201, response.data
+    return response.get_json()
@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import add_adopter, add_pet
+from db import DatabaseBusy, run_immediate
+
+
+def adopt(client, pet_id, adopter_id, **fields):
+    body = dict(PetID=pet_id, AdopterID=adopter_id, AdoptionDate='2025-06-01')
+    body.update(fields)
+    return client.post('/api/v1/adopt', json=body)
+
+
+def test_adopt_claims_pet_and_records_payment(client):
+    add_pet(client, 'P1')
+    add_adopter(client, 'A1')
+    response = adopt(client, 'P1', 'A1', Amount=150.0)
+    assert response.status_code == 201
+    assert response.headers['Link'].endswith('rel="payment"')
+    assert client.get('/api/v1/pets/P1').get_json()['Status'] == 'adopted'
+    payments = client.get('/api/v1/payments').get_json()['items']
+    assert [(p['AdoptionID'], p['Amount'], p['PaymentDate']) for p in payments] == [
+        (response.get_json()['AdoptionID'], 150.0, '2025-06-01')]
+
+
+def test_second_adoption_of_a_pet_is_a_conflict(client):
+    add_pet(client, 'P1')
+    add_adopter(client, 'A1')
+    add_adopter(client, 'A2')
+    assert adopt(client, 'P1', 'A1').status_code == 201
+    response = adopt(client, 'P1', 'A2', Amount=99.0)
+    assert response.status_code == 409
+    assert client.get('/api/v1/payments').get_json()['total'] == 0
+
+
+def test_concurrent_adopters_get_one_adoption_and_409s(app):
+    client = app.test_client()
+    add_pet(client, 'P1')
+    for i in range(8):
+        add_adopter(client, 'A%d' % i)
+    statuses = []
+    start = threading.Barrier(8)
+
+    def run(i):
+        start.wait()
+        statuses.append(adopt(app.test_client(), 'P1', 'A%d' % i).status_code)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(statuses) == [201] + [409] * 7
+    assert client.get('/api/v1/adoptions').get_json()['total'] == 1
+
+
+def test_generic_adoption_create_is_refused(client):
+    add_pet(client, 'P1')
+    add_adopter(client, 'A1')
+    response = client.post('/api/v1/adoptions', json=dict(PetID='P1', AdopterID='A1', AdoptionDate='2025-06-01'))
+    assert response.status_code == 405
+    assert '/api/v1/adopt' in response.get_json()['error']
+    assert client.get('/api/v1/pets/P1').get_json()['Status'] == 'available'
+
+
+def test_moving_an_adoption_claims_the_new_pet(client):
+    for pet_id in ('P1', 'P2', 'P3'):
+        add_pet(client, pet_id)
+    add_adopter(client, 'A1')
+    adoption_id = adopt(client, 'P1', 'A1').get_json()['AdoptionID']
+    assert adopt(client, 'P2', 'A1').status_code == 201
+    body = dict(PetID='P2', AdopterID='A1', AdoptionDate='2025-06-01')
+    assert client.put('/api/v1/adoptions/%d' % adoption_id, json=body).status_code == 409
+    body['PetID'] = 'P3'
+    assert client.put('/api/v1/adoptions/%d' % adoption_id, json=body).status_code == 200
+    status = {pet_id: client.get('/api/v1/pets/%s' % pet_id).get_json()['Status'] for pet_id in ('P1', 'P2', 'P3')}
+    assert status == {'P1': 'available', 'P2': 'adopted', 'P3': 'adopted'}
+
+
+@pytest.mark.parametrize('form', [
+    {'Amount': 'abc'},
+    {'AdoptionDate': 'yesterday'},
+    {'PaymentDate': '2025-13-01', 'Amount': '10'},
+    {'PetID': ''},
+])
+def test_adopt_form_rejects_bad_values(client, form):
+    add_pet(client, 'P1')
+    add_adopter(client, 'A1')
+    data = dict(PetID='P1', AdopterID='A1', AdoptionDate='2025-06-01')
+    data.update(form)
+    assert client.post('/adopt', data=data).status_code == 400
+    assert client.get('/api/v1/pets/P1').get_json()['Status'] == 'available'
+
+
+def test_edit_forms_reject_bad_values(client):
+    add_pet(client, 'P1')
+    add_adopter(client, 'A1')
+    response = client.post('/edit_pet/P1', data=dict(PetName='Rex', Breed='Beagle', Age='old', HealthStatus='Healthy'))
+    assert response.status_code == 400
+    assert client.post('/edit_adopter/A1', data=dict(FirstName='Ada')).status_code == 400
+    response = client.post('/edit_pet/P1', data=dict(PetName='Max', Breed='Beagle', Age='3', HealthStatus='Healthy'))
+    assert response.status_code == 302
+    assert client.get('/api/v1/pets/P1').get_json()['PetName'] == 'Max'
+
+
+def test_run_immediate_retries_while_the_database_is_locked(tmp_path):
+    path = str(tmp_path / 'locked.db')
+    holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    holder.execute('PRAGMA journal_mode=WAL')
+    holder.execute('CREATE TABLE t (x)')
+    holder.execute('BEGIN IMMEDIATE')
+    conn = sqlite3.connect(path, timeout=0)
+    tries = []
+
+    def work(conn):
+        tries.append(1)
+        conn.execute('INSERT INTO t VALUES (1)')
+        return 'done'
+
+    with pytest.raises(DatabaseBusy):
+        run_immediate(conn, work, retries=3, backoff=0.001)
+    assert tries == []
+
+    # Released after the first attempts have failed.
+    timer = threading.Timer(0.05, holder.rollback)
+    timer.start()
+    result, attempts = run_immediate(conn, work, retries=20, backoff=0.01)
+    timer.join()
+    assert result == 'done' and attempts > 1
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
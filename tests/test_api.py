@@ -0,0 +1,134 @@
+import sqlite3
+
+import pytest
+
+import api
+from conftest import add_adopter, add_pet
+
+
+def test_create_returns_the_item_and_its_location(client):
+    response = client.post('/api/v1/pets', json=dict(PetID='P1', PetName='Rex', Breed='Beagle', Age='2',
+                                                     HealthStatus='Healthy'))
+    assert response.status_code == 201
+    assert response.headers['Location'] == '/api/v1/pets/P1'
+    assert response.get_json()['Age'] == 2
+    assert response.headers['ETag'] and response.headers['Last-Modified']
+
+
+@pytest.mark.parametrize('body, error', [
+    ([1, 2], 'expected a JSON object body'),
+    (dict(PetID='P1', PetName='Rex', Breed='Beagle', Age='two', HealthStatus='Healthy'), 'Age'),
+])
+def test_invalid_body_is_a_400(client, body, error):
+    response = client.post('/api/v1/pets', json=body)
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
+
+
+def test_duplicate_key_is_a_conflict(client):
+    add_pet(client, 'P1')
+    response = client.post('/api/v1/pets', json=dict(PetID='P1', PetName='Rex', Breed='Beagle', Age=2,
+                                                     HealthStatus='Healthy'))
+    assert response.status_code == 409
+
+
+def test_item_etag_answers_conditional_get(client):
+    add_pet(client, 'P1')
+    first = client.get('/api/v1/pets/P1')
+    etag = first.headers['ETag']
+    assert client.get('/api/v1/pets/P1', headers={'If-None-Match': etag}).status_code == 304
+    client.put('/api/v1/pets/P1', json=dict(PetName='Rex', Breed='Beagle', Age=3, HealthStatus='Healthy'))
+    second = client.get('/api/v1/pets/P1', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+    assert second.get_json()['Age'] == 3
+
+
+def test_fields_selects_columns_and_gets_its_own_etag(client):
+    add_pet(client, 'P1')
+    full = client.get('/api/v1/pets/P1')
+    partial = client.get('/api/v1/pets/P1?fields=PetName,Age')
+    assert partial.get_json() == {'PetName': 'Rex', 'Age': 2}
+    assert partial.headers['ETag'] != full.headers['ETag']
+    response = client.get('/api/v1/pets/P1?fields=PetName,Owner')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'unknown fields: Owner'
+
+
+def test_stale_if_match_is_refused(client):
+    add_pet(client, 'P1')
+    etag = client.get('/api/v1/pets/P1').headers['ETag']
+    body = dict(PetName='Rex', Breed='Beagle', Age=3, HealthStatus='Healthy')
+    assert client.put('/api/v1/pets/P1', json=body, headers={'If-Match': etag}).status_code == 200
+    response = client.put('/api/v1/pets/P1', json=dict(body, Age=4), headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert client.delete('/api/v1/pets/P1', headers={'If-Match': etag}).status_code == 412
+    assert client.get('/api/v1/pets/P1').get_json()['Age'] == 3
+
+
+def write_between_check_and_write(app, monkeypatch, sql):
+    check = api.check_if_match
+
+    def racing(names, row):
+        version = check(names, row)
+        conn = sqlite3.connect(app.config['DATABASE'])
+        conn.execute(sql)
+        conn.commit()
+        conn.close()
+        return version
+    monkeypatch.setattr(api, 'check_if_match', racing)
+
+
+@pytest.mark.parametrize('method', ['put', 'delete'])
+def test_write_landing_after_the_check_fails_the_precondition(app, client, monkeypatch, method):
+    add_pet(client, 'P1')
+    etag = client.get('/api/v1/pets/P1').headers['ETag']
+    write_between_check_and_write(app, monkeypatch, "UPDATE pets SET Age = 7 WHERE PetID = 'P1'")
+    body = dict(PetName='Rex', Breed='Beagle', Age=3, HealthStatus='Healthy')
+    response = getattr(client, method)('/api/v1/pets/P1', json=body, headers={'If-Match': etag})
+    assert response.status_code == 412
+    monkeypatch.undo()
+    assert client.get('/api/v1/pets/P1').get_json()['Age'] == 7
+
+
+def test_row_deleted_after_the_check_is_not_found(app, client, monkeypatch):
+    add_pet(client, 'P1')
+    etag = client.get('/api/v1/pets/P1').headers['ETag']
+    write_between_check_and_write(app, monkeypatch, "UPDATE pets SET DeletedAt = 'now' WHERE PetID = 'P1'")
+    assert client.delete('/api/v1/pets/P1', headers={'If-Match': etag}).status_code == 404
+
+
+def test_if_match_accepts_an_etag_issued_for_some_fields(client):
+    add_pet(client, 'P1')
+    etag = client.get('/api/v1/pets/P1?fields=Age').headers['ETag']
+    assert client.delete('/api/v1/pets/P1', headers={'If-Match': etag}).status_code == 204
+    assert client.get('/api/v1/pets/P1').status_code == 404
+
+
+def test_list_validators_follow_writes(client):
+    add_pet(client, 'P1')
+    first = client.get('/api/v1/pets')
+    assert client.get('/api/v1/pets', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert client.get('/api/v1/pets', headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+    assert client.get('/api/v1/pets?limit=1').headers['ETag'] != first.headers['ETag']
+    add_pet(client, 'P2')
+    second = client.get('/api/v1/pets', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.get_json()['total'] == 2
+
+
+def test_soft_deleted_pets_are_gone(client):
+    add_pet(client, 'P1')
+    assert client.delete('/api/v1/pets/P1').status_code == 204
+    assert client.get('/api/v1/pets/P1').status_code == 404
+    assert client.get('/api/v1/pets').get_json()['total'] == 0
+
+
+def test_adoption_refreshes_cached_pet_pages(client):
+    add_pet(client, 'P1')
+    add_adopter(client, 'A1')
+    assert b'available' in client.get('/pets').data
+    adoption = client.post('/api/v1/adopt', json=dict(PetID='P1', AdopterID='A1', AdoptionDate='2025-06-01'))
+    assert client.delete('/api/v1/adoptions/%d' % adoption.get_json()['AdoptionID']).status_code == 204
+    assert b'available' in client.get('/pets').data
+    assert client.get('/admin/cache').get_json()['invalidations'] > 0
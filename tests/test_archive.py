@@ -0,0 +1,76 @@
+import sqlite3
+
+import pytest
+
+import archive
+from conftest import add_adopter, add_pet
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    return make_app(PET_ADOPTION_ARCHIVE_DB=str(tmp_path / 'archive.db'))
+
+
+def adopt(client, pet_id, adopter_id, day, amount=None):
+    body = dict(PetID=pet_id, AdopterID=adopter_id, AdoptionDate=day)
+    if amount is not None:
+        body.update(Amount=amount, PaymentDate=day)
+    response = client.post('/api/v1/adopt', json=body)
+    assert response.status_code == 201
+    return response.get_json()['AdoptionID']
+
+
+def test_deleted_pet_disappears_but_keeps_its_row(app, client):
+    add_pet(client, 'P1')
+    add_pet(client, 'P2')
+    assert client.get('/delete_pet/P1').status_code == 302
+    assert client.get('/api/v1/pets/P1').status_code == 404
+    assert client.get('/api/v1/pets').get_json()['total'] == 1
+    assert b'P1' not in client.get('/pets').data
+    conn = sqlite3.connect(app.config['DATABASE'])
+    assert conn.execute("SELECT DeletedAt IS NOT NULL FROM pets WHERE PetID = 'P1'").fetchone()[0] == 1
+
+
+def test_deleted_pet_cannot_be_adopted(client):
+    add_pet(client, 'P1')
+    add_adopter(client, 'A1')
+    assert client.delete('/api/v1/pets/P1').status_code == 204
+    response = client.post('/api/v1/adopt', json=dict(PetID='P1', AdopterID='A1', AdoptionDate='2025-06-01'))
+    assert response.status_code == 409
+
+
+def test_closed_adoptions_move_to_the_archive(app, client):
+    for pet_id in ('P1', 'P2', 'P3'):
+        add_pet(client, pet_id)
+    add_adopter(client, 'A1')
+    old = adopt(client, 'P1', 'A1', '2020-01-10', amount=100.0)
+    paid_late = adopt(client, 'P2', 'A1', '2020-02-10')
+    recent = adopt(client, 'P3', 'A1', '2025-06-01', amount=80.0)
+    assert client.post('/api/v1/payments', json=dict(AdoptionID=paid_late, Amount=50.0,
+                                                     PaymentDate='2025-06-02')).status_code == 201
+    with app.extensions['db_pool'].connection() as conn:
+        assert archive.archive_closed(conn, '2024-01-01', chunk_size=1, pause=0) == (1, 1)
+        assert archive.archive_counts(conn) == {'adoptions': (2, 1), 'payments': (2, 1)}
+    hot = [item['AdoptionID'] for item in client.get('/api/v1/adoptions').get_json()['items']]
+    assert sorted(hot) == [paid_late, recent]
+    everything = client.get('/api/v1/adoptions?scope=all').get_json()
+    assert sorted(item['AdoptionID'] for item in everything['items']) == [old, paid_late, recent]
+    assert everything['total'] == 3
+    # Archived adoptions still hold their pets.
+    assert client.get('/api/v1/pets/P1').get_json()['Status'] == 'adopted'
+
+
+def test_no_archive_is_attached_unless_configured(make_app, tmp_path):
+    app = make_app()
+    client = app.test_client()
+    assert 'archive' not in app.extensions
+    with app.extensions['db_pool'].connection() as conn:
+        assert 'archive' not in [row[1] for row in conn.execute('PRAGMA database_list')]
+    assert not (tmp_path / 'pets_archive.db').exists()
+    add_pet(client, 'P1')
+    add_adopter(client, 'A1')
+    adopt(client, 'P1', 'A1', '2020-01-10', amount=100.0)
+    assert client.get('/api/v1/adoptions?scope=all').get_json()['total'] == 1
+    result = app.test_cli_runner().invoke(args=['archive', 'run'])
+    assert result.exit_code == 1
+    assert 'no archive database' in result.output
@@ -0,0 +1,139 @@
+import asyncio
+import importlib
+
+import pytest
+
+from conftest import add_pet
+
+
+@pytest.fixture
+def bridge(app):
+    # asgi imports the app that the app fixture has just loaded.
+    bridge = importlib.import_module('asgi').WsgiBridge(app, threads=2)
+    yield bridge
+    bridge.executor.shutdown()
+
+
+@pytest.fixture
+def wrap(app):
+    # Bridges around bare WSGI apps.
+    asgi = importlib.import_module('asgi')
+    bridges = []
+
+    def wrap(wsgi_app):
+        bridges.append(asgi.WsgiBridge(wsgi_app, threads=1))
+        return bridges[-1]
+    yield wrap
+    for bridge in bridges:
+        bridge.executor.shutdown()
+
+
+def call(bridge, scope, messages, disconnect_after=None):
+    # Like a server, receive() waits once the messages run out; the client
+    # disconnects after disconnect_after messages have been sent, if given.
+    sent = []
+
+    async def main():
+        gone = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if disconnect_after is not None and len(sent) >= disconnect_after:
+                gone.set()
+        await bridge(scope, receive, send)
+
+    asyncio.run(main())
+    return sent
+
+
+def request(bridge, method, path, body=b'', headers=(), query=b''):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'headers': list(headers),
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+    chunks = [body[i:i + 10] for i in range(0, len(body), 10)] or [b'']
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = call(bridge, scope, messages)
+    start, bodies = sent[0], sent[1:]
+    assert start['type'] == 'http.response.start'
+    assert [m['more_body'] for m in bodies] == [True] * (len(bodies) - 1) + [False]
+    return start['status'], dict(start['headers']), b''.join(m['body'] for m in bodies)
+
+
+def test_get_is_served(client, bridge):
+    add_pet(client, 'P1', PetName='Biscuit')
+    status, headers, body = request(bridge, 'GET', '/pets')
+    assert status == 200
+    assert headers[b'content-type'].startswith(b'text/html')
+    assert b'Biscuit' in body
+
+
+def test_large_bodies_are_sent_in_pieces(client, bridge, monkeypatch):
+    monkeypatch.setattr(importlib.import_module('asgi'), 'SEND_BUFFER', 64)
+    for i in range(5):
+        add_pet(client, 'P%d' % i)
+    sent = call(bridge, {'type': 'http', 'method': 'GET', 'path': '/pets', 'headers': []},
+                [{'type': 'http.request', 'body': b''}])
+    assert len(sent) > 3
+    assert b'P4' in b''.join(m.get('body', b'') for m in sent)
+
+
+def test_request_body_and_query_reach_the_app(client, bridge):
+    body = b'{"PetID": "P1", "PetName": "Rex", "Breed": "Beagle", "Age": 2, "HealthStatus": "Healthy"}'
+    status, headers, _ = request(bridge, 'POST', '/api/v1/pets', body,
+                                 [(b'content-type', b'application/json'), (b'content-length', b'%d' % len(body))])
+    assert status == 201
+    assert headers[b'location'] == b'/api/v1/pets/P1'
+    status, _, body = request(bridge, 'GET', '/api/v1/pets/P1', query=b'fields=PetName')
+    assert (status, body.strip()) == (200, b'{"PetName":"Rex"}')
+
+
+def test_lifespan(bridge):
+    sent = call(bridge, {'type': 'lifespan'}, [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+    assert [m['type'] for m in sent] == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+
+def test_repeated_headers_are_kept_apart(wrap):
+    def wsgi_app(environ, start_response):
+        start_response('200 OK', [('Set-Cookie', 'a=1; Path=/'), ('Set-Cookie', 'b=2; Expires=Wed, 01 Jan 2031')])
+        return [environ['HTTP_COOKIE'].encode()]
+    sent = call(wrap(wsgi_app), {'type': 'http', 'method': 'GET', 'path': '/',
+                                 'headers': [(b'cookie', b'a=1'), (b'cookie', b'b=2')]},
+                [{'type': 'http.request', 'body': b''}])
+    assert sent[0]['headers'] == [(b'set-cookie', b'a=1; Path=/'), (b'set-cookie', b'b=2; Expires=Wed, 01 Jan 2031')]
+    assert sent[1]['body'] == b'a=1; b=2'
+
+
+class Endless:
+    def __init__(self):
+        self.produced = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.produced += 1
+        return b'x' * 1024
+
+    def close(self):
+        self.closed = True
+
+
+def test_client_going_away_closes_a_streamed_body(wrap, monkeypatch):
+    monkeypatch.setattr(importlib.import_module('asgi'), 'SEND_BUFFER', 1024)
+    body = Endless()
+
+    def wsgi_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return body
+    sent = call(wrap(wsgi_app), {'type': 'http', 'method': 'GET', 'path': '/', 'headers': []},
+                [{'type': 'http.request', 'body': b''}], disconnect_after=3)
+    assert body.closed
+    assert len(sent) < 10 and body.produced < 10
+    assert all(m['more_body'] for m in sent[1:])
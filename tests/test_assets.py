@@ -0,0 +1,102 @@
+import gzip
+import sqlite3
+import zlib
+
+import pytest
+
+from assets import MAX_AGE, load_assets
+from conftest import add_pet
+
+
+def test_page_etag_changes_after_a_write(client):
+    add_pet(client, 'P1')
+    first = client.get('/pets')
+    etag = first.headers['ETag']
+    assert first.data
+    assert client.get('/pets', headers={'If-None-Match': etag}).status_code == 304
+    add_pet(client, 'P2', PetName='Biscuit')
+    second = client.get('/pets', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+    assert b'Biscuit' in second.data
+
+
+def test_write_without_invalidation_is_not_served_stale(app, client):
+    # Another process (petAdop.py, flask import, a job) writes straight to
+    # the file: the cached body must follow the ETag.
+    add_pet(client, 'P1')
+    first = client.get('/pets')
+    assert b'Rex' in first.data
+    etag = first.headers['ETag']
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute("INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES ('P2', 'Zorro', 'Mutt', 3, 'Healthy')")
+    conn.commit()
+    conn.close()
+    response = client.get('/pets')
+    assert response.headers['ETag'] != etag
+    assert b'Zorro' in response.data
+
+
+def test_streamed_page_is_gzipped(client):
+    for i in range(30):
+        add_pet(client, 'P%d' % i)
+    plain = client.get('/pets')
+    compressed = client.get('/pets', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert zlib.decompress(compressed.data, 31) == plain.data
+
+
+def test_compressed_json_gets_a_weak_etag(client):
+    add_pet(client, 'P1', PetName='x' * 2000)
+    plain = client.get('/api/v1/pets/P1')
+    compressed = client.get('/api/v1/pets/P1', headers={'Accept-Encoding': 'gzip'})
+    assert gzip.decompress(compressed.data) == plain.data
+    assert compressed.headers['ETag'] == 'W/' + plain.headers['ETag']
+    assert client.get('/api/v1/pets/P1', headers={'If-None-Match': compressed.headers['ETag']}).status_code == 304
+
+
+def test_small_responses_are_sent_as_they_are(client):
+    add_pet(client, 'P1')
+    response = client.get('/api/v1/pets/P1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+@pytest.fixture
+def vendored(app, tmp_path):
+    directory = tmp_path / 'vendor'
+    directory.mkdir()
+    (directory / 'bootstrap.min.css').write_text('body { color: red; }' * 100)
+    app.extensions['assets'] = load_assets(str(directory))
+    return app.extensions['assets']['bootstrap.min.css']
+
+
+def test_pages_link_the_fingerprinted_asset(client, vendored):
+    assert ('/assets/%s' % vendored['path']).encode() in client.get('/pets').data
+
+
+def test_fingerprinted_asset_is_immutable(client, vendored):
+    response = client.get('/assets/' + vendored['path'], headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == b'body { color: red; }' * 100
+    assert response.cache_control.max_age == MAX_AGE and response.cache_control.immutable
+    again = client.get('/assets/' + vendored['path'], headers={'If-None-Match': response.headers['ETag'],
+                                                                'Accept-Encoding': 'gzip'})
+    assert again.status_code == 304
+
+
+def test_plain_asset_path_is_revalidated(client, vendored):
+    response = client.get('/assets/vendor/bootstrap.min.css')
+    assert response.cache_control.no_cache
+    assert client.get('/assets/vendor/missing.css').status_code == 404
+
+
+def test_missing_asset_links_the_cdn(client):
+    assert b'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0' in client.get('/pets').data
+
+
+def test_missing_asset_fails_without_the_cdn(make_app):
+    client = make_app(PET_ADOPTION_ASSETS_CDN='0').test_client()
+    with pytest.raises(RuntimeError, match='flask assets fetch'):
+        client.get('/pets').data
@@ -0,0 +1,69 @@
+import time
+
+from conftest import add_pet
+from cache import MemoryBackend
+
+
+def stats(client):
+    return client.get('/admin/cache').get_json()
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set('a', b'1')
+    backend.set('b', b'2')
+    assert backend.get('a') == b'1'
+    backend.set('c', b'3')
+    assert backend.get('b') is None
+    assert (backend.get('a'), backend.get('c')) == (b'1', b'3')
+    assert backend.stats()['evictions'] == 1
+
+
+def test_memory_backend_is_bounded_by_size():
+    backend = MemoryBackend(max_bytes=10)
+    backend.set('a', b'x' * 6)
+    backend.set('b', b'x' * 6)
+    assert backend.get('a') is None
+    assert backend.stats()['bytes'] == 6
+
+
+def test_memory_backend_expires_entries(monkeypatch):
+    backend = MemoryBackend()
+    backend.set('a', b'1', ttl=10)
+    backend.set('b', b'2')
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    assert backend.get('a') is None
+    assert backend.get('b') == b'2'
+    assert backend.stats()['expirations'] == 1
+
+
+def test_repeated_page_is_served_from_the_cache(client):
+    add_pet(client, 'P1')
+    first = client.get('/pets').data
+    assert client.get('/pets').data == first
+    assert (stats(client)['stores'], stats(client)['hits']) == (1, 1)
+
+
+def test_write_invalidates_the_pages_that_show_it(client):
+    add_pet(client, 'P1')
+    assert b'Biscuit' not in client.get('/pets').data
+    add_pet(client, 'P2', PetName='Biscuit')
+    assert b'Biscuit' in client.get('/pets').data
+    assert stats(client)['hits'] == 0
+
+
+def test_pages_over_the_entry_limit_are_not_stored(app, client):
+    app.extensions['page_cache'].max_entry_bytes = 100
+    add_pet(client, 'P1')
+    client.get('/pets')
+    client.get('/pets')
+    assert (stats(client)['stores'], stats(client)['too_large']) == (0, 2)
+
+
+def test_disabled_cache_always_renders(make_app):
+    client = make_app(PET_ADOPTION_CACHE='0').test_client()
+    add_pet(client, 'P1')
+    client.get('/pets')
+    client.get('/pets')
+    assert (stats(client)['hits'], stats(client)['stores']) == (0, 0)
@@ -0,0 +1,95 @@
+from conftest import add_adopter, add_pet
+from dashboard import rebuild
+
+SUMMARIES = ['monthly_adoptions', 'monthly_revenue', 'breed_stats', 'dashboard_totals']
+
+
+def adopt(client, pet_id, adopter_id, day, amount=None):
+    response = client.post('/api/v1/adopt', json=dict(PetID=pet_id, AdopterID=adopter_id, AdoptionDate=day,
+                                                      Amount=amount))
+    assert response.status_code == 201
+    return response.get_json()['AdoptionID']
+
+
+def summaries(app):
+    with app.extensions['db_pool'].connection() as conn:
+        return {table: sorted(row for row in conn.execute('SELECT * FROM %s' % table) if row[1])
+                for table in SUMMARIES}
+
+
+def populate(client):
+    add_pet(client, 'P1', Breed='Beagle', Age=2)
+    add_pet(client, 'P2', Breed='Beagle', Age=5)
+    add_pet(client, 'P3', Breed='Husky', Age=4)
+    add_pet(client, 'P4', Breed='Corgi', Age=1)
+    add_adopter(client, 'A1')
+    add_adopter(client, 'A2')
+    adopt(client, 'P1', 'A1', '2025-01-10', 100.0)
+    adopt(client, 'P2', 'A2', '2025-01-20', 50.0)
+    moved = adopt(client, 'P3', 'A1', '2025-02-03', 75.5)
+    client.put('/api/v1/adoptions/%d' % moved, json=dict(PetID='P4', AdopterID='A1', AdoptionDate='2025-03-01'))
+    client.delete('/api/v1/pets/P3')
+
+
+def test_summaries_follow_every_write(app, client):
+    populate(client)
+    assert summaries(app) == {
+        'monthly_adoptions': [('2025-01', 2), ('2025-03', 1)],
+        'monthly_revenue': [('2025-01', 2, 150.0), ('2025-02', 1, 75.5)],
+        'breed_stats': [('Beagle', 2, 7), ('Corgi', 1, 1)],
+        'dashboard_totals': [('adopted_pets', 3)],
+    }
+
+
+def test_rebuild_agrees_with_the_triggers(app, client):
+    populate(client)
+    incremental = summaries(app)
+    with app.extensions['db_pool'].connection() as conn:
+        for table in SUMMARIES:
+            conn.execute('DELETE FROM %s' % table)
+        conn.commit()
+        rebuild(conn)
+    assert summaries(app) == incremental
+
+
+def test_page_shows_months_and_breed_averages(client):
+    populate(client)
+    page = client.get('/dashboard').get_data(as_text=True)
+    assert '<tr><td>2025-01</td><td>2</td><td>2</td><td>150.00</td></tr>' in page
+    assert '<tr><td>2025-02</td><td>0</td><td>1</td><td>75.50</td></tr>' in page
+    assert '<tr><td>Beagle</td><td>2</td><td>3.5</td></tr>' in page
+    assert '<strong>3</strong> adopted' in page
+
+
+def test_cli_rebuild(app, client):
+    populate(client)
+    result = app.test_cli_runner().invoke(args=['dashboard', 'rebuild'])
+    assert result.exit_code == 0, result.output
+    assert 'Dashboard aggregates rebuilt' in result.output
+
+
+def open_pets(app):
+    with app.extensions['db_pool'].connection() as conn:
+        return conn.execute("SELECT Value FROM dashboard_totals WHERE Name = 'open_pets'").fetchone()[0]
+
+
+def test_open_pets_are_the_available_ones_on_file(app, client):
+    for pet_id in ('P1', 'P2', 'P3'):
+        add_pet(client, pet_id)
+    add_adopter(client, 'A1')
+    adoption = adopt(client, 'P1', 'A1', '2025-01-10')
+    client.delete('/api/v1/pets/P2')
+    assert open_pets(app) == 1
+    assert '<strong>1</strong> open' in client.get('/dashboard').get_data(as_text=True)
+    client.delete('/api/v1/adoptions/%d' % adoption)
+    client.delete('/api/v1/pets/P1')
+    client.delete('/api/v1/pets/P3')
+    assert open_pets(app) == 0
+    with app.extensions['db_pool'].connection() as conn:
+        conn.execute("UPDATE pets SET DeletedAt = NULL WHERE PetID = 'P2'")
+        conn.commit()
+        assert open_pets(app) == 1
+        conn.execute("UPDATE dashboard_totals SET Value = -5 WHERE Name = 'open_pets'")
+        conn.commit()
+        rebuild(conn)
+    assert open_pets(app) == 1
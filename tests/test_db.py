@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from db import ConnectionPool, get_db
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), size=2, timeout=0.1)
+    yield pool
+    pool.close()
+
+
+def test_connections_are_reused_and_bounded(pool):
+    first = pool.acquire()
+    second = pool.acquire()
+    with pytest.raises(RuntimeError, match='timed out'):
+        pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    stats = pool.stats()
+    assert (stats['created'], stats['checkouts'], stats['waits'], stats['in_use']) == (2, 3, 1, 2)
+    pool.release(first)
+    pool.release(second)
+
+
+def test_waiting_checkout_gets_the_released_connection(pool):
+    held = [pool.acquire(), pool.acquire()]
+    threading.Timer(0.02, pool.release, args=(held[0],)).start()
+    assert pool.acquire() is held[0]
+
+
+def test_connections_are_set_up_once(pool):
+    with pool.connection() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+
+def test_open_transaction_is_rolled_back_on_release(pool):
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE t (x)')
+        conn.commit()
+        conn.execute('INSERT INTO t VALUES (1)')
+    with pool.connection() as conn:
+        assert not conn.in_transaction
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    assert pool.stats()['leaks'] == 1
+
+
+def test_broken_connection_is_replaced(pool):
+    with pool.connection() as conn:
+        pass
+    # Closed while idle in the pool.
+    conn.close()
+    with pool.connection() as conn:
+        assert conn.execute('SELECT 1').fetchone() == (1,)
+    stats = pool.stats()
+    assert (stats['created'], stats['discarded']) == (2, 1)
+
+
+def test_request_uses_one_connection_and_returns_it(app):
+    pool = app.extensions['db_pool']
+    for _ in range(2):
+        with app.test_request_context('/'):
+            conn = get_db()
+            assert get_db() is conn
+            assert pool.stats()['in_use'] == 1
+        assert pool.stats()['in_use'] == 0
+    with app.test_request_context('/'):
+        assert get_db() is conn
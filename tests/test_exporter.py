@@ -0,0 +1,76 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from conftest import add_adopter, add_pet
+from importer import IMPORTS
+
+
+@pytest.fixture
+def shelter(client):
+    add_pet(client, 'P1', PetName='Rex, Jr.')
+    add_pet(client, 'P2', PetName='Luna', Age=5)
+    add_pet(client, 'P3', PetName='Milo')
+    add_adopter(client, 'A1', Address='1 "Main" St')
+    add_adopter(client, 'A2')
+    for pet_id, adopter_id, day in [('P1', 'A1', '2025-01-10'), ('P2', 'A2', '2025-03-05')]:
+        response = client.post('/api/v1/adopt', json=dict(PetID=pet_id, AdopterID=adopter_id, AdoptionDate=day,
+                                                           Amount=50.0))
+        assert response.status_code == 201
+    return client
+
+
+def imported(table, items):
+    columns = [name for name, _ in IMPORTS[table]]
+    return [{name: item[name] for name in columns} for item in items]
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_export_imports_into_another_database(make_app, shelter, tmp_path, fmt):
+    exports = {table: shelter.get('/export/%s.%s' % (table, fmt)).data
+               for table in ['pets', 'adopters', 'adoptions', 'payments']}
+    other = make_app(PET_ADOPTION_DB=str(tmp_path / 'other.db')).test_client()
+    for table, data in exports.items():
+        response = other.post('/import', data={'table': table, 'file': (io.BytesIO(data), table + '.' + fmt)},
+                              content_type='multipart/form-data')
+        assert b'0 rejected' in response.data, (table, response.data)
+    for table in exports:
+        url = '/api/v1/%s?limit=100' % table
+        assert imported(table, other.get(url).get_json()['items']) == imported(
+            table, shelter.get(url).get_json()['items'])
+
+
+def test_csv_export_has_a_header_and_quotes_values(shelter):
+    response = shelter.get('/export/pets.csv')
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="pets.csv"'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row['PetName'] for row in rows] == ['Rex, Jr.', 'Luna', 'Milo']
+
+
+def test_export_filters_on_dates(shelter):
+    lines = shelter.get('/export/adoptions.jsonl?date_from=2025-02-01').get_data(as_text=True).splitlines()
+    assert [json.loads(line)['PetID'] for line in lines] == ['P2']
+    lines = shelter.get('/export/payments.jsonl?date_to=2025-02-01').get_data(as_text=True).splitlines()
+    assert [json.loads(line)['PaymentDate'] for line in lines] == ['2025-01-10']
+
+
+def test_gzip_export_matches_plain_export(shelter):
+    plain = shelter.get('/export/adopters.csv').data
+    response = shelter.get('/export/adopters.csv.gz')
+    assert response.mimetype == 'application/gzip'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="adopters.csv.gz"'
+    assert gzip.decompress(response.data) == plain
+    assert gzip.decompress(shelter.get('/export/adopters.csv?gzip=1').data) == plain
+
+
+def test_cli_export_writes_a_file(app, shelter, tmp_path):
+    path = tmp_path / 'adoptions.jsonl.gz'
+    result = app.test_cli_runner().invoke(args=['export', 'adoptions', str(path), '--format', 'jsonl', '--gzip',
+                                                '--date-to', '2025-02-01'])
+    assert result.exit_code == 0, result.output
+    lines = gzip.decompress(path.read_bytes()).decode().splitlines()
+    assert [json.loads(line)['AdopterID'] for line in lines] == ['A1']
@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+
+from importer import clean_record, import_records, read_records
+
+PETS_CSV = '''PetID,PetName,Breed,Age,HealthStatus
+P1,Rex,Beagle,2,Healthy
+P2,Luna,Husky,old,Healthy
+P3,Milo,Corgi,1,Healthy
+P1,Again,Beagle,3,Healthy
+'''
+
+
+def pet_ids(client):
+    return [item['PetID'] for item in client.get('/api/v1/pets?limit=100').get_json()['items']]
+
+
+def test_cli_import_reports_bad_rows_by_line(app, client, tmp_path):
+    path = tmp_path / 'pets.csv'
+    path.write_text(PETS_CSV)
+    result = app.test_cli_runner().invoke(args=['import', 'pets', str(path), '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'pets: 4 rows read, 2 inserted, 2 rejected' in result.stdout
+    assert 'line 3: Age: invalid literal' in result.stderr
+    assert 'line 5: UNIQUE constraint failed' in result.stderr
+    assert pet_ids(client) == ['P1', 'P3']
+
+
+def test_upload_of_jsonl(client):
+    lines = [dict(AdopterID='A1', FirstName='Ada', LastName='Lee', Contact='c', Address='a', City='Springfield',
+                  State='IL', Country='USA'), 'not json', ['not', 'an', 'object']]
+    data = '\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+    response = client.post('/import', data={'table': 'adopters', 'file': (io.BytesIO(data.encode()), 'adopters.jsonl')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert b'3 rows read, 1 inserted, 2 rejected' in response.data
+    assert b'invalid JSON' in response.data and b'expected a JSON object' in response.data
+    assert client.get('/api/v1/adopters/A1').status_code == 200
+
+
+def test_import_invalidates_cached_pages(client):
+    assert b'Rex' not in client.get('/pets').data
+    client.post('/import', data={'table': 'pets', 'file': (io.BytesIO(PETS_CSV.encode()), 'pets.csv')},
+                content_type='multipart/form-data')
+    assert b'Rex' in client.get('/pets').data
+
+
+def test_constraint_violation_only_rejects_its_own_row(app):
+    with app.extensions['db_pool'].connection() as conn:
+        report = import_records(conn, 'pets', read_records(io.StringIO(PETS_CSV), 'csv'), batch_size=10)
+    assert (report.rows, report.inserted, report.error_count) == (4, 2, 2)
+
+
+@pytest.mark.parametrize('record, error', [
+    ({'AdoptionID': '', 'PetID': 'P1', 'AdopterID': 'A1', 'AdoptionDate': '2025-02-30'}, 'AdoptionDate'),
+    ({'AdoptionID': '-1', 'PetID': 'P1', 'AdopterID': 'A1', 'AdoptionDate': '2025-02-01'}, 'must not be negative'),
+    ({'AdoptionID': '', 'PetID': ' ', 'AdopterID': 'A1', 'AdoptionDate': '2025-02-01'}, 'PetID: value is required'),
+])
+def test_records_are_validated(record, error):
+    with pytest.raises(ValueError, match=error):
+        clean_record('adoptions', record)
+
+
+def test_blank_key_is_left_to_sqlite():
+    assert clean_record('payments', {'PaymentID': '', 'AdoptionID': '3', 'Amount': '9.5', 'PaymentDate': '2025-01-02'}) == [
+        None, 3, 9.5, '2025-01-02']
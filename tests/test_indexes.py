@@ -0,0 +1,22 @@
+import re
+
+
+def test_no_audited_query_scans_a_whole_table(client):
+    page = client.get('/admin/explain')
+    assert page.status_code == 200
+    warned, total = re.search(rb'(\d+) of (\d+) queries', page.data).groups()
+    assert int(total) > 0
+    assert warned == b'0'
+
+
+def test_plan_warning_flags_unindexed_scans(app):
+    import petadopupdate
+    assert petadopupdate.plan_warning(['SCAN pets'])
+    assert not petadopupdate.plan_warning(['SCAN pets USING INDEX idx_pets_breed'])
+    assert not petadopupdate.plan_warning(['SEARCH pets USING INDEX sqlite_autoindex_pets_1 (PetID=?)'])
+
+
+def test_foreign_keys_are_enforced(client):
+    response = client.post('/add_payment', data=dict(AdoptionID='99', Amount='10', PaymentDate='2025-06-01'))
+    assert response.status_code == 409
+    assert client.get('/api/v1/payments').get_json()['total'] == 0
@@ -0,0 +1,73 @@
+import re
+
+from conftest import add_pet
+from instrumentation import BUCKETS, Metrics, statement_label
+
+
+def metric(client, line):
+    # The value of the first /metrics sample whose name and labels start with line.
+    for sample in client.get('/metrics').get_data(as_text=True).splitlines():
+        if sample.startswith('petadoption_' + line):
+            return float(sample.rsplit(' ', 1)[1])
+    return None
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics([('latency', 'histogram', 'Latency.')])
+    for value in (0.0005, 0.003, 0.003, 20.0):
+        metrics.observe('latency', value, route='x')
+    text = metrics.render()
+    assert 'petadoption_latency_bucket{route="x",le="%r"} 1' % BUCKETS[0] in text
+    assert 'petadoption_latency_bucket{route="x",le="0.005"} 3' in text
+    assert 'petadoption_latency_bucket{route="x",le="10.0"} 3' in text
+    assert 'petadoption_latency_bucket{route="x",le="+Inf"} 4' in text
+    assert 'petadoption_latency_count{route="x"} 4' in text
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics([('hits', 'counter', 'Hits.')])
+    metrics.inc('hits', path='say "hi"\n')
+    assert 'petadoption_hits{path="say \\"hi\\"\\n"} 1' in metrics.render()
+
+
+def test_requests_are_counted_by_endpoint_and_status(client):
+    client.get('/pets')
+    client.get('/pets')
+    client.get('/api/v1/pets/nope')
+    assert metric(client, 'http_requests_total{endpoint="pets",method="GET",status="200"}') == 2
+    assert metric(client, 'http_requests_total{endpoint="api.get_item",method="GET",status="404"}') == 1
+    assert metric(client, 'http_request_duration_seconds_count{endpoint="pets"}') == 2
+
+
+def test_statements_are_counted_by_their_sql(client):
+    add_pet(client, 'P1')
+    client.get('/api/v1/pets/P1')
+    label = statement_label('SELECT * FROM pets WHERE PetID=? AND DeletedAt IS NULL')
+    assert metric(client, 'sql_statements_total{statement="%s"}' % label) == 2
+    assert metric(client, 'sql_rows_total{statement="%s"}' % label) == 2
+
+
+def test_server_timing_reports_sql_and_render_time(client):
+    add_pet(client, 'P1')
+    header = client.get('/pets').headers['Server-Timing']
+    assert re.search(r'sql;desc="\d+ statements, \d+ rows";dur=[\d.]+', header)
+    assert 'tpl;desc="template render"' in header and 'app;desc="until headers"' in header
+
+
+def test_profiling_is_off_by_default(client):
+    response = client.get('/pets?profile=1')
+    assert response.mimetype == 'text/html'
+
+
+def test_profile_replaces_the_page_with_a_report(make_app):
+    client = make_app(PET_ADOPTION_PROFILE='1', PET_ADOPTION_PROFILE_TOKEN='s3cret').test_client()
+    assert client.get('/pets?profile=1').mimetype == 'text/html'
+    response = client.get('/pets?profile=cprofile', headers={'X-Profile-Token': 's3cret'})
+    assert response.mimetype == 'text/plain'
+    assert 'cumulative' in response.get_data(as_text=True)
+    response = client.get('/pets?profile=1&token=s3cret')
+    assert re.match(r'\d+ samples every 1.0 ms', response.get_data(as_text=True))
+
+
+def test_metrics_can_be_turned_off(make_app):
+    assert make_app(PET_ADOPTION_METRICS='0').test_client().get('/metrics').status_code == 404
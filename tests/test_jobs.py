@@ -0,0 +1,94 @@
+import datetime
+import os
+import threading
+import time
+
+import pytest
+
+import jobs
+
+
+def test_importing_the_app_starts_no_runner(make_app):
+    app = make_app(PET_ADOPTION_JOBS='1')
+    assert 'job_runner' not in app.extensions
+    assert app.test_cli_runner().invoke(args=['jobs', 'list']).exit_code == 0
+    assert 'job_runner' not in app.extensions
+
+
+def test_first_request_starts_the_runner(make_app):
+    app = make_app(PET_ADOPTION_JOBS='1')
+    app.test_client().get('/api/v1/pets')
+    runner = app.extensions['job_runner']
+    app.test_client().get('/api/v1/pets')
+    assert app.extensions['job_runner'] is runner
+
+
+@pytest.mark.parametrize('arg', ['days', '=30'])
+def test_job_arguments_need_a_key_and_a_value(app, arg):
+    result = app.test_cli_runner().invoke(args=['jobs', 'enqueue', 'maintenance', '--arg', arg])
+    assert result.exit_code == 2
+    assert 'expected KEY=VALUE' in result.output
+
+
+def test_run_command_passes_arguments(app):
+    result = app.test_cli_runner().invoke(args=['jobs', 'run', 'payment-report', '--arg', 'month=2025-05'])
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith('payment-report run 1: done')
+    assert os.path.exists(os.path.join(app.config['JOBS_REPORT_DIR'], 'payments-2025-05.csv'))
+
+
+@pytest.mark.parametrize('expression, after, expected', [
+    ('30 3 * * *', datetime.datetime(2025, 6, 1, 3, 30), datetime.datetime(2025, 6, 2, 3, 30)),
+    ('0 4 * * 0', datetime.datetime(2025, 6, 2, 12, 0), datetime.datetime(2025, 6, 8, 4, 0)),
+    ('*/15 * * * *', datetime.datetime(2025, 6, 1, 10, 7), datetime.datetime(2025, 6, 1, 10, 15)),
+    ('0 6 1 * *', datetime.datetime(2025, 12, 15, 0, 0), datetime.datetime(2026, 1, 1, 6, 0)),
+])
+def test_cron_next_run(expression, after, expected):
+    assert jobs.Cron(expression).next_after(after) == expected
+
+
+def test_bad_cron_is_refused():
+    with pytest.raises(ValueError):
+        jobs.Cron('61 * * * *')
+
+
+def run_status(app, run_id):
+    with app.extensions['db_pool'].connection() as conn:
+        return conn.execute('SELECT Status, Attempts FROM job_runs WHERE RunID = ?', (run_id,)).fetchone()
+
+
+def test_run_past_its_lease_is_not_claimed_again(app, monkeypatch):
+    calls = []
+    done = threading.Event()
+
+    def slow(conn):
+        calls.append(time.monotonic())
+        time.sleep(0.5)
+        done.set()
+    monkeypatch.setitem(jobs.JOBS, 'slow', jobs.Job('slow', slow, retries=2, timeout=0.1))
+    with app.extensions['db_pool'].connection() as conn:
+        run_id = jobs.enqueue(conn, 'slow')
+    runner = jobs.JobRunner(app, app.extensions['db_pool'], workers=2, interval=0.02)
+    try:
+        assert done.wait(5)
+        deadline = time.monotonic() + 5
+        while run_status(app, run_id)[0] == 'running' and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        runner.close()
+    assert len(calls) == 1
+    assert run_status(app, run_id) == ('done', 1)
+
+
+def test_released_attempt_does_not_record_its_outcome(app, monkeypatch):
+    monkeypatch.setitem(jobs.JOBS, 'slow', jobs.Job('slow', lambda conn: None, retries=2, timeout=0))
+    with app.extensions['db_pool'].connection() as conn:
+        run_id = jobs.enqueue(conn, 'slow')
+        first = jobs.claim(conn, 'elsewhere:1')
+        time.sleep(0.01)
+        assert jobs.release_abandoned(conn) == 1
+        second = jobs.claim(conn, 'elsewhere:1')
+        assert (first[0], first[3], second[3]) == (run_id, 1, 2)
+        assert jobs.finish(conn, run_id, first[3], error='late') is None
+        assert jobs.finish(conn, run_id, second[3], result={'ok': True}) == 'done'
+    assert run_status(app, run_id) == ('done', 2)
@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import add_pet
+from listing import decode_cursor, encode_cursor
+
+
+def walk(client, url):
+    # Every item of a listing, page by page along next_cursor.
+    items, cursor, pages = [], None, 0
+    while True:
+        page = client.get(url + ('&cursor=%s' % cursor if cursor else '')).get_json()
+        items += page['items']
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            return items, pages
+
+
+@pytest.fixture
+def pets(client):
+    for i in range(7):
+        add_pet(client, 'P%02d' % i, PetName='Pet %d' % (i % 3), Age=i % 4)
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(['Rex', 'P01'])) == ['Rex', 'P01']
+    assert decode_cursor(encode_cursor([3])) == [3]
+
+
+@pytest.mark.parametrize('token', ['!!!', 'bm90IGpzb24=', encode_cursor({'a': 1}), encode_cursor([1, 2, 3]),
+                                   encode_cursor([[1], [2]]), encode_cursor([{'a': 1}])])
+def test_garbage_cursors_are_ignored(token):
+    assert decode_cursor(token) is None
+
+
+def test_pages_cover_every_row_once(client, pets):
+    items, pages = walk(client, '/api/v1/pets?limit=2')
+    assert [item['PetID'] for item in items] == ['P%02d' % i for i in range(7)]
+    assert pages == 4
+
+
+@pytest.mark.parametrize('sort', ['PetName', 'Age'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_pages_on_a_sort_column_with_ties(client, pets, sort, order):
+    items, _ = walk(client, '/api/v1/pets?limit=2&sort=%s&order=%s' % (sort, order))
+    expected = sorted(client.get('/api/v1/pets?limit=100').get_json()['items'],
+                      key=lambda item: (item[sort], item['PetID']), reverse=order == 'desc')
+    assert [item['PetID'] for item in items] == [item['PetID'] for item in expected]
+
+
+@pytest.mark.parametrize('token', ['!!!', encode_cursor([[1], [2]])])
+def test_garbage_cursor_serves_the_first_page(client, pets, token):
+    response = client.get('/api/v1/pets?limit=2&cursor=' + token)
+    assert response.status_code == 200
+    assert [item['PetID'] for item in response.get_json()['items']] == ['P00', 'P01']
+    response = client.get('/pets?limit=2&cursor=' + token)
+    assert response.status_code == 200
+    assert b'P00' in response.data
@@ -0,0 +1,136 @@
+import random
+
+import numpy
+import pytest
+
+import matching
+from conftest import add_adopter, add_pet
+from matching import feature_arrays, rank_numpy, rank_python, rebuild, refill_size, refresh, score, score_matrix
+
+BREEDS = ['beagle', 'husky', 'corgi', None]
+HEALTH = ['healthy', 'needs care', None]
+COUNT = 4
+
+
+def features(seed, pets=40, adopters=30):
+    rng = random.Random(seed)
+    pet_features = {'P%d' % i: (rng.choice(BREEDS[:-1]), float(rng.randint(0, 15)), rng.choice(HEALTH[:-1]))
+                    for i in range(pets)}
+    adopter_features = {}
+    for i in range(adopters):
+        low = rng.choice([None, rng.randint(0, 8)])
+        high = rng.choice([None, rng.randint(8, 15)])
+        adopter_features['A%d' % i] = (rng.choice(BREEDS), low, high, rng.choice(HEALTH), rng.choice([0.0, 0.3, 0.6, 1.0]))
+    return pet_features, adopter_features
+
+
+def scores_by_owner(lists):
+    return {owner: sorted(value for _, value in pairs) for owner, pairs in lists}
+
+
+def test_score_matrix_agrees_with_score():
+    pets, adopters = features(1)
+    pet_columns, adopter_columns = feature_arrays(list(pets.values()), list(adopters.values()))
+    matrix = score_matrix(pet_columns, adopter_columns, numpy.arange(len(pets)))
+    expected = [[score(p, a) for a in adopters.values()] for p in pets.values()]
+    assert matrix.tolist() == expected
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_numpy_and_python_ranking_agree(seed, monkeypatch):
+    monkeypatch.setattr(matching, 'BLOCK_ROWS', 7)
+    pets, adopters = features(seed)
+    fast, slow = rank_numpy(pets, adopters, COUNT), rank_python(pets, adopters, COUNT)
+    for fast_lists, slow_lists in zip(fast, slow):
+        assert scores_by_owner(fast_lists) == scores_by_owner(slow_lists)
+        assert all(len(pairs) == COUNT for _, pairs in fast_lists)
+
+
+def test_importing_the_app_starts_no_refresher(make_app):
+    app = make_app(PET_ADOPTION_MATCH_REFRESH='1')
+    assert 'match_refresher' not in app.extensions
+    assert app.test_cli_runner().invoke(args=['jobs', 'list']).exit_code == 0
+    assert 'match_refresher' not in app.extensions
+
+
+def test_first_request_starts_the_refresher(make_app):
+    app = make_app(PET_ADOPTION_MATCH_REFRESH='1')
+    app.test_client().get('/api/v1/pets')
+    refresher = app.extensions['match_refresher']
+    app.test_client().get('/api/v1/pets')
+    assert app.extensions['match_refresher'] is refresher
+
+
+def populate(client, conn, pets=12, adopters=8):
+    rng = random.Random(7)
+    for i in range(pets):
+        add_pet(client, 'P%d' % i, Breed=rng.choice(['Beagle', 'Husky', 'Corgi']), Age=rng.randint(0, 15))
+    for i in range(adopters):
+        add_adopter(client, 'A%d' % i, City=rng.choice(['Springfield', 'Shelbyville']))
+    for i in range(adopters):
+        conn.execute('INSERT INTO adopter_preferences (AdopterID, Breed, MinAge, MaxAge) VALUES (?, ?, ?, ?)',
+                     ('A%d' % i, rng.choice(['Beagle', 'Husky', None]), rng.randint(0, 5), rng.randint(5, 15)))
+    conn.commit()
+
+
+def top_scores(conn):
+    # The part of every list a page can show, as scores.
+    shown = refill_size(COUNT)
+    result = {}
+    for kind, (table, owner, _) in matching.LISTS.items():
+        for key, value in conn.execute('SELECT %s, Score FROM %s ORDER BY %s, Score DESC' % (owner, table, owner)):
+            values = result.setdefault((kind, key), [])
+            if len(values) < shown:
+                values.append(value)
+    return result
+
+
+def test_incremental_refresh_matches_a_rebuild(app, client):
+    with app.extensions['db_pool'].connection() as conn:
+        populate(client, conn)
+        assert refresh(conn, COUNT)[0] == 'rebuild'
+        client.put('/api/v1/pets/P1', json=dict(PetName='Rex', Breed='Husky', Age=1, HealthStatus='Healthy'))
+        client.delete('/api/v1/pets/P2')
+        client.delete('/api/v1/adopters/A3')
+        add_pet(client, 'P99', Breed='Beagle', Age=4)
+        client.post('/api/v1/adopt', json=dict(PetID='P5', AdopterID='A0', AdoptionDate='2025-06-01'))
+        conn.execute("UPDATE adopter_preferences SET Breed = 'Corgi' WHERE AdopterID = 'A1'")
+        conn.commit()
+        while refresh(conn, COUNT)[1]:
+            pass
+        incremental = top_scores(conn)
+        rebuild(conn, COUNT)
+        assert incremental == top_scores(conn)
+
+
+def test_match_pages_and_api(app, client):
+    add_pet(client, 'P1', Breed='Husky', Age=3)
+    add_pet(client, 'P2', Breed='Beagle', Age=3)
+    add_adopter(client, 'A1')
+    client.post('/adopters/A1/preferences', data={'Breed': 'Husky', 'MinAge': '1', 'MaxAge': '5'})
+    with app.extensions['db_pool'].connection() as conn:
+        refresh(conn, COUNT)
+    items = client.get('/api/v1/adopters/A1/matches').get_json()['items']
+    assert [item['PetID'] for item in items] == ['P1', 'P2']
+    assert items[0]['Score'] == score(('husky', 3.0, 'healthy'), ('husky', 1.0, 5.0, None, 0.0))
+    assert b'Best adopters for Rex' in client.get('/pets/P1/matches').data
+    assert client.get('/pets/P404/matches').status_code == 404
+    assert client.post('/adopters/A1/preferences', data={'MinAge': 'one'}).status_code == 400
+
+
+def test_adopted_pets_drop_out_of_the_lists(app, client):
+    add_pet(client, 'P1')
+    add_pet(client, 'P2')
+    add_adopter(client, 'A1')
+    with app.extensions['db_pool'].connection() as conn:
+        refresh(conn, COUNT)
+    client.post('/api/v1/adopt', json=dict(PetID='P1', AdopterID='A1', AdoptionDate='2025-06-01'))
+    # Straight away, before the refresher has caught up ...
+    matches = client.get('/api/v1/adopters/A1/matches').get_json()
+    assert [item['PetID'] for item in matches['items']] == ['P2']
+    assert matches['pending'] == 1
+    # ... and from the index itself afterwards.
+    with app.extensions['db_pool'].connection() as conn:
+        refresh(conn, COUNT)
+        assert conn.execute("SELECT COUNT(*) FROM pet_matches WHERE PetID = 'P1'").fetchone()[0] == 0
+        assert conn.execute("SELECT PetID FROM adopter_matches WHERE AdopterID = 'A1'").fetchall() == [('P2',)]
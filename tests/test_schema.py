@@ -0,0 +1,116 @@
+import sqlite3
+
+import pytest
+
+import schema
+from db import ConnectionPool
+
+# The tables as the first release created them, plus petAdop.py's own.
+BASELINE = schema.TABLES + [
+    'CREATE TABLE Pet (PetID INTEGER PRIMARY KEY, PetName TEXT, Breed TEXT, Age INTEGER, HealthStatus TEXT)',
+    '''CREATE TABLE Adopter (AdopterID INTEGER PRIMARY KEY, FirstName TEXT, LastName TEXT, Contact TEXT,
+        Address TEXT, City TEXT, State TEXT, Country TEXT)''',
+]
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = str(tmp_path / 'pets.db')
+    conn = sqlite3.connect(path)
+    for sql in BASELINE:
+        conn.execute(sql)
+    conn.executemany('INSERT INTO pets VALUES (?, ?, ?, ?, ?)',
+                     [('P1', 'Rex', 'Beagle', 2, 'Healthy'), ('P2', 'Luna', 'Husky', 4, 'Healthy')])
+    conn.execute("INSERT INTO adopters VALUES ('A1', 'Ada', 'Lee', 'c', 'a', 'Springfield', 'IL', 'USA')")
+    conn.execute("INSERT INTO adoptions (PetID, AdopterID, AdoptionDate) VALUES ('P1', 'A1', '2025-01-02')")
+    conn.execute("INSERT INTO payments (AdoptionID, Amount, PaymentDate) VALUES (1, 120.0, '2025-01-02')")
+    conn.executemany('INSERT INTO Pet VALUES (?, ?, ?, ?, ?)', [(1, 'Old', None, 3, 'ok'), (2, 'Older', 'Pug', None, None)])
+    conn.execute("INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES ('2', 'Taken', 'Pug', 1, 'ok')")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def migrate(path):
+    pool = ConnectionPool(path, size=1)
+    try:
+        schema.init_db(pool)
+        with pool.connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        pool.close()
+
+
+def test_baseline_database_migrates_to_the_latest_version(baseline):
+    assert migrate(baseline) == len(schema.MIGRATIONS)
+    conn = sqlite3.connect(baseline)
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    assert conn.execute('PRAGMA foreign_key_check').fetchall() == []
+    assert [row[0] for row in conn.execute('SELECT Version FROM schema_version ORDER BY Version')] == list(
+        range(1, len(schema.MIGRATIONS) + 1))
+    # Backfilled by the migrations.
+    assert dict(conn.execute('SELECT PetID, Status FROM pets')) == {'P1': 'adopted', 'P2': 'available', '2': 'available'}
+    assert conn.execute("SELECT Total FROM row_counts WHERE TableName = 'pets'").fetchone()[0] == 3
+    assert conn.execute("SELECT rowid FROM pets_fts WHERE pets_fts MATCH 'husky'").fetchall() == [(2,)]
+    # Integer keys alias the rowids they were given.
+    assert conn.execute("SELECT PetKey FROM pets WHERE PetID = 'P2'").fetchone()[0] == 2
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES ('P1', 'x', 'y', 1, 'z')")
+
+
+def test_migrations_run_once(baseline):
+    migrate(baseline)
+    conn = sqlite3.connect(baseline)
+    triggers = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").fetchone()[0]
+    conn.close()
+    assert migrate(baseline) == len(schema.MIGRATIONS)
+    conn = sqlite3.connect(baseline)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").fetchone()[0] == triggers
+
+
+def test_rebuilt_tables_keep_their_triggers(baseline):
+    migrate(baseline)
+    conn = sqlite3.connect(baseline)
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute("INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES ('P3', 'Milo', 'Corgi', 1, 'ok')")
+    conn.execute("UPDATE pets SET PetName = 'Max' WHERE PetID = 'P3'")
+    assert conn.execute("SELECT RowVersion FROM pets WHERE PetID = 'P3'").fetchone()[0] == 2
+    assert conn.execute("SELECT Total FROM row_counts WHERE TableName = 'pets'").fetchone()[0] == 4
+    assert conn.execute("SELECT rowid FROM pets_fts WHERE pets_fts MATCH 'max'").fetchone() is not None
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO adoptions (PetID, AdopterID, AdoptionDate) VALUES ('nope', 'A1', '2025-01-02')")
+
+
+def test_legacy_rows_are_copied_once(baseline):
+    migrate(baseline)
+    conn = sqlite3.connect(baseline, isolation_level=None)
+    assert schema.legacy_pending(conn) == {'Pet': 2}
+    totals = schema.copy_legacy(conn, chunk_size=1, pause=0)
+    assert totals == {'Pet': (1, 1), 'Adopter': (0, 0)}
+    assert conn.execute("SELECT PetName, Breed, Age FROM pets WHERE PetID = '1'").fetchone() == ('Old', '', 3)
+    assert conn.execute("SELECT PetName FROM pets WHERE PetID = '2'").fetchone()[0] == 'Taken'
+    assert schema.legacy_pending(conn) == {}
+    assert schema.copy_legacy(conn, pause=0) == {'Pet': (0, 0), 'Adopter': (0, 0)}
+
+
+def test_rebuilt_tables_follow_the_schema(baseline):
+    migrate(baseline)
+    conn = sqlite3.connect(baseline)
+    columns = [(name, kind, notnull, pk) for _, name, kind, notnull, _, pk in conn.execute('PRAGMA table_info(pets)')]
+    assert columns == [('PetID', 'TEXT', 1, 0), ('PetName', 'TEXT', 1, 0), ('Breed', 'TEXT', 1, 0),
+                       ('Age', 'INTEGER', 1, 0), ('HealthStatus', 'TEXT', 1, 0), ('RowVersion', 'INTEGER', 1, 0),
+                       ('UpdatedAt', 'TEXT', 0, 0), ('Status', 'TEXT', 1, 0), ('DeletedAt', 'TEXT', 0, 0),
+                       ('PetKey', 'INTEGER', 0, 1)]
+    conn.execute("INSERT INTO adopters (AdopterID, FirstName, LastName, Contact, Address, City, State, Country) "
+                 "VALUES ('A2', 'Bo', 'Li', 'c', 'a', 'c', 's', 'c')")
+    assert conn.execute("SELECT RowVersion, AdopterKey FROM adopters WHERE AdopterID = 'A2'").fetchone() == (1, 2)
+
+
+def test_migration_that_breaks_foreign_keys_is_rolled_back(baseline, monkeypatch):
+    migrate(baseline)
+    monkeypatch.setattr(schema, 'MIGRATIONS', schema.MIGRATIONS + [["DELETE FROM pets WHERE PetID = 'P1'"]])
+    with pytest.raises(sqlite3.IntegrityError, match='migration %d leaves 1 rows' % len(schema.MIGRATIONS)):
+        migrate(baseline)
+    conn = sqlite3.connect(baseline)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(schema.MIGRATIONS) - 1
+    assert conn.execute("SELECT COUNT(*) FROM pets WHERE PetID = 'P1'").fetchone()[0] == 1
@@ -0,0 +1,49 @@
+from conftest import add_adopter, add_pet
+from search import match_expression, search_table
+
+
+def ids(rows):
+    return [row[0] for row in rows]
+
+
+def test_match_expression_quotes_each_word_as_a_prefix():
+    assert match_expression('golden retr') == '"golden"* "retr"*'
+    assert match_expression('"); DROP') == '"DROP"*'
+    assert match_expression('  ') == ''
+
+
+def test_rows_matching_in_more_columns_rank_first(app, client):
+    add_pet(client, 'P1', PetName='Rex', Breed='Husky')
+    add_pet(client, 'P2', PetName='Husky', Breed='Husky')
+    add_pet(client, 'P3', PetName='Milo', Breed='Corgi')
+    with app.test_request_context():
+        assert ids(search_table('pets', match_expression('husky'), 10)) == ['P2', 'P1']
+        assert ids(search_table('pets', match_expression('husky'), 1)) == ['P2']
+
+
+def test_every_word_must_match_as_a_prefix(app, client):
+    add_pet(client, 'P1', PetName='Goldie', Breed='Golden Retriever')
+    add_pet(client, 'P2', PetName='Rex', Breed='Golden Doodle')
+    with app.test_request_context():
+        assert ids(search_table('pets', match_expression('gold retr'), 10)) == ['P1']
+        assert sorted(ids(search_table('pets', match_expression('gold'), 10))) == ['P1', 'P2']
+
+
+def test_index_follows_edits_and_deletes(app, client):
+    add_pet(client, 'P1', PetName='Biscuit')
+    add_pet(client, 'P2', PetName='Biscotti')
+    client.put('/api/v1/pets/P1', json=dict(PetName='Waffles', Breed='Beagle', Age=2, HealthStatus='Healthy'))
+    client.delete('/api/v1/pets/P2')
+    with app.test_request_context():
+        assert ids(search_table('pets', match_expression('bisc'), 10)) == []
+        assert ids(search_table('pets', match_expression('waffles'), 10)) == ['P1']
+
+
+def test_search_page_lists_pets_and_adopters(client):
+    add_pet(client, 'P1', PetName='Springer')
+    add_adopter(client, 'A1', City='Springfield')
+    add_adopter(client, 'A2', City='Shelbyville')
+    page = client.get('/search?q=spring').get_data(as_text=True)
+    assert '<td>P1</td>' in page
+    assert '<td>A1</td>' in page and '<td>A2</td>' not in page
+    assert 'No matching' not in client.get('/search').get_data(as_text=True)
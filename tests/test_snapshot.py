@@ -0,0 +1,35 @@
+import pytest
+
+from conftest import add_pet
+from snapshot import WROTE_COOKIE, Snapshot
+
+
+def test_backup_copy_is_only_refreshed_after_a_write(app, client, tmp_path):
+    snapshot = Snapshot(app.config['DATABASE'], str(tmp_path / 'copy.db'), interval=3600)
+    try:
+        assert snapshot.version == 1
+        assert snapshot.refresh() == 'unchanged'
+        add_pet(client, 'P1')
+        assert snapshot.refresh() == 'copied'
+        with snapshot.pool.connection() as conn:
+            assert conn.execute('SELECT PetID FROM pets').fetchall() == [('P1',)]
+            with pytest.raises(Exception, match='readonly'):
+                conn.execute("DELETE FROM pets")
+        assert snapshot.stats()['copied'] == 2
+    finally:
+        snapshot.close()
+
+
+@pytest.mark.parametrize('mode', ['backup', 'readonly'])
+def test_list_pages_read_from_the_snapshot(make_app, mode):
+    app = make_app(PET_ADOPTION_SNAPSHOT=mode)
+    client = app.test_client()
+    response = client.get('/pets')
+    assert response.data
+    assert 'X-Snapshot-Age' in response.headers
+    add_pet(client, 'P1', PetName='Fresh')
+    # Whoever just wrote reads live data for a while.
+    assert client.get_cookie(WROTE_COOKIE) is not None
+    response = client.get('/pets')
+    assert b'Fresh' in response.data
+    assert 'X-Snapshot-Age' not in response.headers
@@ -0,0 +1,25 @@
+from conftest import add_pet
+
+
+def test_templates_are_compiled_once(app):
+    env = app.jinja_env
+    assert env.get_template('pets.html') is env.get_template('pets.html')
+    assert env.get_template('base.html') is env.get_template('base.html')
+
+
+def test_list_pages_are_streamed(app, client):
+    add_pet(client, 'P1', PetName='Streamy')
+    with app.test_request_context('/pets'):
+        response = app.full_dispatch_request()
+        assert response.is_streamed
+        body = b''.join(response.response)
+        response.close()
+    assert b'Streamy' in body
+    assert body.count(b'<html') == 1
+
+
+def test_template_digest_follows_the_templates(app):
+    from templating import register_templates
+    digest = app.extensions['template_digest']
+    register_templates(app, {'extra.html': '{% extends "base.html" %}'})
+    assert app.extensions['template_digest'] != digest
@@ -0,0 +1,94 @@
+import sqlite3
+import time
+
+import pytest
+
+from conftest import add_pet
+
+NORTH = {'X-Shelter': 'north'}
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    app = make_app(PET_ADOPTION_TENANT_DIR=str(tmp_path / 'shelters'))
+    for name in ('north', 'south'):
+        app.extensions['tenants'].create(name)
+    return app
+
+
+def count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM pets').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_header_routes_writes_to_the_shelter_database(app, client, tmp_path):
+    add_pet(client, 'P1', headers=NORTH)
+    add_pet(client, 'P2')
+    assert count(str(tmp_path / 'shelters' / 'north.db')) == 1
+    assert count(str(tmp_path / 'shelters' / 'south.db')) == 0
+    assert count(app.config['DATABASE']) == 1
+    assert client.get('/api/v1/pets/P1', headers={'X-Shelter': 'south'}).status_code == 404
+    response = client.get('/api/v1/pets/P1', headers=NORTH)
+    assert response.status_code == 200
+    assert 'X-Shelter' in response.vary
+
+
+def test_unknown_shelter_is_not_found(client):
+    assert client.get('/pets', headers={'X-Shelter': 'nowhere'}).status_code == 404
+    assert client.get('/pets', headers={'X-Shelter': '../pets'}).status_code == 404
+
+
+def test_subdomain_picks_the_shelter(make_app, tmp_path):
+    app = make_app(PET_ADOPTION_TENANT_DIR=str(tmp_path / 'shelters'), PET_ADOPTION_TENANT_DOMAIN='example.org')
+    app.extensions['tenants'].create('north')
+    client = app.test_client()
+    add_pet(client, 'P1', headers=NORTH)
+    assert client.get('/api/v1/pets/P1', base_url='http://north.example.org').status_code == 200
+    assert client.get('/api/v1/pets/P1', base_url='http://example.org').status_code == 404
+
+
+def test_shelter_pages_are_cached_apart(client):
+    add_pet(client, 'P1', PetName='Northpaw', headers=NORTH)
+    add_pet(client, 'P2', PetName='Homebody')
+    north = client.get('/pets', headers=NORTH)
+    assert b'Northpaw' in north.data and b'Homebody' not in north.data
+    home = client.get('/pets')
+    assert b'Homebody' in home.data and b'Northpaw' not in home.data
+    assert north.headers['ETag'] != home.headers['ETag']
+
+
+def test_least_recently_used_shelter_is_closed(app, client):
+    tenants = app.extensions['tenants']
+    tenants.capacity = 1
+    tenants.create('east')
+    assert list(tenants.stats()) == ['east']
+    add_pet(client, 'P1', headers=NORTH)
+    assert list(tenants.stats()) == ['north']
+    assert client.get('/api/v1/pets/P1', headers=NORTH).status_code == 200
+
+
+def job_runs(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT Name, Status FROM job_runs').fetchall()
+    finally:
+        conn.close()
+
+
+def test_shelter_jobs_run_on_the_shelter_database(make_app, tmp_path):
+    app = make_app(PET_ADOPTION_TENANT_DIR=str(tmp_path / 'shelters'), PET_ADOPTION_JOBS='1')
+    app.config['JOBS_POLL_INTERVAL'] = 0.02
+    app.extensions['tenants'].create('north')
+    client = app.test_client()
+    assert b'No job runner' not in client.get('/admin/jobs', headers=NORTH).data
+    client.post('/admin/jobs/maintenance/run', headers=NORTH)
+    north = str(tmp_path / 'shelters' / 'north.db')
+    deadline = time.monotonic() + 5
+    while job_runs(north) != [('maintenance', 'done')] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert job_runs(north) == [('maintenance', 'done')]
+    assert job_runs(app.config['DATABASE']) == []
+    assert b'maintenance' in client.get('/admin/jobs', headers=NORTH).data
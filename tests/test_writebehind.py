@@ -0,0 +1,76 @@
+import sqlite3
+
+import pytest
+
+from db import ConnectionPool
+from schema import init_db
+from writebehind import WriteBehindQueue
+
+INSERT = 'INSERT INTO pets (PetID, PetName, Breed, Age, HealthStatus) VALUES (?, ?, ?, ?, ?)'
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'pets.db')
+    pool = ConnectionPool(path, size=1)
+    init_db(pool)
+    pool.close()
+    return path
+
+
+def insert(pet_id):
+    return lambda conn: conn.execute(INSERT, (pet_id, 'Rex', 'Beagle', 2, 'Healthy')).lastrowid
+
+
+def pet_ids(database):
+    conn = sqlite3.connect(database)
+    try:
+        return [row[0] for row in conn.execute('SELECT PetID FROM pets ORDER BY PetID')]
+    finally:
+        conn.close()
+
+
+def test_failed_write_does_not_take_its_batch_down(database):
+    # A long flush interval puts every write below in the same batch.
+    writer = WriteBehindQueue(database, flush_interval=0.5)
+    for pet_id in ('P1', 'P2', 'P1', 'P3'):
+        writer.submit(insert(pet_id), ('pets',), wait=False)
+    writer.close()
+    assert pet_ids(database) == ['P1', 'P2', 'P3']
+    stats = writer.stats()
+    assert (stats['batches'], stats['committed'], stats['failed']) == (1, 3, 1)
+
+
+def test_waiting_writer_gets_its_own_error(database):
+    writer = WriteBehindQueue(database)
+    try:
+        assert writer.submit(insert('P1'), ('pets',)) is not None
+        with pytest.raises(sqlite3.IntegrityError):
+            writer.submit(insert('P1'), ('pets',))
+        writer.submit(insert('P2'), ('pets',))
+    finally:
+        writer.close()
+    assert pet_ids(database) == ['P1', 'P2']
+
+
+def test_writer_connections_are_made_like_the_request_pool(make_app, tmp_path):
+    app = make_app(PET_ADOPTION_WRITE_BEHIND='1', PET_ADOPTION_ARCHIVE_DB=str(tmp_path / 'archive.db'))
+    writer = app.extensions['write_behind']
+    with writer._pool.connection() as conn:
+        assert isinstance(conn, app.extensions['db_pool'].factory)
+        assert 'archive' in [row[1] for row in conn.execute('PRAGMA database_list')]
+
+
+def test_direct_write_rolls_back_when_work_fails(app):
+    from db import get_db
+    from writebehind import submit_write
+
+    def work(conn):
+        insert('P1')(conn)
+        raise RuntimeError('boom')
+
+    with app.test_request_context('/'):
+        with pytest.raises(RuntimeError):
+            submit_write(work, ('pets',))
+        assert not get_db().in_transaction
+    assert pet_ids(app.config['DATABASE']) == []
@@ -0,0 +1,252 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, jsonify
+
+from cache import namespaced, written
+from db import ConnectionPool, DatabaseBusy, get_db, run_immediate
+
+log = logging.getLogger(__name__)
+
+
+class Write:
+    """One queued unit of work: work(conn) plus the tables it changes."""
+
+    def __init__(self, work, tables, wait):
+        self.work = work
+        self.tables = tables
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event() if wait else None
+        self.result = None
+        self.error = None
+
+
+class WriteBehindQueue:
+    """Bounded queue of writes drained by one writer thread.
+
+    The writer takes whatever is queued (up to batch_size, waiting at most
+    flush_interval for more) and commits it as one BEGIN IMMEDIATE
+    transaction, so a burst of inserts costs one fsync and one trip through
+    SQLite's write lock instead of one per request. Each write runs in its
+    own savepoint: a constraint violation fails that write only.
+    """
+
+    def __init__(self, database, maxsize=10000, batch_size=500, flush_interval=0.002,
+                 busy_timeout=5000, factory=sqlite3.Connection, setup=None, metrics=None, page_cache=None):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.metrics = metrics
+        self.page_cache = page_cache
+        self._pool = ConnectionPool(database, size=1, busy_timeout=busy_timeout, factory=factory, setup=setup)
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._stats = {
+            'enqueued': 0,
+            'rejected': 0,
+            'committed': 0,
+            'failed': 0,
+            'batches': 0,
+            'largest_batch': 0,
+        }
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self._stats[name] += value
+
+    def submit(self, work, tables, wait=True, enqueue_timeout=1.0, ack_timeout=30.0):
+        # wait=True returns work's result (or raises its error) once the batch
+        # holding it has committed; wait=False returns as soon as it is queued.
+        item = Write(work, tables, wait)
+        try:
+            self._queue.put(item, timeout=enqueue_timeout)
+        except queue.Full:
+            self._count(rejected=1)
+            if self.metrics is not None:
+                self.metrics.inc('writes_total', result='rejected')
+            raise DatabaseBusy('write queue is full')
+        self._count(enqueued=1)
+        if not wait:
+            return None
+        if not item.done.wait(ack_timeout):
+            raise DatabaseBusy('write was not committed within %.0f seconds' % ack_timeout)
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._commit(batch)
+            elif self._stopping:
+                return
+
+    def _commit(self, batch):
+        def work(conn):
+            outcomes = []
+            for item in batch:
+                conn.execute('SAVEPOINT write_behind')
+                try:
+                    outcomes.append((item.work(conn), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_behind')
+                    outcomes.append((None, e))
+                conn.execute('RELEASE write_behind')
+            return outcomes
+
+        started = time.perf_counter()
+        try:
+            with self._pool.connection() as conn:
+                outcomes, _ = run_immediate(conn, work)
+        except Exception as e:
+            # The whole batch failed (busy past every retry, disk full...).
+            log.exception('write-behind batch of %d failed', len(batch))
+            outcomes = [(None, e)] * len(batch)
+        committed = time.perf_counter()
+
+        tables, failed = set(), 0
+        for item, (result, error) in zip(batch, outcomes):
+            item.result, item.error = result, error
+            if error is None:
+                tables.update(item.tables)
+            else:
+                failed += 1
+                if item.done is None:
+                    log.warning('write-behind write failed with nobody waiting: %s', error)
+        if tables and self.page_cache is not None:
+            self.page_cache.invalidate(*tables)
+        for item in batch:
+            if item.done is not None:
+                item.done.set()
+
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['committed'] += len(batch) - failed
+            self._stats['failed'] += failed
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+        if self.metrics is not None:
+            self.metrics.inc('write_batches_total')
+            self.metrics.inc('writes_total', len(batch) - failed, result='committed')
+            if failed:
+                self.metrics.inc('writes_total', failed, result='failed')
+            self.metrics.observe('write_commit_seconds', committed - started)
+            for item in batch:
+                self.metrics.observe('write_queue_wait_seconds', started - item.enqueued)
+
+    def close(self, timeout=30.0):
+        # Stop taking batches once the queue is empty, committing what is left.
+        self._stopping = True
+        self._thread.join(timeout)
+        self._pool.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['depth'] = self._queue.qsize()
+        stats['capacity'] = self.maxsize
+        return stats
+
+
+# ---------- FLASK INTEGRATION ----------
+def start_writer(app, pool):
+    # One writer per database: the app's own and each open tenant's. Its
+    # connections are made like those of the request pool it writes for.
+    config = app.config
+    return WriteBehindQueue(pool.database,
+                            maxsize=config['WRITE_BEHIND_QUEUE_SIZE'],
+                            batch_size=config['WRITE_BEHIND_BATCH_SIZE'],
+                            flush_interval=config['WRITE_BEHIND_FLUSH_INTERVAL'],
+                            busy_timeout=config['DB_BUSY_TIMEOUT'],
+                            factory=pool.factory,
+                            setup=pool.setup,
+                            metrics=app.extensions.get('metrics'),
+                            page_cache=app.extensions.get('page_cache'))
+
+
+def init_app(app):
+    app.config.setdefault('WRITE_BEHIND', False)
+    app.config.setdefault('WRITE_BEHIND_ACK', 'commit')
+    app.config.setdefault('WRITE_BEHIND_QUEUE_SIZE', 10000)
+    app.config.setdefault('WRITE_BEHIND_BATCH_SIZE', 500)
+    app.config.setdefault('WRITE_BEHIND_FLUSH_INTERVAL', 0.002)
+    app.config.setdefault('WRITE_BEHIND_ENQUEUE_TIMEOUT', 1.0)
+    app.config.setdefault('WRITE_BEHIND_ACK_TIMEOUT', 30.0)
+    if app.config['WRITE_BEHIND_ACK'] not in ('commit', 'enqueue'):
+        raise ValueError("WRITE_BEHIND_ACK must be 'commit' or 'enqueue'")
+    app.add_url_rule('/admin/writes', 'write_stats', write_stats)
+    if not app.config['WRITE_BEHIND']:
+        return None
+    writer = start_writer(app, app.extensions['db_pool'])
+    app.extensions['write_behind'] = writer
+    atexit.register(writer.close)
+    return writer
+
+
+def get_writer():
+    # A tenant's requests (see tenancy.py) go to that tenant's writer.
+    if 'write_behind' in g:
+        return g.write_behind
+    return current_app.extensions.get('write_behind')
+
+
+def submit_write(work, tables):
+    # Runs work(conn) as a write. With write-behind on it is queued for the
+    # writer thread and acknowledged per WRITE_BEHIND_ACK ('commit' waits for
+    # the batch to commit and returns work's result, 'enqueue' returns None
+    # straight away); otherwise it runs and commits on the request's
+    # connection.
+    writer = get_writer()
+    if writer is None:
+        conn = get_db()
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        return result
+    config = current_app.config
+    return writer.submit(work, namespaced(written(tables)), wait=config['WRITE_BEHIND_ACK'] == 'commit',
+                         enqueue_timeout=config['WRITE_BEHIND_ENQUEUE_TIMEOUT'],
+                         ack_timeout=config['WRITE_BEHIND_ACK_TIMEOUT'])
+
+
+def execute_write(sql, params, tables):
+    return submit_write(lambda conn: conn.execute(sql, params).lastrowid, tables)
+
+
+def write_stats():
+    writer = get_writer()
+    if writer is None:
+        return jsonify(enabled=False)
+    return jsonify(enabled=True, ack=current_app.config['WRITE_BEHIND_ACK'], **writer.stats())